@@ -0,0 +1,61 @@
+r"""Compares the scatter-based :class:`SequenceLinearAttention` to linear
+attention on padded batches for different distributions of set sizes."""
+
+import time
+
+import torch
+
+from torchsupport.structured.scatter import pad, unpad
+from torchsupport.structured.modules.sequence_transformer import SequenceLinearAttention
+
+def padded_forward(module, inputs, index):
+  key = module.key(inputs).view(inputs.size(0), module.heads, module.attention_size)
+  query = module.query(inputs).view(inputs.size(0), module.heads, module.attention_size)
+  value = module.value(inputs).view(inputs.size(0), module.heads, module.hidden_size)
+  key, _, indices, _ = pad(module.sim(key), index)
+  query, _, indices, _ = pad(module.sim(query), index)
+  value, _, indices, _ = pad(value, index)
+  key_value = (key[:, :, :, :, None] * value[:, :, :, None, :]).sum(dim=1)
+  sum_key = key.sum(dim=1)
+  query_key_value = (query[:, :, :, :, None] * key_value[:, None]).sum(dim=3)
+  query_sum_key = (query * sum_key[:, None]).sum(dim=-1).unsqueeze(-1)
+  result = query_key_value / (query_sum_key + 1e-6)
+  result = result.view(*result.shape[:2], -1)
+  return module.out(unpad(result, indices))
+
+def set_sizes(distribution, sets, mean):
+  if distribution == "constant":
+    return torch.full((sets,), mean, dtype=torch.long)
+  if distribution == "uniform":
+    return torch.randint(1, 2 * mean, (sets,))
+  # a few large sets among many small ones:
+  sizes = torch.randint(1, mean // 4 + 2, (sets,))
+  sizes[:max(1, sets // 32)] = 8 * mean
+  return sizes
+
+def timed(function, repeats=5):
+  function()
+  start = time.perf_counter()
+  for _ in range(repeats):
+    function()
+  return (time.perf_counter() - start) / repeats
+
+if __name__ == "__main__":
+  torch.manual_seed(0)
+  module = SequenceLinearAttention(
+    64, 64, hidden_size=32, attention_size=32, heads=4
+  )
+  print(f"{'sizes':>10} {'elements':>9} {'padded':>9} {'scatter':>9}")
+  with torch.no_grad():
+    for distribution in ("constant", "uniform", "long-tail"):
+      sizes = set_sizes(distribution, 256, 64)
+      index = torch.repeat_interleave(torch.arange(sizes.size(0)), sizes)
+      inputs = torch.randn(index.size(0), 64)
+      expected = padded_forward(module, inputs, index)
+      assert torch.allclose(module(inputs, index), expected, atol=1e-4)
+      padded = timed(lambda: padded_forward(module, inputs, index))
+      scatter = timed(lambda: module(inputs, index))
+      print(
+        f"{distribution:>10} {index.size(0):>9} "
+        f"{1000 * padded:>7.1f}ms {1000 * scatter:>7.1f}ms"
+      )
@@ -1,32 +1,265 @@
-class PolygonAnnotation(object):
-  def __init__(self, points):
-    self.points = points
+import numpy as np
+import torch
 
-  def tile_at(self, position, size=(224, 224), origin=(0.5, 0.5)):
-    pass ## TODO
+from torchsupport.data.tiles import TileCache
 
-class SplineAnnotation(object):
-  def __init__(self, points):
-    self.points = points
+class GridIndex(object):
+  r"""Spatial index of axis-aligned bounding boxes on a uniform grid.
 
-  def tile_at(self, position, size=(224, 224), origin=(0.5, 0.5)):
-    pass ## TODO
+  Args:
+    boxes (np.ndarray): boxes `(left, top, right, bottom)` of shape `(N, 4)`.
+    cell_size (float): side length of a grid cell.
+  """
+  def __init__(self, boxes, cell_size=1024):
+    self.boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    self.cell_size = cell_size
+    self.cells = {}
+    lower = np.floor(self.boxes[:, :2] / cell_size).astype(int)
+    upper = np.floor(self.boxes[:, 2:] / cell_size).astype(int)
+    for idx, ((x0, y0), (x1, y1)) in enumerate(zip(lower, upper)):
+      for cx in range(x0, x1 + 1):
+        for cy in range(y0, y1 + 1):
+          self.cells.setdefault((cx, cy), []).append(idx)
 
-class PointSetAnnotation(object):
-  def __init__(self, points):
-    self.points = points
+  def query(self, box):
+    r"""Returns the indices of all boxes intersecting a query box."""
+    left, top, right, bottom = box
+    x0, y0 = int(np.floor(left / self.cell_size)), int(np.floor(top / self.cell_size))
+    x1, y1 = int(np.floor(right / self.cell_size)), int(np.floor(bottom / self.cell_size))
+    candidates = set()
+    for cx in range(x0, x1 + 1):
+      for cy in range(y0, y1 + 1):
+        candidates.update(self.cells.get((cx, cy), ()))
+    candidates = np.array(sorted(candidates), dtype=int)
+    if len(candidates) == 0:
+      return candidates
+    boxes = self.boxes[candidates]
+    hit = (
+      (boxes[:, 0] <= right) & (boxes[:, 2] >= left) &
+      (boxes[:, 1] <= bottom) & (boxes[:, 3] >= top)
+    )
+    return candidates[hit]
 
-  def tile_at(self, position, size=(224, 224), origin=(0.5, 0.5)):
-    pass ## TODO
+def fill_polygons(polygons, origin, shape, downsample=1.0):
+  r"""Rasterizes the union of a set of polygons using a vectorized
+  even-odd scanline fill. A pixel is inside a polygon if its center is.
+
+  Args:
+    polygons (list): arrays of level 0 `(x, y)` vertices of shape `(N, 2)`.
+    origin (tuple): level 0 coordinates of the top left corner of the raster.
+    shape (tuple): height and width of the raster.
+    downsample (float): number of level 0 pixels per raster pixel.
+
+  Returns:
+    Boolean array of shape `(height, width)`.
+  """
+  height, width = shape
+  polygons = [polygon for polygon in polygons if len(polygon) > 2]
+  if not polygons:
+    return np.zeros(shape, dtype=bool)
+  start = np.concatenate(polygons, axis=0)
+  start = (start - np.asarray(origin, dtype=float)) / downsample
+  end = np.concatenate([
+    np.roll(np.arange(len(polygon)), -1) + offset
+    for polygon, offset in zip(
+      polygons, np.cumsum([0] + [len(polygon) for polygon in polygons[:-1]])
+    )
+  ])
+  end = start[end]
+  ids = np.repeat(np.arange(len(polygons)), [len(polygon) for polygon in polygons])
+
+  # an edge crosses all rows with centers in [min(y0, y1), max(y0, y1)).
+  lower = np.minimum(start[:, 1], end[:, 1])
+  upper = np.maximum(start[:, 1], end[:, 1])
+  first = np.clip(np.ceil(lower - 0.5), 0, height).astype(int)
+  last = np.clip(np.ceil(upper - 0.5), 0, height).astype(int)
+  counts = np.maximum(last - first, 0)
+  edges = np.nonzero(counts)[0]
+  counts = counts[edges]
+  if len(edges) == 0:
+    return np.zeros(shape, dtype=bool)
+  edge = np.repeat(edges, counts)
+  row = np.arange(len(edge)) - np.repeat(np.cumsum(counts) - counts, counts)
+  row += np.repeat(first[edges], counts)
+  t = (row + 0.5 - start[edge, 1]) / (end[edge, 1] - start[edge, 1])
+  x = start[edge, 0] + t * (end[edge, 0] - start[edge, 0])
+
+  # each polygon crosses each row an even number of times.
+  order = np.lexsort((x, row, ids[edge]))
+  x, row = x[order], row[order]
+  span_start = np.clip(np.ceil(x[0::2] - 0.5), 0, width).astype(int)
+  span_end = np.clip(np.ceil(x[1::2] - 0.5), 0, width).astype(int)
+  row = row[0::2]
+  valid = span_end > span_start
+  coverage = np.zeros((height, width + 1), dtype=np.int32)
+  np.add.at(coverage, (row[valid], span_start[valid]), 1)
+  np.add.at(coverage, (row[valid], span_end[valid]), -1)
+  return np.cumsum(coverage[:, :width], axis=1) > 0
+
+def fill_points(points, origin, shape, downsample=1.0, radius=0.0):
+  r"""Rasterizes discs around a set of points.
+
+  Args:
+    points (list): arrays of level 0 `(x, y)` coordinates of shape `(N, 2)`.
+    origin (tuple): level 0 coordinates of the top left corner of the raster.
+    shape (tuple): height and width of the raster.
+    downsample (float): number of level 0 pixels per raster pixel.
+    radius (float): disc radius in level 0 pixels. Zero marks single pixels.
+
+  Returns:
+    Boolean array of shape `(height, width)`.
+  """
+  height, width = shape
+  result = np.zeros(shape, dtype=bool)
+  points = [point for point in points if len(point) > 0]
+  if not points:
+    return result
+  pixels = np.floor(
+    (np.concatenate(points, axis=0) - np.asarray(origin, dtype=float)) / downsample
+  ).astype(int)
+  extent = int(np.ceil(radius / downsample))
+  offset = np.arange(-extent, extent + 1)
+  dx, dy = np.meshgrid(offset, offset)
+  disc = (dx ** 2 + dy ** 2) * downsample ** 2 <= radius ** 2
+  columns = (pixels[:, None, 0] + dx[disc][None]).reshape(-1)
+  rows = (pixels[:, None, 1] + dy[disc][None]).reshape(-1)
+  inside = (rows >= 0) & (rows < height) & (columns >= 0) & (columns < width)
+  result[rows[inside], columns[inside]] = True
+  return result
+
+def sample_spline(points, samples=8):
+  r"""Samples a closed Catmull-Rom spline through a set of control points.
+
+  Args:
+    points (np.ndarray): control points of shape `(N, 2)`.
+    samples (int): number of samples per spline segment.
+
+  Returns:
+    Array of polygon vertices of shape `(N * samples, 2)`.
+  """
+  points = np.asarray(points, dtype=float)
+  if len(points) < 3:
+    return points
+  p0, p1 = np.roll(points, 1, axis=0), points
+  p2, p3 = np.roll(points, -1, axis=0), np.roll(points, -2, axis=0)
+  t = (np.arange(samples, dtype=float) / samples)[:, None, None]
+  result = 0.5 * (
+    2 * p1 + (p2 - p0) * t +
+    (2 * p0 - 5 * p1 + 4 * p2 - p3) * t ** 2 +
+    (3 * p1 - p0 - 3 * p2 + p3) * t ** 3
+  )
+  return result.transpose(1, 0, 2).reshape(-1, 2)
+
+def _as_shapes(points):
+  if len(points) > 0 and np.ndim(points[0]) == 1:
+    points = [points]
+  return [
+    np.asarray(shape, dtype=float).reshape(-1, 2)
+    for shape in points
+    if len(shape) > 0
+  ]
+
+class ShapeAnnotation(object):
+  r"""Annotation consisting of a set of shapes, which are rasterized to
+  tiles on demand. Only shapes intersecting a tile, as found using a grid
+  spatial index, are rasterized. Rasterized tiles are cached.
+
+  Args:
+    points (list): shapes, each an array of level 0 `(x, y)` coordinates
+      of shape `(N, 2)`.
+    cache (TileCache): cache for rasterized tiles. Passing the cache of a
+      :class:`torchsupport.data.tiles.TileReader` caches masks alongside
+      image tiles under a common budget.
+    cell_size (float): spatial index cell size in level 0 pixels.
+  """
+  def __init__(self, points, cache=None, cell_size=1024):
+    self.points = _as_shapes(points)
+    self.shapes = self.prepare(self.points)
+    margin = self.margin()
+    boxes = np.array([
+      np.concatenate((shape.min(axis=0) - margin, shape.max(axis=0) + margin))
+      for shape in self.shapes
+    ]).reshape(-1, 4)
+    self.index = GridIndex(boxes, cell_size=cell_size)
+    self.cache = cache if cache is not None else TileCache(64 * 2 ** 20)
+
+  def prepare(self, points):
+    return points
+
+  def margin(self):
+    return 0.0
+
+  def rasterize(self, shapes, origin, shape, downsample):
+    raise NotImplementedError("Abstract.")
+
+  def tile_at(self, position, size=(224, 224), origin=(0.5, 0.5), downsample=1.0):
+    r"""Rasterizes the annotation in a tile.
+
+    Args:
+      position (tuple): level 0 position of the tile.
+      size (tuple): width and height of the tile.
+      origin (tuple): relative location of `position` within the tile.
+      downsample (float): number of level 0 pixels per tile pixel.
+
+    Returns:
+      uint8 tensor of shape `(height, width)`.
+    """
+    left = position[0] - origin[0] * size[0] * downsample
+    top = position[1] - origin[1] * size[1] * downsample
+    key = ("annotation", id(self), left, top, size[0], size[1], downsample)
+    tile = self.cache.get(key)
+    if tile is None:
+      box = (left, top, left + size[0] * downsample, top + size[1] * downsample)
+      shapes = [self.shapes[idx] for idx in self.index.query(box)]
+      mask = self.rasterize(shapes, (left, top), (size[1], size[0]), downsample)
+      tile = torch.from_numpy(mask.astype(np.uint8))
+      self.cache.put(key, tile)
+    return tile
+
+class PolygonAnnotation(ShapeAnnotation):
+  r"""Annotation consisting of a set of polygons."""
+  def rasterize(self, shapes, origin, shape, downsample):
+    return fill_polygons(shapes, origin, shape, downsample=downsample)
+
+class SplineAnnotation(PolygonAnnotation):
+  r"""Annotation consisting of a set of closed splines through control
+  points, rasterized as densely sampled polygons.
+
+  Args:
+    samples (int): number of polygon vertices per spline segment.
+  """
+  def __init__(self, points, cache=None, cell_size=1024, samples=8):
+    self.samples = samples
+    super(SplineAnnotation, self).__init__(points, cache=cache, cell_size=cell_size)
+
+  def prepare(self, points):
+    return [sample_spline(shape, samples=self.samples) for shape in points]
+
+class PointSetAnnotation(ShapeAnnotation):
+  r"""Annotation consisting of sets of points, rasterized as discs.
+
+  Args:
+    radius (float): disc radius in level 0 pixels.
+  """
+  def __init__(self, points, cache=None, cell_size=1024, radius=0.0):
+    self.radius = radius
+    super(PointSetAnnotation, self).__init__(points, cache=cache, cell_size=cell_size)
+
+  def margin(self):
+    return self.radius
+
+  def rasterize(self, shapes, origin, shape, downsample):
+    return fill_points(shapes, origin, shape, downsample=downsample, radius=self.radius)
 
 class CoordinateAnnotation(object):
   def __init__(self, surface_dict):
     self.surface_dict = surface_dict
     self.n_classes = len(self.surface_dict)
 
-  def tile_at(self, position, size=(224, 224), origin=(0.5, 0.5)):
-    to_cat = []
-    for key in self.surface_dict:
-      label_pixels = self.surface_dict[key].tile_at(position, size, origin)
-      to_cat.append(label_pixels.unsqueeze(0))
-    return torch.cat(to_cat, dim=0)
\ No newline at end of file
+  def tile_at(self, position, size=(224, 224), origin=(0.5, 0.5), downsample=1.0):
+    result = torch.zeros(self.n_classes, size[1], size[0], dtype=torch.uint8)
+    for idx, key in enumerate(self.surface_dict):
+      result[idx] = self.surface_dict[key].tile_at(
+        position, size, origin, downsample=downsample
+      )
+    return result
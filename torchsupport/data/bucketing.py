@@ -0,0 +1,137 @@
+import os
+
+import torch
+from torch.utils.data import Sampler
+
+class SizeIndex():
+  r"""Precomputed index of per-item sizes of a dataset, e.g. the number
+  of set elements or graph nodes of each item.
+
+  Args:
+    sizes (list or torch.Tensor): size of each item in the dataset.
+  """
+  def __init__(self, sizes):
+    self.sizes = torch.as_tensor(sizes, dtype=torch.long)
+
+  @classmethod
+  def build(cls, dataset, size=None, path=None):
+    r"""Computes the sizes of all items in a dataset, reusing a cached
+    index at a given path if present.
+
+    Args:
+      dataset (Dataset): dataset to index.
+      size (callable): function mapping an item index to its size. Should
+        avoid loading the full item where possible. Defaults to the
+        length of the first component of each item.
+      path (str): optional path to cache the index at.
+    """
+    if path is not None and os.path.isfile(path):
+      return cls(torch.load(path))
+    if size is None:
+      size = lambda idx: len(dataset[idx][0])
+    result = cls([size(idx) for idx in range(len(dataset))])
+    if path is not None:
+      result.save(path)
+    return result
+
+  def save(self, path):
+    torch.save(self.sizes, path)
+
+  def __len__(self):
+    return self.sizes.size(0)
+
+  def __getitem__(self, idx):
+    return self.sizes[idx]
+
+class BucketBatchSampler(Sampler):
+  r"""Samples batches of items of similar size, such that padding
+  ragged items to the largest item in a batch wastes little compute.
+  Batches either contain a fixed number of items, or as many items as fit
+  into a budget of padded elements. If both limits are given, batches
+  are cut as soon as either is reached.
+
+  Items are shuffled, split into pools of `pool_size` items, sorted by
+  size within each pool and cut into batches. Batch order is shuffled.
+  Smaller pools result in more random batches, larger pools in batches
+  of more uniform size.
+
+  Args:
+    sizes (SizeIndex or list or torch.Tensor): per-item sizes.
+    batch_size (int): number of items per batch.
+    max_size (int): maximum number of padded elements per batch. At least
+      one of `batch_size` and `max_size` needs to be not `None`.
+    pool_size (int): number of items sorted together. Defaults to
+      fifty batches worth of items, or the whole dataset if not shuffling.
+    shuffle (bool): randomize batches in each epoch?
+    drop_last (bool): drop batches with fewer than `batch_size` items at
+      the end of each pool?
+    generator (torch.Generator): optional random number generator.
+  """
+  def __init__(self, sizes, batch_size=None, max_size=None, pool_size=None,
+               shuffle=True, drop_last=False, generator=None):
+    if batch_size is None and max_size is None:
+      raise ValueError("Either `batch_size` or `max_size` needs to be not `None`.")
+    if isinstance(sizes, SizeIndex):
+      sizes = sizes.sizes
+    self.sizes = torch.as_tensor(sizes, dtype=torch.long)
+    self.batch_size = batch_size
+    self.max_size = max_size
+    self.pool_size = pool_size
+    self.shuffle = shuffle
+    self.drop_last = drop_last
+    self.generator = generator
+    self.batches = None
+
+  def _pool_size(self):
+    if self.pool_size is not None:
+      return self.pool_size
+    if not self.shuffle:
+      return len(self.sizes)
+    if self.batch_size is not None:
+      return 50 * self.batch_size
+    average = max(int(self.sizes.float().mean()), 1)
+    return 50 * max(self.max_size // average, 1)
+
+  def _split(self, pool):
+    if self.max_size is None:
+      batches = list(pool.split(self.batch_size))
+    else:
+      batches = []
+      start = 0
+      for position, size in enumerate(self.sizes[pool].tolist()):
+        count = position - start + 1
+        full = self.batch_size is not None and count > self.batch_size
+        if (full or count * size > self.max_size) and position > start:
+          batches.append(pool[start:position])
+          start = position
+      batches.append(pool[start:])
+    if self.drop_last and self.batch_size is not None:
+      if batches and len(batches[-1]) < self.batch_size:
+        batches = batches[:-1]
+    return batches
+
+  def _epoch(self):
+    count = len(self.sizes)
+    if self.shuffle:
+      order = torch.randperm(count, generator=self.generator)
+    else:
+      order = torch.arange(count)
+    pool_size = self._pool_size()
+    batches = []
+    for pool in order.split(pool_size):
+      _, ordering = self.sizes[pool].sort()
+      batches += self._split(pool[ordering])
+    if self.shuffle:
+      permutation = torch.randperm(len(batches), generator=self.generator)
+      batches = [batches[idx] for idx in permutation.tolist()]
+    return [batch.tolist() for batch in batches]
+
+  def __iter__(self):
+    batches = self.batches if self.batches is not None else self._epoch()
+    self.batches = None
+    return iter(batches)
+
+  def __len__(self):
+    if self.batches is None:
+      self.batches = self._epoch()
+    return len(self.batches)
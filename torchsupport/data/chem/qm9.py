@@ -1,12 +1,266 @@
+import os
+import json
+
+import numpy as np
 import torch
-import torch.nn
-import torch.nn.functional as func
 from torch.utils.data import Dataset
 
-import torchsupport.modules.nodegraph as ng
-import torchsupport.data.graph as gdata
+from torchsupport.structured.packedtensor import PackedTensor
+from torchsupport.structured.structures.connection import ScatterStructure
+
+SYMBOLS = [
+  "H", "He", "Li", "Be", "B", "C", "N", "O", "F", "Ne",
+  "Na", "Mg", "Al", "Si", "P", "S", "Cl", "Ar", "K", "Ca",
+  "Sc", "Ti", "V", "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn",
+  "Ga", "Ge", "As", "Se", "Br", "Kr"
+]
+ATOMIC_NUMBERS = {symbol: idx + 1 for idx, symbol in enumerate(SYMBOLS)}
+ATOMIC_NUMBERS["I"] = 53
+
+COVALENT_RADII = {
+  1: 0.31, 5: 0.84, 6: 0.76, 7: 0.71, 8: 0.66, 9: 0.57,
+  14: 1.11, 15: 1.07, 16: 1.05, 17: 1.02, 35: 1.20, 53: 1.39
+}
+
+QM9_PROPERTIES = [
+  "A", "B", "C", "mu", "alpha", "homo", "lumo", "gap",
+  "r2", "zpve", "U0", "U", "H", "G", "Cv"
+]
+
+CACHE_VERSION = 2
+
+def _float(value):
+  return float(value.replace("*^", "e"))
+
+def _molecule(atoms, positions, bonds, properties):
+  return dict(atoms=atoms, positions=positions, bonds=bonds, properties=properties)
+
+def _parse_molblock(lines):
+  counts = lines[3]
+  n_atoms, n_bonds = int(counts[0:3]), int(counts[3:6])
+  atoms, positions = [], []
+  for line in lines[4:4 + n_atoms]:
+    positions.append([_float(line[0:10]), _float(line[10:20]), _float(line[20:30])])
+    atoms.append(ATOMIC_NUMBERS[line[31:34].strip()])
+  bonds = []
+  for line in lines[4 + n_atoms:4 + n_atoms + n_bonds]:
+    bonds.append((int(line[0:3]) - 1, int(line[3:6]) - 1, int(line[6:9])))
+  properties = {}
+  rest = lines[4 + n_atoms + n_bonds:]
+  for idx, line in enumerate(rest[:-1]):
+    if line.startswith(">") and "<" in line:
+      start = line.index("<") + 1
+      properties[line[start:line.index(">", start)]] = rest[idx + 1].strip()
+  return _molecule(atoms, positions, bonds, properties)
+
+def read_sdf(path):
+  r"""Iterates over the molecules of an SDF file. Yields dictionaries of
+  atomic numbers, positions, bonds `(first, second, type)` and data fields."""
+  with open(path) as sdf:
+    block = []
+    for line in sdf:
+      if line.strip() == "$$$$":
+        yield _parse_molblock(block)
+        block = []
+      else:
+        block.append(line.rstrip("\n"))
+    if any(line.strip() for line in block):
+      yield _parse_molblock(block)
+
+def infer_bonds(atoms, positions, tolerance=1.15):
+  r"""Infers single bonds between atoms closer than the sum of their
+  covalent radii times a tolerance factor."""
+  positions = np.asarray(positions, dtype=float)
+  radii = np.array([COVALENT_RADII.get(atom, 0.75) for atom in atoms])
+  distance = np.linalg.norm(positions[:, None] - positions[None, :], axis=-1)
+  bonded = distance < tolerance * (radii[:, None] + radii[None, :])
+  first, second = np.nonzero(np.triu(bonded, k=1))
+  return [(int(i), int(j), 1) for i, j in zip(first, second)]
+
+def read_xyz(path):
+  r"""Iterates over the molecules of an XYZ file containing one or more
+  molecules. QM9-style comment lines (`gdb <id> <properties>`) are parsed
+  into properties and trailing frequency, SMILES and InChI lines skipped.
+  Bonds are inferred from interatomic distances."""
+  with open(path) as xyz:
+    lines = [line.strip() for line in xyz]
+  position = 0
+  while position < len(lines):
+    if not lines[position]:
+      position += 1
+      continue
+    n_atoms = int(lines[position])
+    comment = lines[position + 1].split()
+    atoms, positions = [], []
+    for line in lines[position + 2:position + 2 + n_atoms]:
+      fields = line.split()
+      atoms.append(ATOMIC_NUMBERS[fields[0]])
+      positions.append([_float(value) for value in fields[1:4]])
+    position += 2 + n_atoms
+    properties = {}
+    if comment and comment[0] == "gdb":
+      properties = dict(zip(["index"] + QM9_PROPERTIES, comment[1:]))
+      position += 3
+    yield _molecule(atoms, positions, infer_bonds(atoms, positions), properties)
+
+def read_molecules(path):
+  r"""Iterates over the molecules of an SDF or XYZ file, or of all XYZ
+  files in a directory in lexicographic order."""
+  if os.path.isdir(path):
+    for name in sorted(os.listdir(path)):
+      if name.endswith(".xyz"):
+        yield from read_xyz(os.path.join(path, name))
+  elif path.endswith(".sdf"):
+    yield from read_sdf(path)
+  else:
+    yield from read_xyz(path)
+
+def _read_properties(path):
+  with open(path) as csv:
+    header = csv.readline().strip().split(",")
+    for line in csv:
+      if line.strip():
+        yield dict(zip(header, line.strip().split(",")))
 
 class QM9(Dataset):
-  def __init__(self):
-    # self.data = 
+  r"""Dataset of molecular graphs with scalar targets, such as QM9.
+  Molecules are parsed from a local SDF or XYZ source once and written to
+  a binary cache of packed atom, position and bond arrays with per-molecule
+  offsets. The cache is memory-mapped, such that loading a molecule only
+  slices these arrays.
+
+  Each item consists of the inputs `(atoms, positions, structure)` and a
+  tensor of targets, where `atoms` is a :class:`PackedTensor` of one-hot
+  element features, `positions` a :class:`PackedTensor` of atom
+  coordinates and `structure` a :class:`ScatterStructure` of bonds in
+  both directions.
+
+  Args:
+    path (str): path to an SDF or XYZ file, or a directory of XYZ files.
+    targets (list): names of properties to predict. Defaults to the QM9
+      properties present in the source.
+    properties (str): optional CSV file of per-molecule properties in
+      source order, e.g. the `gdb9.sdf.csv` file accompanying QM9.
+    elements (list): atomic numbers of elements encoded in atom features.
+    cache (str): cache directory. Defaults to `path + ".cache"`.
+    bond_types (bool): add a :class:`PackedTensor` of one-hot bond types
+      (single, double, triple, aromatic) to the inputs?
+  """
+  def __init__(self, path, targets=None, properties=None, elements=(1, 6, 7, 8, 9),
+               cache=None, bond_types=False):
+    self.path = path
+    self.elements = list(elements)
+    self.bond_types = bond_types
+    self.cache = cache or path.rstrip("/") + ".cache"
+    if not self._cache_valid(targets, properties):
+      self._build_cache(targets, properties)
+    self._load_cache()
+    self.element_index = -torch.ones(max(self.elements + [1]) + 1, dtype=torch.long)
+    self.element_index[torch.tensor(self.elements, dtype=torch.long)] = torch.arange(
+      len(self.elements)
+    )
+
+  def _source_stamp(self, path=None):
+    stat = os.stat(path or self.path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+  def _properties_stamp(self, properties):
+    if properties is None:
+      return None
+    return self._source_stamp(properties)
+
+  def _cache_valid(self, targets, properties):
+    meta_path = os.path.join(self.cache, "meta.json")
+    if not os.path.isfile(meta_path):
+      return False
+    with open(meta_path) as meta_file:
+      meta = json.load(meta_file)
+    return (
+      meta["version"] == CACHE_VERSION and
+      meta["source"] == self._source_stamp() and
+      meta["properties"] == self._properties_stamp(properties) and
+      (targets is None or meta["targets"] == list(targets))
+    )
+
+  def _build_cache(self, targets, properties):
+    molecules = list(read_molecules(self.path))
+    if properties is not None:
+      for molecule, values in zip(molecules, _read_properties(properties)):
+        molecule["properties"].update(values)
+    if targets is None:
+      available = molecules[0]["properties"] if molecules else {}
+      targets = [name for name in QM9_PROPERTIES if name in available]
+
+    atom_offsets = np.zeros(len(molecules) + 1, dtype=np.int64)
+    bond_offsets = np.zeros(len(molecules) + 1, dtype=np.int64)
+    atoms, positions, edges, edge_types = [], [], [], []
+    values = np.full((len(molecules), len(targets)), np.nan, dtype=np.float32)
+    for idx, molecule in enumerate(molecules):
+      atoms.append(np.asarray(molecule["atoms"], dtype=np.int64))
+      positions.append(np.asarray(molecule["positions"], dtype=np.float32).reshape(-1, 3))
+      bonds = np.asarray(molecule["bonds"], dtype=np.int64).reshape(-1, 3)
+      edges.append(np.concatenate((bonds[:, :2], bonds[:, 1::-1]), axis=0))
+      edge_types.append(np.concatenate((bonds[:, 2], bonds[:, 2]), axis=0))
+      atom_offsets[idx + 1] = atom_offsets[idx] + len(molecule["atoms"])
+      bond_offsets[idx + 1] = bond_offsets[idx] + 2 * len(bonds)
+      for column, name in enumerate(targets):
+        if name in molecule["properties"]:
+          values[idx, column] = _float(molecule["properties"][name])
+
+    os.makedirs(self.cache, exist_ok=True)
+    arrays = dict(
+      atoms=np.concatenate(atoms) if atoms else np.zeros(0, dtype=np.int64),
+      positions=np.concatenate(positions) if positions else np.zeros((0, 3), dtype=np.float32),
+      edges=np.concatenate(edges) if edges else np.zeros((0, 2), dtype=np.int64),
+      edge_types=np.concatenate(edge_types) if edge_types else np.zeros(0, dtype=np.int64),
+      atom_offsets=atom_offsets, bond_offsets=bond_offsets, targets=values
+    )
+    for name, array in arrays.items():
+      np.save(os.path.join(self.cache, f"{name}.npy"), array)
+    with open(os.path.join(self.cache, "meta.json"), "w") as meta_file:
+      json.dump(dict(
+        version=CACHE_VERSION, source=self._source_stamp(),
+        properties=self._properties_stamp(properties),
+        targets=list(targets)
+      ), meta_file)
+
+  def _load_cache(self):
+    def _load(name):
+      return np.load(os.path.join(self.cache, f"{name}.npy"), mmap_mode="r")
+    with open(os.path.join(self.cache, "meta.json")) as meta_file:
+      self.targets = json.load(meta_file)["targets"]
+    self.atoms = _load("atoms")
+    self.positions = _load("positions")
+    self.edges = _load("edges")
+    self.edge_types = _load("edge_types")
+    self.atom_offsets = np.load(os.path.join(self.cache, "atom_offsets.npy"))
+    self.bond_offsets = np.load(os.path.join(self.cache, "bond_offsets.npy"))
+    self.values = np.load(os.path.join(self.cache, "targets.npy"))
+
+  def __len__(self):
+    return len(self.atom_offsets) - 1
+
+  def __getitem__(self, idx):
+    atom_start, atom_stop = self.atom_offsets[idx], self.atom_offsets[idx + 1]
+    bond_start, bond_stop = self.bond_offsets[idx], self.bond_offsets[idx + 1]
+    atoms = torch.from_numpy(np.array(self.atoms[atom_start:atom_stop]))
+    positions = torch.from_numpy(np.array(self.positions[atom_start:atom_stop]))
+    edges = torch.from_numpy(np.array(self.edges[bond_start:bond_stop]))
 
+    element = self.element_index[atoms.clamp(max=self.element_index.size(0) - 1)]
+    element[atoms >= self.element_index.size(0)] = -1
+    features = torch.zeros(atoms.size(0), len(self.elements))
+    known = element >= 0
+    features[known.nonzero().view(-1), element[known]] = 1
+    structure = ScatterStructure(
+      "atoms", "atoms", edges[:, 1], edges[:, 0],
+      node_count=atoms.size(0)
+    )
+    inputs = [PackedTensor(features), PackedTensor(positions), structure]
+    if self.bond_types:
+      edge_types = torch.from_numpy(np.array(self.edge_types[bond_start:bond_stop]))
+      bond_features = torch.zeros(edge_types.size(0), 4)
+      bond_features[torch.arange(edge_types.size(0)), (edge_types - 1).clamp(0, 3)] = 1
+      inputs.append(PackedTensor(bond_features))
+    targets = torch.from_numpy(self.values[idx].copy())
+    return tuple(inputs), targets
@@ -74,6 +74,9 @@ def DataLoader(dataset, batch_size=1, shuffle=False, sampler=None,
                batch_sampler=None, num_workers=0, collate_fn=default_collate,
                pin_memory=False, drop_last=False, timeout=0,
                worker_init_fn=None):
+  if batch_sampler is not None:
+    # batch samplers determine batch size, order and dropping on their own.
+    batch_size, shuffle, sampler, drop_last = 1, False, None, False
   return TorchDataLoader(dataset, batch_size=batch_size, shuffle=shuffle,
                          sampler=sampler, batch_sampler=batch_sampler,
                          num_workers=num_workers, collate_fn=collate_fn,
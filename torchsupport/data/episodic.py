@@ -1,3 +1,5 @@
+import os
+import hashlib
 import torch
 import random
 # import pandas as pd
@@ -7,44 +9,197 @@ if True:
   from torch.utils.data.sampler import Sampler, SubsetRandomSampler
 else:
   from torch.utils.data import Sampler, SubsetRandomSampler
-import os
+
+def _fingerprint(dataset):
+  result = [len(dataset)]
+  if hasattr(dataset, "labels"):
+    labels = torch.as_tensor(dataset.labels, dtype=torch.long)
+    result.append(hashlib.sha1(labels.numpy().tobytes()).hexdigest())
+  else:
+    for name in ("path", "root"):
+      path = getattr(dataset, name, None)
+      if isinstance(path, str) and os.path.exists(path):
+        stat = os.stat(path)
+        result += [stat.st_size, stat.st_mtime_ns]
+        break
+  return tuple(result)
+
+class LabelIndex():
+  r"""Precomputed index of the labels of a dataset, grouping item
+  indices by label for fast episode sampling.
+
+  Args:
+    labels (list or torch.Tensor): integer label of each item in a dataset.
+  """
+  def __init__(self, labels):
+    self.labels = torch.as_tensor(labels, dtype=torch.long)
+    self.classes, self.counts = self.labels.unique(return_counts=True)
+    _, self.order = self.labels.sort()
+    self.offsets = self.counts.cumsum(dim=0) - self.counts
+
+  @classmethod
+  def build(cls, dataset, label=None, path=None, fingerprint=None):
+    r"""Builds a label index for a dataset, reusing a cached index
+    at a given path if present.
+
+    Args:
+      dataset (Dataset): dataset to index.
+      label (callable): function mapping an item index to its label.
+        Should avoid loading the full item where possible. Defaults to
+        the `labels` attribute of the dataset if present, otherwise the
+        second component of each item.
+      path (str): optional path to cache the index at. A cached index is
+        rebuilt if its fingerprint does not match the dataset.
+      fingerprint (object): optional fingerprint identifying the dataset's
+        labels. Defaults to the dataset length together with a hash of its
+        `labels` attribute if present, otherwise with the size and
+        modification time of its `path` or `root` attribute if present.
+    """
+    if fingerprint is None:
+      fingerprint = _fingerprint(dataset)
+    if path is not None and os.path.isfile(path):
+      cached = torch.load(path)
+      if isinstance(cached, dict) and cached.get("fingerprint") == fingerprint:
+        return cls(cached["labels"])
+    if label is None and hasattr(dataset, "labels"):
+      result = cls(dataset.labels)
+    else:
+      if label is None:
+        label = lambda idx: int(dataset[idx][1])
+      result = cls([label(idx) for idx in range(len(dataset))])
+    if path is not None:
+      result.save(path, fingerprint=fingerprint)
+    return result
+
+  def save(self, path, fingerprint=None):
+    torch.save(dict(labels=self.labels, fingerprint=fingerprint), path)
+
+  def check(self, shots, classes=None):
+    r"""Checks that classes contain at least a given number of items,
+    raising a `ValueError` naming all classes which do not.
+
+    Args:
+      shots (int): required number of items per class.
+      classes (torch.Tensor): positions of classes in the index. Defaults
+        to all classes.
+    """
+    if classes is None:
+      classes = torch.arange(self.classes.size(0))
+    small = classes[self.counts[classes] < shots]
+    if small.size(0) > 0:
+      raise ValueError(
+        f"Classes {self.classes[small].tolist()} have fewer than "
+        f"{shots} items."
+      )
+
+  def __len__(self):
+    return self.classes.size(0)
+
+  def sample(self, classes, shots, generator=None):
+    r"""Samples item indices for a set of classes without replacement.
+
+    Args:
+      classes (torch.Tensor): positions of classes in the index.
+      shots (int): number of items per class.
+      generator (torch.Generator): optional random number generator.
+
+    Returns:
+      Tensor of item indices of shape `(len(classes), shots)`.
+    """
+    self.check(shots, classes)
+    counts = self.counts[classes]
+    noise = torch.rand(classes.size(0), int(counts.max()), generator=generator)
+    invalid = torch.arange(noise.size(1))[None, :] >= counts[:, None]
+    noise[invalid] = 2.0
+    positions = noise.topk(shots, dim=1, largest=False).indices
+    return self.order[self.offsets[classes, None] + positions]
+
+class EpisodeSampler(Sampler):
+  r"""Batch sampler emitting N-way K-shot episodes. Each batch contains
+  `ways * shots` support items followed by `ways * queries` query items,
+  both ordered by episode class. Episode labels can be recovered using
+  :func:`split_episode`.
+
+  Args:
+    index (LabelIndex): label index of the sampled dataset.
+    ways (int): number of classes per episode.
+    shots (int): number of support items per class.
+    queries (int): number of query items per class.
+    episodes (int): number of episodes per epoch.
+    generator (torch.Generator): optional random number generator.
+  """
+  def __init__(self, index, ways=3, shots=5, queries=0,
+               episodes=1000, generator=None):
+    self.index = index
+    self.ways = ways
+    self.shots = shots
+    self.queries = queries
+    self.episodes = episodes
+    self.generator = generator
+    self.eligible = (index.counts >= shots + queries).nonzero().view(-1)
+    if self.eligible.size(0) < ways:
+      raise ValueError(
+        f"Only {self.eligible.size(0)} classes have at least {shots + queries} "
+        f"items, cannot sample {ways}-way episodes."
+      )
+
+  def __iter__(self):
+    for _ in range(self.episodes):
+      permutation = torch.randperm(self.eligible.size(0), generator=self.generator)
+      classes = self.eligible[permutation[:self.ways]]
+      indices = self.index.sample(
+        classes, self.shots + self.queries,
+        generator=self.generator
+      )
+      support = indices[:, :self.shots].reshape(-1)
+      query = indices[:, self.shots:].reshape(-1)
+      yield torch.cat((support, query), dim=0).tolist()
+
+  def __len__(self):
+    return self.episodes
+
+def split_episode(data, ways, shots, queries=0):
+  r"""Splits a batch sampled by :class:`EpisodeSampler` into support and
+  query items and computes their episode labels.
+
+  Args:
+    data (torch.Tensor): batched episode data.
+    ways (int): number of classes per episode.
+    shots (int): number of support items per class.
+    queries (int): number of query items per class.
+
+  Returns:
+    Support data, support labels, query data and query labels.
+  """
+  support = data[:ways * shots]
+  query = data[ways * shots:]
+  labels = torch.arange(ways, device=data.device)
+  support_labels = labels.repeat_interleave(shots)
+  query_labels = labels.repeat_interleave(queries)
+  return support, support_labels, query, query_labels
 
 class SupportData(Dataset):
-  def __init__(self, dataset, ways=3, shots=5, key=lambda x: int(x[1])):
+  def __init__(self, dataset, ways=3, shots=5, key=lambda x: int(x[1]),
+               label=None, path=None):
     self.shots = shots
     self.ways = ways
-    self.index_lists = {}
-    for idx, point in enumerate(dataset):
-      label = key(point)
-      if label not in self.index_lists:
-        self.index_lists[label] = []
-      self.index_lists[label].append(idx)
-    self.index_lists = [
-      self.index_lists[label]
-      for label in range(self.ways)
-    ]
-    print(self.index_lists)
+    if label is None:
+      label = lambda idx: key(dataset[idx])
+    self.index = LabelIndex.build(dataset, label=label, path=path)
+    self.index.check(shots, torch.arange(ways))
     self.dataset = dataset
 
   def __getitem__(self, idx):
-    support_shots = []
-    support_labels = []
-    for label, indices in enumerate(self.index_lists):
-      support_indices = random.sample(indices, self.shots)
-      print(support_indices)
-      support_subset = [
-        self.dataset[index][0].unsqueeze(0)
-        for index in support_indices
-      ]
-      support_subset = torch.cat(support_subset)
-      support_label = torch.LongTensor([[[[label]]] for idx in range(self.shots)])
-      support_shots.append(support_subset)
-      support_labels.append(support_label)
-    support_shots = torch.cat(support_shots, dim=0)
-    support_labels = torch.cat(support_labels, dim=0)
+    classes = torch.arange(self.ways)
+    support_indices = self.index.sample(classes, self.shots).view(-1)
+    support_shots = torch.cat([
+      self.dataset[index][0].unsqueeze(0)
+      for index in support_indices.tolist()
+    ], dim=0)
+    support_labels = classes.repeat_interleave(self.shots)
+    support_labels = support_labels.view(-1, 1, 1, 1)
     return support_shots, support_labels
 
-
   def __len__(self):
     return 1000000000000
 
@@ -0,0 +1,324 @@
+import os
+import json
+
+import numpy as np
+import torch
+
+from torchsupport.structured.structures.connection import (
+  ScatterStructure, ConnectionStructure
+)
+
+class LazyNodes(object):
+  r"""Memory-mapped node feature array stored as a `.npy` file. Rows are
+  only read from disk when materialized.
+
+  Args:
+    path (str): path to the node feature file.
+  """
+  def __init__(self, path):
+    self.path = path
+    self.data = np.load(path, mmap_mode="r")
+
+  @classmethod
+  def write(cls, path, features):
+    r"""Writes node features of shape `(nodes, ...)` to disk."""
+    with open(path, "wb") as node_file:
+      np.save(node_file, np.ascontiguousarray(features))
+    return cls(path)
+
+  def __len__(self):
+    return self.data.shape[0]
+
+  def materialize(self, nodes=None):
+    r"""Reads the features of a set of nodes.
+
+    Args:
+      nodes (array): node indices. Defaults to all nodes.
+
+    Returns:
+      Tensor of node features of shape `(len(nodes), ...)`.
+    """
+    if nodes is None:
+      return torch.from_numpy(np.array(self.data))
+    nodes = np.asarray(nodes, dtype=np.int64)
+    return torch.from_numpy(np.ascontiguousarray(self.data[nodes]))
+
+class LazyAdjacency(object):
+  r"""Memory-mapped adjacency of a single edge type in compressed sparse
+  row (CSR) format. Row `i` lists the source nodes of all edges into
+  target node `i`, following the convention of
+  :class:`torchsupport.structured.ConnectionStructure`.
+
+  An adjacency is stored as a directory containing the row pointer array
+  `rows.npy`, the column array `columns.npy` and a `meta.json` file
+  holding source and target node types.
+
+  Args:
+    path (str): path to the adjacency directory.
+  """
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, "meta.json")) as meta_file:
+      meta = json.load(meta_file)
+    self.source = meta["source"]
+    self.target = meta["target"]
+    self.rows = np.load(os.path.join(path, "rows.npy"), mmap_mode="r")
+    self.columns = np.load(os.path.join(path, "columns.npy"), mmap_mode="r")
+
+  @classmethod
+  def write(cls, path, rows, columns, source="nodes", target="nodes"):
+    r"""Writes a CSR adjacency to disk.
+
+    Args:
+      path (str): path to the adjacency directory.
+      rows (array): row pointers of shape `(targets + 1,)`.
+      columns (array): source node of each edge, grouped by target node.
+      source (str): source node type.
+      target (str): target node type.
+    """
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "rows.npy"), np.asarray(rows, dtype=np.int64))
+    np.save(os.path.join(path, "columns.npy"), np.asarray(columns, dtype=np.int64))
+    with open(os.path.join(path, "meta.json"), "w") as meta_file:
+      json.dump(dict(source=source, target=target), meta_file)
+    return cls(path)
+
+  @classmethod
+  def from_edges(cls, path, edges, node_count, source="nodes", target="nodes",
+                 directed=False):
+    r"""Writes an adjacency given as a list of `(source, target)` edges.
+
+    Args:
+      path (str): path to the adjacency directory.
+      edges (array): edges of shape `(E, 2)`.
+      node_count (int): number of target nodes.
+      source (str): source node type.
+      target (str): target node type.
+      directed (bool): if False, every edge is stored in both directions.
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    sources, targets = edges[:, 0], edges[:, 1]
+    if not directed:
+      sources, targets = (
+        np.concatenate((sources, targets)),
+        np.concatenate((targets, sources))
+      )
+    order = np.argsort(targets, kind="stable")
+    rows = np.zeros(node_count + 1, dtype=np.int64)
+    rows[1:] = np.cumsum(np.bincount(targets, minlength=node_count))
+    return cls.write(path, rows, sources[order], source=source, target=target)
+
+  def __len__(self):
+    return self.rows.shape[0] - 1
+
+  @property
+  def edge_count(self):
+    return self.columns.shape[0]
+
+  def neighbours(self, nodes):
+    r"""Reads the incoming edges of a set of target nodes.
+
+    Args:
+      nodes (array): target node indices.
+
+    Returns:
+      Position of the target node of each edge within `nodes`, and
+      the source node index of each edge.
+    """
+    nodes = np.asarray(nodes, dtype=np.int64)
+    starts = np.asarray(self.rows[nodes])
+    counts = np.asarray(self.rows[nodes + 1]) - starts
+    total = int(counts.sum())
+    targets = np.repeat(np.arange(len(nodes)), counts)
+    offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    positions = offsets + np.arange(total)
+    return targets, np.asarray(self.columns[positions])
+
+  def subgraph(self, targets, sources=None):
+    r"""Materializes the subgraph induced by a set of nodes.
+
+    Args:
+      targets (array): sorted, unique target node indices.
+      sources (array): sorted, unique source node indices. Defaults to
+        `targets`.
+
+    Returns:
+      :class:`ScatterStructure` relabeled to positions within `targets`
+      and `sources`.
+    """
+    targets = np.asarray(targets, dtype=np.int64)
+    sources = targets if sources is None else np.asarray(sources, dtype=np.int64)
+    indices, connections = self.neighbours(targets)
+    positions = np.searchsorted(sources, connections)
+    keep = positions < len(sources)
+    keep[keep] = sources[positions[keep]] == connections[keep]
+    return ScatterStructure(
+      self.source, self.target,
+      torch.from_numpy(indices[keep]),
+      torch.from_numpy(positions[keep]),
+      node_count=len(targets)
+    )
+
+def k_hop(adjacencies, start_nodes, depth=1):
+  r"""Computes all nodes reachable within `depth` hops along incoming
+  edges by vectorized frontier expansion.
+
+  Args:
+    adjacencies (list): :class:`LazyAdjacency` of each edge type.
+    start_nodes (dict): start node indices per node type.
+    depth (int): number of hops.
+
+  Returns:
+    Dictionary of sorted, unique reachable node indices per node type.
+  """
+  visited = {
+    typ: np.unique(np.asarray(nodes, dtype=np.int64))
+    for typ, nodes in start_nodes.items()
+  }
+  frontier = dict(visited)
+  for _ in range(depth):
+    found = {}
+    for adjacency in adjacencies:
+      if len(frontier.get(adjacency.target, ())) > 0:
+        _, sources = adjacency.neighbours(frontier[adjacency.target])
+        found.setdefault(adjacency.source, []).append(sources)
+    frontier = {}
+    for typ, nodes in found.items():
+      nodes = np.unique(np.concatenate(nodes))
+      known = visited.get(typ, np.zeros(0, dtype=np.int64))
+      new = np.setdiff1d(nodes, known, assume_unique=True)
+      if len(new) > 0:
+        visited[typ] = np.union1d(known, new)
+        frontier[typ] = new
+    if not frontier:
+      break
+  return visited
+
+def _csr_arrays(adjacency):
+  if isinstance(adjacency, ConnectionStructure):
+    return adjacency.rows.cpu().numpy(), adjacency.columns.cpu().numpy()
+  if isinstance(adjacency, ScatterStructure):
+    indices = adjacency.indices.cpu().numpy()
+    order = np.argsort(indices, kind="stable")
+    rows = np.zeros(int(adjacency.node_count) + 1, dtype=np.int64)
+    rows[1:] = np.cumsum(np.bincount(indices, minlength=int(adjacency.node_count)))
+    return rows, adjacency.connections.cpu().numpy()[order]
+  return adjacency.rows, adjacency.columns
+
+class NeighbourSampler(object):
+  r"""Samples the computation graph of a stack of message passing layers
+  around a mini-batch of seed nodes, GraphSAGE-style. Starting from the
+  seeds, each layer draws at most a fixed number of incoming neighbours
+  per node, without a Python loop over nodes.
+
+  Every layer is represented by a bipartite :class:`ScatterStructure`
+  block, whose target nodes are a prefix of its source nodes. The source
+  nodes of one block are the target nodes of the block before it, such
+  that an unchanged stack of :class:`ConnectedModule` layers runs as::
+
+    nodes, blocks = sampler.sample(seeds)
+    out = features[nodes]
+    for layer, block in zip(layers, blocks):
+      out = layer(out, out[:block.node_count], block)
+
+  after which the rows of `out` correspond to the seeds.
+
+  Args:
+    adjacency (LazyAdjacency or AbstractStructure): graph to sample from,
+      given as a :class:`LazyAdjacency`, a :class:`ConnectionStructure`
+      or a :class:`ScatterStructure` with a single node type.
+    fanouts (list): maximum number of neighbours per node for each layer,
+      from the input layer to the output layer. `None` keeps all
+      neighbours.
+    replace (bool): sample neighbours with replacement? This draws
+      exactly `fanout` neighbours for each node with a nonempty
+      neighbourhood and avoids reading the full neighbourhood.
+  """
+  def __init__(self, adjacency, fanouts, replace=False):
+    self.rows, self.columns = _csr_arrays(adjacency)
+    self.source = adjacency.source
+    self.target = adjacency.target
+    self.fanouts = list(fanouts)
+    self.replace = replace
+
+  def neighbours(self, nodes, fanout=None):
+    r"""Samples the incoming edges of a set of target nodes.
+
+    Args:
+      nodes (array): target node indices.
+      fanout (int): maximum number of edges per node.
+
+    Returns:
+      Position of the target node of each edge within `nodes`, and
+      the source node index of each edge.
+    """
+    nodes = np.asarray(nodes, dtype=np.int64)
+    starts = np.asarray(self.rows[nodes])
+    counts = np.asarray(self.rows[nodes + 1]) - starts
+    if fanout is not None and self.replace:
+      filled = counts > 0
+      targets = np.repeat(np.arange(len(nodes))[filled], fanout)
+      offsets = torch.rand(len(targets), dtype=torch.float64).numpy()
+      offsets = (offsets * np.repeat(counts[filled], fanout)).astype(np.int64)
+      positions = np.repeat(starts[filled], fanout) + offsets
+      return targets, np.asarray(self.columns[positions])
+    total = int(counts.sum())
+    first = np.cumsum(counts) - counts
+    targets = np.repeat(np.arange(len(nodes)), counts)
+    positions = np.repeat(starts - first, counts) + np.arange(total)
+    if fanout is not None and total > 0:
+      # keep the `fanout` edges of lowest random key per node:
+      keys = torch.rand(total).numpy()
+      order = np.lexsort((keys, targets))
+      rank = np.arange(total) - np.repeat(first, counts)
+      keep = order[rank < fanout]
+      targets, positions = targets[keep], positions[keep]
+    return targets, np.asarray(self.columns[positions])
+
+  def block(self, nodes, fanout=None):
+    r"""Samples a single bipartite block into a set of target nodes.
+
+    Args:
+      nodes (array): unique target node indices.
+      fanout (int): maximum number of neighbours per node.
+
+    Returns:
+      Source node indices, starting with `nodes`, and a
+      :class:`ScatterStructure` connecting positions within the source
+      nodes to positions within `nodes`.
+    """
+    nodes = np.asarray(nodes, dtype=np.int64)
+    indices, connections = self.neighbours(nodes, fanout)
+    new = np.setdiff1d(connections, nodes)
+    sources = np.concatenate((nodes, new))
+    order = np.argsort(sources, kind="stable")
+    connections = order[np.searchsorted(sources[order], connections)]
+    structure = ScatterStructure(
+      self.source, self.target,
+      torch.from_numpy(indices),
+      torch.from_numpy(connections),
+      node_count=len(nodes)
+    )
+    structure.prepare_segments()
+    return sources, structure
+
+  def sample(self, seeds):
+    r"""Samples the blocks of all layers around a set of seed nodes.
+
+    Args:
+      seeds (array): seed node indices. Duplicates are removed, keeping
+        the first occurrence.
+
+    Returns:
+      Input node indices, starting with the seeds, and the list of blocks
+      from the input layer to the output layer.
+    """
+    seeds = np.asarray(seeds, dtype=np.int64).reshape(-1)
+    _, first = np.unique(seeds, return_index=True)
+    nodes = seeds[np.sort(first)]
+    blocks = []
+    for fanout in reversed(self.fanouts):
+      nodes, block = self.block(nodes, fanout)
+      blocks.append(block)
+    blocks.reverse()
+    return nodes, blocks
@@ -7,7 +7,7 @@ import numpy as np
 import time
 
 from torchsupport.data.tensor_provider import TensorProvider
-from torchsupport.data.namedtuple import NamedTuple
+from torchsupport.data.namedtuple import Record
 
 import os
 
@@ -116,7 +116,7 @@ class Detachable():
 def to_device(data, device):
   if isinstance(data, torch.Tensor):
     return data.to(device)
-  if isinstance(data, NamedTuple):
+  if isinstance(data, Record):
     typ = type(data)
     dict_val = to_device(data.asdict(), device)
     return typ(**dict_val)
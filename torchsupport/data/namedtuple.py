@@ -1,67 +1,204 @@
 """Pickle-safe faux namedtuple action."""
 
-from copy import copy
-
 from collections import OrderedDict
 
-class CheckArgs:
-  def __init__(self, name, args):
-    self.name = name
-    self.fields = args
-    self.sfields = sorted(args)
-
-  def __call__(self, **kwargs):
-    skeys = sorted(list(kwargs.keys()))
-    if skeys != self.sfields:
-      raise ValueError
-    result = NamedTuple(**kwargs)
-    return result
+import torch
 
-class NamedTuple:
-  def __init__(self, **kwargs):
-    self.dict = OrderedDict(**kwargs)
-    self.fields = list(self.dict.keys())
+_RECORD_TYPES = {}
 
-  def asdict(self):
-    return self.dict
+def _rebuild(kind, name, fields, values):
+  result = _record_type(name, fields)
+  if kind == "batch":
+    result = result.Batch
+  return result(*values)
 
-  def __repr__(self):
-    keyvals = [
-      f"{key}={self.dict[key]}"
-      for key in self.dict
-    ]
-    keyvals = ", ".join(keyvals)
-    result = f"NamedTuple({keyvals})"
-    return result
+class Record:
+  r"""Base class of generated record types, which store each field in
+  a slot. Instances pickle by schema, such that generated types need not
+  be importable by name."""
+  __slots__ = ()
+  _fields = ()
+  _name = "Record"
+  _kind = "record"
 
-  def __getattr__(self, name):
-    result = ...
-    if name in super().__getattribute__("fields"):
-      result = super().__getattribute__("dict")[name]
-    else:
-      raise AttributeError
-    return result
+  def __init__(self, *args, **kwargs):
+    if len(args) > len(self._fields):
+      raise ValueError(
+        f"{self._name} expects {len(self._fields)} fields, got {len(args)} values."
+      )
+    if args:
+      kwargs = dict(zip(self._fields, args), **kwargs)
+    if len(kwargs) != len(self._fields):
+      raise ValueError(
+        f"{self._name} expects fields {list(self._fields)}, "
+        f"got {sorted(kwargs)}."
+      )
+    try:
+      for field in self._fields:
+        setattr(self, field, kwargs[field])
+    except KeyError:
+      raise ValueError(
+        f"{self._name} expects fields {list(self._fields)}, "
+        f"got {sorted(kwargs)}."
+      )
+
+  def asdict(self):
+    return OrderedDict(
+      (field, getattr(self, field))
+      for field in self._fields
+    )
 
   def replace(self, **kwargs):
-    result = copy(self)
-    for key in kwargs:
-      result.dict[key] = kwargs[key]
+    result = object.__new__(type(self))
+    for field in self._fields:
+      setattr(result, field, kwargs.pop(field) if field in kwargs else getattr(self, field))
+    if kwargs:
+      raise ValueError(f"{self._name} has no fields {sorted(kwargs)}.")
     return result
 
+  def __reduce__(self):
+    values = tuple(getattr(self, field) for field in self._fields)
+    return (_rebuild, (self._kind, self._name, self._fields, values))
+
+  def __repr__(self):
+    keyvals = ", ".join(
+      f"{field}={getattr(self, field)}"
+      for field in self._fields
+    )
+    return f"{type(self).__name__}({keyvals})"
+
+class NamedTuple(Record):
+  r"""Record of named fields. Calling `NamedTuple(**kwargs)` directly
+  creates a record of a schema given by the keyword names."""
+  __slots__ = ()
+  _name = "NamedTuple"
+
+  def __new__(cls, *args, **kwargs):
+    if cls is NamedTuple:
+      cls = _record_type("NamedTuple", list(kwargs.keys()))
+    return object.__new__(cls)
+
   def __getitem__(self, index):
-    if index < len(self):
-      return self.dict[self.fields[index]]
-    else:
-      raise IndexError
+    return getattr(self, self._fields[index])
 
   def __len__(self):
-    return len(self.dict)
+    return len(self._fields)
 
   def __iter__(self):
     return (
-      self.dict[key]
-      for key in self.dict
+      getattr(self, field)
+      for field in self._fields
     )
 
+def _stack_field(values, shape=None):
+  if all(value is None for value in values):
+    return None
+  if all(torch.is_tensor(value) for value in values):
+    if shape is not None:
+      values = [value.reshape(shape) for value in values]
+    return torch.stack(values, dim=0)
+  return list(values)
+
+def _cat_field(values):
+  if all(value is None for value in values):
+    return None
+  if all(torch.is_tensor(value) for value in values):
+    return torch.cat(values, dim=0)
+  return [item for value in values for item in value]
+
+class NamedTupleBatch(Record):
+  r"""Struct-of-arrays form of a batch of records, holding one tensor per
+  field with a leading batch dimension. Fields which are `None` for all
+  records stay `None`, other non-tensor fields are held as lists.
+  Indexing with an integer returns a single record, indexing with a slice
+  or index tensor returns a batch."""
+  __slots__ = ()
+  _kind = "batch"
+  _record = None
+
+  @classmethod
+  def stack(cls, records, schema=None):
+    r"""Stacks a sequence of records into a batch.
+
+    Args:
+      records (list): records of the batch's schema.
+      schema (NamedTuple): optional record of single items. Tensors are
+        reshaped to the shape of their schema field before stacking, such
+        that items with and without a leading singleton dimension can be
+        mixed.
+    """
+    records = list(records)
+    return cls(**{
+      field: _stack_field(
+        [getattr(record, field) for record in records],
+        shape=getattr(schema, field).shape
+        if schema is not None and torch.is_tensor(getattr(schema, field))
+        else None
+      )
+      for field in cls._fields
+    })
+
+  @classmethod
+  def cat(cls, batches):
+    r"""Concatenates a sequence of batches."""
+    batches = list(batches)
+    return cls(**{
+      field: _cat_field([getattr(batch, field) for batch in batches])
+      for field in cls._fields
+    })
+
+  def __len__(self):
+    for field in self._fields:
+      value = getattr(self, field)
+      if torch.is_tensor(value):
+        return value.size(0)
+      if value is not None:
+        return len(value)
+    return 0
+
+  def _index(self, value, index):
+    if value is None:
+      return None
+    if torch.is_tensor(value) or isinstance(index, (int, slice)):
+      return value[index]
+    return [value[idx] for idx in torch.as_tensor(index).view(-1).tolist()]
+
+  def __getitem__(self, index):
+    values = {
+      field: self._index(getattr(self, field), index)
+      for field in self._fields
+    }
+    if isinstance(index, int):
+      return self._record(**values)
+    return type(self)(**values)
+
+  def __iter__(self):
+    return (self[idx] for idx in range(len(self)))
+
+  def unbind(self):
+    r"""Splits the batch into a list of records."""
+    return list(self)
+
+_RESERVED = set(dir(NamedTuple)) | set(dir(NamedTupleBatch))
+
+def _record_type(name, fields):
+  fields = tuple(fields)
+  key = (name, fields)
+  result = _RECORD_TYPES.get(key)
+  if result is None:
+    reserved = [field for field in fields if field.startswith("_") or field in _RESERVED]
+    if reserved:
+      raise ValueError(f"Invalid field names {reserved} for {name}.")
+    result = type(name, (NamedTuple,), dict(
+      __slots__=fields, _fields=fields, _name=name
+    ))
+    result.Batch = type(f"{name}Batch", (NamedTupleBatch,), dict(
+      __slots__=fields, _fields=fields, _name=name, _record=result
+    ))
+    _RECORD_TYPES[key] = result
+  return result
+
 def namedtuple(name, fields):
-  return CheckArgs(name, fields)
+  r"""Creates a record type with a given name and fields. Its
+  struct-of-arrays batch type is available as `Batch`."""
+  return _record_type(name, fields)
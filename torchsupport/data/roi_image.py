@@ -1,30 +1,231 @@
+import os
+from bisect import bisect_right
+from collections import OrderedDict
+
 import torch
-from torch.utils.data import Dataset, DataLoader, Sampler
-import openslide
+from torch.utils.data import Dataset
 import random
 import numpy as np
 from read_roi import read_roi_zip
 from skimage.draw import polygon
-from PIL import Image, ImageSequence
+from PIL import Image
+
+_RAW_DTYPES = {
+  "L": "u1", "I;8": "u1",
+  "I;16": "<u2", "I;16B": ">u2", "I;16S": "<i2", "I;16BS": ">i2",
+  "I;32S": "<i4", "I;32BS": ">i4",
+  "F;32F": "<f4", "F;32BF": ">f4"
+}
+
+def _raw_layout(image):
+  r"""Determines the byte offset and dtype of the current frame of a TIFF
+  image, if it is stored uncompressed in a single contiguous block.
+  Returns None otherwise."""
+  tiles = list(image.tile)
+  if not tiles or any(tile[0] != "raw" for tile in tiles):
+    return None
+  rawmode = tiles[0][3][0] if isinstance(tiles[0][3], tuple) else tiles[0][3]
+  if rawmode not in _RAW_DTYPES or any(tile[3] != tiles[0][3] for tile in tiles):
+    return None
+  dtype = np.dtype(_RAW_DTYPES[rawmode])
+  width, height = image.size
+  offset = tiles[0][2]
+  position = offset
+  for tile in tiles:
+    x0, y0, x1, y1 = tile[1]
+    if tile[2] != position or x0 != 0 or x1 != width:
+      return None
+    position += (y1 - y0) * width * dtype.itemsize
+  if position - offset != height * width * dtype.itemsize:
+    return None
+  return offset, dtype
+
+class TiffStack(object):
+  r"""Lazily accessed stack of TIFF frames. Frame offsets are indexed once
+  on construction. Uncompressed frames are memory-mapped, all other frames
+  are decoded on access.
+
+  Args:
+    path (str): path to a multi-frame TIFF file.
+  """
+  def __init__(self, path):
+    self.path = path
+    self.pid = None
+    self.image = None
+    self.buffer = None
+    image = self._image()
+    self.layouts = []
+    for idx in range(getattr(image, "n_frames", 1)):
+      image.seek(idx)
+      if idx == 0:
+        self.frame_size = image.size
+      elif image.size != self.frame_size:
+        raise ValueError(
+          f"Frame {idx} of {path} has size {image.size}, "
+          f"expected {self.frame_size}."
+        )
+      self.layouts.append(_raw_layout(image))
+
+  def _image(self):
+    # file positions of open images are shared with forked data loader
+    # workers, so each process needs its own handle.
+    if self.pid != os.getpid():
+      self.image = Image.open(self.path)
+      self.buffer = None
+      self.pid = os.getpid()
+    return self.image
+
+  def __len__(self):
+    return len(self.layouts)
+
+  @property
+  def shape(self):
+    return (len(self), self.frame_size[1], self.frame_size[0])
+
+  def frame(self, idx):
+    r"""Returns a frame as an array of shape `(height, width)` in its
+    native dtype, memory-mapped if possible."""
+    image = self._image()
+    layout = self.layouts[idx]
+    if layout is None:
+      image.seek(idx)
+      return np.asarray(image)
+    if self.buffer is None:
+      self.buffer = np.memmap(self.path, dtype=np.uint8, mode="r")
+    offset, dtype = layout
+    width, height = self.frame_size
+    size = width * height * dtype.itemsize
+    return self.buffer[offset:offset + size].view(dtype).reshape(height, width)
+
+  def read(self, idx, top, left, height, width, dtype=torch.float):
+    r"""Reads a window of a frame, converting to a given dtype. Regions
+    outside the frame are zero.
+
+    Returns:
+      Tensor of shape `(height, width)`.
+    """
+    frame = self.frame(idx)
+    result = torch.zeros(height, width, dtype=dtype)
+    rows = slice(max(top, 0), min(top + height, frame.shape[0]))
+    columns = slice(max(left, 0), min(left + width, frame.shape[1]))
+    if rows.start < rows.stop and columns.start < columns.stop:
+      window = frame[rows, columns]
+      native = window.dtype.newbyteorder("=")
+      if native.kind == "u" and native.itemsize > 1:
+        # torch lacks wide unsigned integer types.
+        native = np.dtype(np.int32 if native.itemsize == 2 else np.int64)
+      result[
+        rows.start - top:rows.stop - top,
+        columns.start - left:columns.stop - left
+      ] = torch.from_numpy(window.astype(native)).to(dtype)
+    return result
+
+def _roi_vertices(roi):
+  if "x" in roi and "y" in roi:
+    return np.asarray(roi["x"], dtype=float), np.asarray(roi["y"], dtype=float)
+  if roi.get("type") in ("rectangle", "oval"):
+    left, top = roi["left"], roi["top"]
+    width, height = roi["width"], roi["height"]
+    if roi["type"] == "rectangle":
+      x = np.array([left, left + width, left + width, left], dtype=float)
+      y = np.array([top, top, top + height, top + height], dtype=float)
+      return x, y
+    angle = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+    x = left + width / 2 * (1 + np.cos(angle))
+    y = top + height / 2 * (1 + np.sin(angle))
+    return x, y
+  return None
+
+def _roi_frame(roi):
+  position = roi.get("position", 0)
+  if isinstance(position, dict):
+    position = position.get("frame", 0) or position.get("slice", 0)
+  return position - 1 if position else None
 
 class RoiImage(Dataset):
-  def __init__(self, path, size=(226, 226), transform=lambda x: x):
+  r"""Dataset of crops centered on regions of interest (ROIs) of a TIFF
+  image stack annotated with an ImageJ ROI archive. Frames are read on
+  demand and converted to `dtype` on access. ROI masks are rasterized on
+  first use and cached. ROIs without a frame position yield one item per
+  frame.
+
+  Each item is a pair of a crop of shape `(1, height, width)` and the mask
+  of its ROI within that crop.
+
+  Args:
+    path (str): path without extensions. Reads `path.tif` and `path.roi.zip`.
+    size (tuple): width and height of each crop.
+    transform (callable): transformation applied to each pair of crop and mask.
+    dtype (torch.dtype): dtype frames are converted to.
+    jitter (int): maximum random offset of crops from ROI centers.
+    cache_size (int): maximum number of cached ROI masks.
+  """
+  def __init__(self, path, size=(226, 226), transform=lambda x: x,
+               dtype=torch.float, jitter=0, cache_size=1024):
     self.transform = transform
-    with Image.open(path + ".tif") as stack:
-      frames = []
-      for img in ImageSequence.Iterator(stack):
-        frame = torch.tensor(np.array(img).astype(float))
-        frames.append(frame.unsqueeze(0))
-      self.raw_image = torch.cat(frames, dim=0)
-    rois = read_roi_zip(path + ".roi.zip")
-    self.rois = [
-      torch.tensor(zip(*polygon(
-        roi[1]["x"], roi[1]["y"],
-        shape=(self.raw_image.size(1),
-               self.raw_image.size(2))
-      )), dtype=torch.long)
-      for roi in rois
+    self.size = size
+    self.dtype = dtype
+    self.jitter = jitter
+    self.cache_size = cache_size
+    self.masks = OrderedDict()
+    self.stack = TiffStack(path + ".tif")
+
+    self.rois = []
+    self.frames = []
+    for roi in read_roi_zip(path + ".roi.zip").values():
+      vertices = _roi_vertices(roi)
+      if vertices is None:
+        continue
+      self.rois.append(vertices)
+      self.frames.append(_roi_frame(roi))
+    self.centers = [
+      (int(round((y.min() + y.max()) / 2)), int(round((x.min() + x.max()) / 2)))
+      for x, y in self.rois
     ]
+    self.offsets = [0]
+    for frame in self.frames:
+      self.offsets.append(self.offsets[-1] + (1 if frame is not None else len(self.stack)))
+
+  def mask(self, idx):
+    r"""Returns the pixel coordinates `(rows, columns)` covered by an ROI."""
+    if idx in self.masks:
+      self.masks.move_to_end(idx)
+      return self.masks[idx]
+    x, y = self.rois[idx]
+    rows, columns = polygon(y, x, shape=self.stack.shape[1:])
+    result = (torch.tensor(rows, dtype=torch.long), torch.tensor(columns, dtype=torch.long))
+    self.masks[idx] = result
+    if len(self.masks) > self.cache_size:
+      self.masks.popitem(last=False)
+    return result
+
+  def _locate(self, idx):
+    roi = bisect_right(self.offsets, idx) - 1
+    frame = self.frames[roi]
+    if frame is None:
+      frame = idx - self.offsets[roi]
+    return roi, frame
+
+  def __len__(self):
+    return self.offsets[-1]
 
   def __getitem__(self, idx):
-    pass # TODO
+    if not -len(self) <= idx < len(self):
+      raise IndexError(f"Index {idx} out of range for {len(self)} crops.")
+    if idx < 0:
+      idx += len(self)
+    roi, frame = self._locate(idx)
+    width, height = self.size
+    center_y, center_x = self.centers[roi]
+    if self.jitter > 0:
+      center_y += random.randint(-self.jitter, self.jitter)
+      center_x += random.randint(-self.jitter, self.jitter)
+    top, left = center_y - height // 2, center_x - width // 2
+    crop = self.stack.read(frame, top, left, height, width, dtype=self.dtype)
+
+    rows, columns = self.mask(roi)
+    rows, columns = rows - top, columns - left
+    inside = (rows >= 0) & (rows < height) & (columns >= 0) & (columns < width)
+    mask = torch.zeros(height, width, dtype=self.dtype)
+    mask[rows[inside], columns[inside]] = 1
+    return self.transform((crop.unsqueeze(0), mask.unsqueeze(0)))
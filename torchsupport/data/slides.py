@@ -1,77 +1,309 @@
+import os
 import torch
-from torch.utils.data import Dataset, DataLoader, Sampler, ConcatDataset
-import openslide
+from torch.utils.data import (
+  Dataset, DataLoader, Sampler, ConcatDataset, WeightedRandomSampler
+)
 import random
 import numpy as np
 
+from torchsupport.data.tiles import OpenSlideBackend, TileReader
+
 class SlideImage(object):
-  def __init__(self, path):
-    self.slide = openslide.OpenSlide(path)
+  r"""Tiled access to a multi-resolution slide image.
 
-  def _tile_at_impl(self, position, level, size, origin):
-    to_cat = []
+  Args:
+    path (str): path to a whole-slide image file read with OpenSlide.
+    backend (SlideBackend): image pyramid to read from instead of `path`.
+    cache_size (int): tile cache budget in bytes.
+    workers (int): number of tile prefetching threads.
+    lookahead (int): number of tiles prefetched ahead when iterating
+      over a tiling.
+  """
+  def __init__(self, path=None, backend=None, cache_size=256 * 2 ** 20,
+               workers=4, lookahead=16):
+    if backend is None:
+      backend = OpenSlideBackend(path)
+    self.slide = backend
+    self.reader = TileReader(backend, cache_size=cache_size, workers=workers)
+    self.lookahead = lookahead
+
+  def _keys(self, position, level, size, origin):
+    keys = []
     for lv in level:
       size_off = (
-        size[0] * self.slide.level_downsample[lv],
-        size[1] * self.slide.level_downsample[lv]
+        size[0] * self.slide.level_downsamples[lv],
+        size[1] * self.slide.level_downsamples[lv]
       )
       start = (
         int(position[0] - origin[0] * size_off[0]),
         int(position[1] - origin[1] * size_off[1])
       )
-      image = self.slide.read_region(start, level, size)
-      image = np.array(image).astype(type)
-      image = np.transpose(image,(0,1,2))
-      image = torch.from_numpy(image)
-      to_cat.append(image.unsqueeze(0))
-    result = torch.cat(to_cat, dim=0)
-    return result
+      keys.append((lv, start[0], start[1], size[0], size[1]))
+    return keys
 
-  def tile_at(self, position, level=0, size=(224, 224), origin=(0.5, 0.5)):
+  def _levels(self, level):
     if isinstance(level, list) or isinstance(level, tuple):
-      return self._tile_at_impl(position, level, size, origin)
-    else:
-      return self._tile_at_impl(position, [level], size, origin)
+      return level
+    return [level]
+
+  def _tile_at_impl(self, position, level, size, origin):
+    tiles = self.reader.read(self._keys(position, level, size, origin))
+    return torch.stack(tiles, dim=0).float()
+
+  def tile_at(self, position, level=0, size=(224, 224), origin=(0.5, 0.5)):
+    return self._tile_at_impl(position, self._levels(level), size, origin)
+
+  def prefetch(self, positions, level=0, size=(224, 224), origin=(0.5, 0.5)):
+    r"""Schedules tiles at a list of positions to be read in the background."""
+    levels = self._levels(level)
+    self.reader.prefetch([
+      key
+      for position in positions
+      for key in self._keys(position, levels, size, origin)
+    ])
+
+  def tiles_at(self, positions, level=0, size=(224, 224), origin=(0.5, 0.5)):
+    r"""Iterates over tiles at a list of positions, prefetching
+    upcoming tiles while earlier tiles are processed."""
+    positions = list(positions)
+    step = max(self.lookahead, 1)
+    self.prefetch(positions[:step], level=level, size=size, origin=origin)
+    for idx, position in enumerate(positions):
+      if idx % step == 0:
+        self.prefetch(
+          positions[idx + step:idx + 2 * step],
+          level=level, size=size, origin=origin
+        )
+      yield self.tile_at(position, level=level, size=size, origin=origin)
 
   def regular_tiling(self, level=0, size=(224, 224)):
     dimensions = self.slide.dimensions
     n_tiles = (dimensions[0] // size[0], dimensions[1] // size[1])
-    for idx in range(n_tiles[0]):
-      x_pos = idx * size[0]
-      for idy in range(n_tiles[1]):
-        y_pos = idy * size[1]
-        yield self.tile_at((x_pos, y_pos), level=level, size=size, origin=(0, 0))
+    positions = [
+      (idx * size[0], idy * size[1])
+      for idx in range(n_tiles[0])
+      for idy in range(n_tiles[1])
+    ]
+    return self.tiles_at(positions, level=level, size=size, origin=(0, 0))
 
   def random_tiling(self, count, level=0, size=(224, 224)):
     dimensions = self.slide.dimensions
     lower_x, lower_y = 0, 0
     upper_x, upper_y = dimensions[0] - size[0], dimensions[1] - size[1]
-    for idx in range(count):
-      rand_x, rand_y = random.randint(lower_x, upper_x), random.randint(lower_y, upper_y)
-      yield self.tile_at((rand_x, rand_y), level=level, size=size, origin=(0, 0))
+    positions = [
+      (random.randint(lower_x, upper_x), random.randint(lower_y, upper_y))
+      for idx in range(count)
+    ]
+    return self.tiles_at(positions, level=level, size=size, origin=(0, 0))
+
+  def close(self):
+    self.reader.close()
+    self.slide.close()
+
+def tissue_mask(image, brightness=220, saturation=20):
+  r"""Detects tissue in a (low-resolution) slide image by thresholding
+  brightness and colour saturation. Transparent pixels are background.
+
+  Args:
+    image (np.ndarray or torch.Tensor): image of shape `(height, width, channels)`.
+    brightness (float): pixels brighter than this are background.
+    saturation (float): pixels with a smaller channel spread are background.
+
+  Returns:
+    Boolean tensor of shape `(height, width)`.
+  """
+  image = torch.as_tensor(np.asarray(image))
+  rgb = image[..., :3].float()
+  value = rgb.mean(dim=-1)
+  spread = rgb.max(dim=-1).values - rgb.min(dim=-1).values
+  mask = (value < brightness) & (spread > saturation)
+  if image.size(-1) == 4:
+    mask = mask & (image[..., 3] > 0)
+  return mask
+
+class TileIndex(object):
+  r"""Grid positions of tiles containing tissue in a slide.
+
+  Args:
+    positions (torch.Tensor): level 0 coordinates of the top left corner
+      of each tile, of shape `(N, 2)`.
+    size (tuple): tile size at the tile level.
+    level (int): pyramid level tiles are read at.
+    stride (tuple): grid stride at the tile level.
+    detection (dict): tissue detection parameters used to build the index.
+  """
+  def __init__(self, positions, size, level, stride, detection=None):
+    self.positions = positions
+    self.size = tuple(size)
+    self.level = level
+    self.stride = tuple(stride)
+    self.detection = detection
+
+  @classmethod
+  def build(cls, slide, size=(224, 224), level=0, stride=None, mask_level=None,
+            min_foreground=0.5, brightness=220, saturation=20, path=None):
+    r"""Computes the positions of all grid tiles covered by tissue to at
+    least a given fraction, reusing a cached index at a given path if
+    it matches the requested tiling and tissue detection parameters.
+
+    Args:
+      slide (SlideImage or SlideBackend): slide to index.
+      size (tuple): tile size at the tile level.
+      level (int): pyramid level tiles are read at.
+      stride (tuple): grid stride at the tile level. Defaults to `size`.
+      mask_level (int): pyramid level used for tissue detection.
+        Defaults to the lowest resolution level.
+      min_foreground (float): minimum fraction of tissue in a tile.
+      brightness (float): brightness threshold of :func:`tissue_mask`.
+      saturation (float): saturation threshold of :func:`tissue_mask`.
+      path (str): optional path to cache the index at.
+    """
+    stride = tuple(stride or size)
+    backend = slide.slide if isinstance(slide, SlideImage) else slide
+    if mask_level is None:
+      mask_level = backend.level_count - 1
+    detection = dict(
+      mask_level=mask_level, min_foreground=min_foreground,
+      brightness=brightness, saturation=saturation
+    )
+    if path is not None and os.path.isfile(path):
+      result = cls.load(path)
+      if (result.size, result.level, result.stride, result.detection) == (
+          tuple(size), level, stride, detection
+      ):
+        return result
+    mask_dimensions = backend.level_dimensions[mask_level]
+    thumbnail = backend.read_region((0, 0), mask_level, mask_dimensions)
+    mask = tissue_mask(thumbnail, brightness=brightness, saturation=saturation)
+    integral = torch.zeros(mask.size(0) + 1, mask.size(1) + 1, dtype=torch.long)
+    integral[1:, 1:] = mask.long().cumsum(dim=0).cumsum(dim=1)
+
+    mask_downsample = backend.level_downsamples[mask_level]
+    downsample = backend.level_downsamples[level]
+    extent = (size[0] * downsample, size[1] * downsample)
+    step = (stride[0] * downsample, stride[1] * downsample)
+    dimensions = backend.dimensions
+    xs = torch.arange(0, dimensions[0] - extent[0] + 1, step[0], dtype=torch.float64)
+    ys = torch.arange(0, dimensions[1] - extent[1] + 1, step[1], dtype=torch.float64)
+
+    def _bounds(start, extent, limit):
+      lower = (start / mask_downsample).floor().long().clamp(0, limit)
+      upper = ((start + extent) / mask_downsample).ceil().long().clamp(0, limit)
+      return lower, upper
+    x0, x1 = _bounds(xs, extent[0], mask.size(1))
+    y0, y1 = _bounds(ys, extent[1], mask.size(0))
+    tissue = (
+      integral[y1[:, None], x1[None, :]] - integral[y0[:, None], x1[None, :]]
+      - integral[y1[:, None], x0[None, :]] + integral[y0[:, None], x0[None, :]]
+    )
+    area = ((y1 - y0)[:, None] * (x1 - x0)[None, :]).clamp(min=1)
+    keep = tissue.double() / area.double() >= min_foreground
+    row, column = keep.nonzero(as_tuple=True)
+    positions = torch.stack((xs[column], ys[row]), dim=1).long()
+
+    result = cls(positions, size, level, stride, detection=detection)
+    if path is not None:
+      result.save(path)
+    return result
+
+  @classmethod
+  def load(cls, path):
+    data = torch.load(path)
+    return cls(
+      data["positions"], data["size"], data["level"], data["stride"],
+      detection=data.get("detection")
+    )
+
+  def save(self, path):
+    torch.save(dict(
+      positions=self.positions, size=self.size,
+      level=self.level, stride=self.stride,
+      detection=self.detection
+    ), path)
+
+  def __len__(self):
+    return self.positions.size(0)
+
+  def __getitem__(self, idx):
+    return tuple(self.positions[idx].tolist())
 
 class SingleSlideData(Dataset):
-  def __init__(self, path, size=(224, 224), level=0, transform=lambda x: x):
+  r"""Dataset of tissue-containing tiles of a single slide.
+
+  Args:
+    path (str): path to a whole-slide image file.
+    size (tuple): tile size.
+    level (int): pyramid level tiles are read at.
+    transform (callable): transformation applied to each tile.
+    stride (tuple): tile grid stride. Defaults to `size`.
+    min_foreground (float): minimum fraction of tissue in a tile.
+    index_path (str): optional path to cache the tile index at.
+    backend (SlideBackend): image pyramid to read from instead of `path`.
+  """
+  def __init__(self, path, size=(224, 224), level=0, transform=lambda x: x,
+               stride=None, min_foreground=0.5, index_path=None, backend=None):
     self.transform = transform
-    self.slide = SlideImage(path)
-    self.dims = self.slide.slide.dimensions
-    self.dims = (dims[0] - size[0], dims[1] - size[1])
+    self.slide = SlideImage(path, backend=backend)
     self.size = size
     self.level = level
+    self.index = TileIndex.build(
+      self.slide, size=size, level=level, stride=stride,
+      min_foreground=min_foreground, path=index_path
+    )
 
   def __len__(self):
-    return self.dims[0] * self.dims[1]
+    return len(self.index)
 
   def __getitem__(self, index):
-    x_pos = index // self.dims[0]
-    y_pos = index % self.dims[0]
-    tile = self.slide.tile_at((x_pos, y_pos), level=self.level, size=self.size, origin=(0, 0))
+    position = self.index[index]
+    tile = self.slide.tile_at(position, level=self.level, size=self.size, origin=(0, 0))
     if self.transform != None:
       tile = self.transform(tile)
     return tile
 
-def MultiSlideData(self, paths, size=(224, 224), level=0, transform=lambda x: x):
-  datasets = []
-  for path in paths:
-    datasets.append(SingleSlideData(path, size=size, level=level, transform=transform))
-  return ConcatDataset(datasets)
+class MultiSlideData(ConcatDataset):
+  r"""Dataset of tissue-containing tiles of multiple slides.
+
+  Args:
+    paths (list): paths to whole-slide image files.
+    size (tuple): tile size.
+    level (int): pyramid level tiles are read at.
+    transform (callable): transformation applied to each tile.
+    stride (tuple): tile grid stride. Defaults to `size`.
+    min_foreground (float): minimum fraction of tissue in a tile.
+    index_paths (list): optional paths to cache tile indices at.
+  """
+  def __init__(self, paths, size=(224, 224), level=0, transform=lambda x: x,
+               stride=None, min_foreground=0.5, index_paths=None):
+    index_paths = index_paths or [None for _ in paths]
+    super(MultiSlideData, self).__init__([
+      SingleSlideData(
+        path, size=size, level=level, transform=transform,
+        stride=stride, min_foreground=min_foreground,
+        index_path=index_path
+      )
+      for path, index_path in zip(paths, index_paths)
+    ])
+
+  def sampler(self, num_samples=None, weights=None, replacement=True):
+    r"""Constructs a sampler drawing tiles across slides.
+
+    Args:
+      num_samples (int): number of tiles per epoch. Defaults to all tiles.
+      weights (list or str or None): relative sampling weight of each slide.
+        `None` samples all slides equally often, "tiles" samples all tiles
+        equally often.
+      replacement (bool): sample with replacement?
+    """
+    lengths = torch.tensor([len(data) for data in self.datasets], dtype=torch.double)
+    if weights is None:
+      slide_weights = torch.ones_like(lengths)
+    elif isinstance(weights, str) and weights == "tiles":
+      slide_weights = lengths
+    else:
+      slide_weights = torch.tensor(weights, dtype=torch.double)
+    tile_weights = (slide_weights / lengths.clamp(min=1)).repeat_interleave(lengths.long())
+    return WeightedRandomSampler(
+      tile_weights, num_samples or len(self),
+      replacement=replacement
+    )
@@ -1,13 +1,29 @@
 import os
 import random
 
+import numpy as np
 import torch
 from torch.utils.data import Dataset
 
-from torchsupport.modules.structured import connected_entities as ce
-from torchsupport.data.graphio import LazyNodes, LazyAdjacency
+from torchsupport.data.graphio import (
+  LazyNodes, LazyAdjacency, NeighbourSampler, k_hop
+)
 
 class LazySubgraphDataset(Dataset):
+  r"""Dataset of subgraphs within `depth` hops of random nodes of large
+  graphs stored on disk. Node features and adjacencies are memory-mapped,
+  such that only the nodes and edges of each sampled subgraph are read.
+
+  Graphs are found by their node files `<base>.<node_name>.node`, with
+  one adjacency directory `<base>.<edge_name>.struct` per edge type
+  (see :class:`LazyNodes` and :class:`LazyAdjacency`).
+
+  Args:
+    path (str): directory containing the graphs.
+    node_name (str): node type.
+    edge_names (list): edge types.
+    depth (int): number of hops around the start node.
+  """
   def __init__(self, path, node_name, edge_names, depth=3):
     self.depth = depth
     self.path = path
@@ -15,7 +31,7 @@ class LazySubgraphDataset(Dataset):
     self.nodes = []
     self.adjacencies = []
     for root, _, names in os.walk(path):
-      for name in names:
+      for name in sorted(names):
         if name.endswith(f"{node_name}.node"):
           base = ".".join(name.split(".")[:-2])
           self.nodes.append(LazyNodes(os.path.join(root, f"{base}.{node_name}.node")))
@@ -28,20 +44,82 @@ class LazySubgraphDataset(Dataset):
     return len(self.nodes)
 
   def __getitem__(self, idx):
-    start_node = random.randint(0, len(self.nodes[idx]))
-    adjacencies = [
-      self.adjacencies[idx][name].materialize()
-      for name in self.adjacencies[idx]
-    ]
-    reachable = ce.ConnectionStructure.reachable_nodes(
-      {self.node_name: set([start_node])},
-      adjacencies,
+    start_node = random.randrange(len(self.nodes[idx]))
+    adjacencies = list(self.adjacencies[idx].values())
+    reachable = k_hop(
+      adjacencies, {self.node_name: [start_node]},
       depth=self.depth
-    )
-    reachable = list(reachable[self.node_name])
+    )[self.node_name]
     node_tensor = self.nodes[idx].materialize(reachable)
-    adjacencies = [
-      adj.select(reachable)
+    structures = [
+      adj.subgraph(reachable)
       for adj in adjacencies
     ]
-    return node_tensor, adjacencies
+    return node_tensor, structures
+
+class NeighbourSampledDataset(Dataset):
+  r"""Dataset of neighbour-sampled mini-batches of seed nodes of a large
+  graph. Each item is a full mini-batch, such that sampling runs in the
+  workers of a :class:`torch.utils.data.DataLoader` created with
+  `batch_size=None`.
+
+  Items consist of the input node features, or input node indices if no
+  features are given, the list of blocks from the input layer to the
+  output layer (see :class:`NeighbourSampler`) and the input node
+  indices, the first of which are the seeds of the batch.
+
+  Args:
+    sampler (NeighbourSampler): neighbour sampler.
+    seeds (array): indices of all seed nodes, e.g. training nodes.
+    batch_size (int): number of seeds per mini-batch.
+    nodes (LazyNodes): optional node features.
+    shuffle (bool): shuffle seeds before splitting them into batches?
+      Seeds are reshuffled by :meth:`set_epoch`.
+    seed (int): optional random seed of the shuffle. Defaults to a seed
+      drawn from torch's global random number generator.
+
+  Note:
+    As batches are fixed within an epoch, call :meth:`set_epoch` before
+    iterating a data loader over this dataset for every epoch, such that
+    each epoch draws new batches of seeds. Data loaders with
+    `persistent_workers=True` keep the dataset of their first epoch.
+  """
+  def __init__(self, sampler, seeds, batch_size=512, nodes=None,
+               shuffle=True, seed=None):
+    self.sampler = sampler
+    self.nodes = nodes
+    self.seeds = np.asarray(seeds, dtype=np.int64).reshape(-1)
+    self.batch_size = batch_size
+    self.shuffle = shuffle
+    if seed is None:
+      seed = int(torch.randint(2 ** 31, (1,)))
+    self.seed = seed
+    self.batches = []
+    self.set_epoch(0)
+
+  def set_epoch(self, epoch):
+    r"""Reshuffles seeds and splits them into batches for a given epoch.
+
+    Args:
+      epoch (int): index of the epoch, which together with the dataset's
+        seed determines the shuffle.
+    """
+    seeds = self.seeds
+    if self.shuffle:
+      generator = torch.Generator()
+      generator.manual_seed(self.seed + epoch)
+      seeds = seeds[torch.randperm(len(seeds), generator=generator).numpy()]
+    self.batches = [
+      seeds[start:start + self.batch_size]
+      for start in range(0, len(seeds), self.batch_size)
+    ]
+
+  def __len__(self):
+    return len(self.batches)
+
+  def __getitem__(self, idx):
+    nodes, blocks = self.sampler.sample(self.batches[idx])
+    node_tensor = torch.from_numpy(nodes)
+    if self.nodes is not None:
+      return self.nodes.materialize(nodes), blocks, node_tensor
+    return node_tensor, blocks, node_tensor
@@ -0,0 +1,341 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+try:
+  import openslide
+except ImportError:
+  openslide = None
+
+class SlideBackend(object):
+  r"""Interface for multi-resolution image pyramids. Mirrors the subset
+  of the OpenSlide API used for reading tiles.
+
+  Attributes:
+    dimensions (tuple): width and height of the highest resolution level.
+    level_dimensions (list): width and height of each level.
+    level_downsamples (list): downsampling factor of each level.
+  """
+  dimensions = None
+  level_dimensions = None
+  level_downsamples = None
+
+  @property
+  def level_count(self):
+    return len(self.level_dimensions)
+
+  def read_region(self, location, level, size):
+    r"""Reads a region of the pyramid.
+
+    Args:
+      location (tuple): top left corner in level 0 coordinates.
+      level (int): pyramid level to read from.
+      size (tuple): width and height of the region at the given level.
+
+    Returns:
+      A uint8 array of shape `(height, width, channels)`.
+    """
+    raise NotImplementedError("Abstract.")
+
+  def close(self):
+    pass
+
+class OpenSlideBackend(SlideBackend):
+  r"""Whole-slide image pyramid read using OpenSlide.
+
+  Args:
+    path (str): path to a whole-slide image file.
+  """
+  def __init__(self, path):
+    if openslide is None:
+      raise ImportError("OpenSlideBackend requires `openslide` to be installed.")
+    self.slide = openslide.OpenSlide(path)
+    self.dimensions = self.slide.dimensions
+    self.level_dimensions = self.slide.level_dimensions
+    self.level_downsamples = self.slide.level_downsamples
+
+  def read_region(self, location, level, size):
+    return np.asarray(self.slide.read_region(location, level, size))
+
+  def close(self):
+    self.slide.close()
+
+class MemoryBackend(SlideBackend):
+  r"""Image pyramid held in memory. Useful as a stand-in for whole-slide
+  images in tests, or for images small enough to fit into memory.
+
+  Args:
+    levels (list): uint8 arrays of shape `(height, width, channels)`,
+      from highest to lowest resolution.
+    downsamples (list): downsampling factor of each level. Defaults to the
+      width ratio of each level with respect to the first level.
+  """
+  def __init__(self, levels, downsamples=None):
+    self.levels = [np.asarray(level) for level in levels]
+    self.level_dimensions = [
+      (level.shape[1], level.shape[0])
+      for level in self.levels
+    ]
+    self.dimensions = self.level_dimensions[0]
+    if downsamples is None:
+      downsamples = [
+        self.dimensions[0] / width
+        for width, _ in self.level_dimensions
+      ]
+    self.level_downsamples = list(downsamples)
+
+  @classmethod
+  def from_image(cls, image, depth=3):
+    r"""Builds a pyramid by repeated 2x subsampling of an image.
+
+    Args:
+      image (np.ndarray): array of shape `(height, width, channels)`.
+      depth (int): number of pyramid levels.
+    """
+    levels = [np.asarray(image)]
+    for _ in range(depth - 1):
+      levels.append(levels[-1][::2, ::2])
+    downsamples = [2 ** idx for idx in range(depth)]
+    return cls(levels, downsamples=downsamples)
+
+  def read_region(self, location, level, size):
+    data = self.levels[level]
+    downsample = self.level_downsamples[level]
+    x, y = int(location[0] / downsample), int(location[1] / downsample)
+    width, height = size
+    result = np.zeros((height, width, data.shape[2]), dtype=data.dtype)
+    source_x = slice(max(x, 0), min(x + width, data.shape[1]))
+    source_y = slice(max(y, 0), min(y + height, data.shape[0]))
+    if source_x.start < source_x.stop and source_y.start < source_y.stop:
+      target_x = slice(source_x.start - x, source_x.stop - x)
+      target_y = slice(source_y.start - y, source_y.stop - y)
+      result[target_y, target_x] = data[source_y, source_x]
+    return result
+
+def _nbytes(tile):
+  return tile.element_size() * tile.nelement()
+
+class TileCache(object):
+  r"""Thread-safe least-recently-used cache of tensors with a budget
+  in bytes.
+
+  Args:
+    max_bytes (int): maximum total size of cached tensors in bytes.
+  """
+  def __init__(self, max_bytes=256 * 2 ** 20):
+    self.max_bytes = max_bytes
+    self.bytes = 0
+    self.tiles = OrderedDict()
+    self.lock = threading.Lock()
+
+  def __len__(self):
+    return len(self.tiles)
+
+  def __contains__(self, key):
+    return key in self.tiles
+
+  def get(self, key):
+    with self.lock:
+      tile = self.tiles.get(key)
+      if tile is not None:
+        self.tiles.move_to_end(key)
+      return tile
+
+  def put(self, key, tile):
+    size = _nbytes(tile)
+    if size > self.max_bytes:
+      return
+    with self.lock:
+      if key in self.tiles:
+        self.bytes -= _nbytes(self.tiles.pop(key))
+      self.tiles[key] = tile
+      self.bytes += size
+      while self.bytes > self.max_bytes:
+        _, evicted = self.tiles.popitem(last=False)
+        self.bytes -= _nbytes(evicted)
+
+  def clear(self):
+    with self.lock:
+      self.tiles.clear()
+      self.bytes = 0
+
+def _to_tile(array):
+  array = np.ascontiguousarray(np.asarray(array).transpose(2, 0, 1))
+  return torch.from_numpy(array)
+
+class TileReader(object):
+  r"""Reads tiles from a :class:`SlideBackend`, merging reads of
+  overlapping or adjacent tiles into single region reads, prefetching
+  tiles on a thread pool and caching decoded tiles.
+
+  Tiles are identified by keys `(level, x, y, width, height)`, where `x`
+  and `y` are level 0 coordinates of the top left corner and `width` and
+  `height` are given at the tile's level.
+
+  Args:
+    backend (SlideBackend): image pyramid to read from.
+    cache_size (int): tile cache budget in bytes.
+    workers (int): number of prefetching threads. Zero disables prefetching.
+    merge_ratio (float): maximum ratio of the area of a merged read to the
+      total area of the tiles it contains.
+  """
+  def __init__(self, backend, cache_size=256 * 2 ** 20, workers=4, merge_ratio=1.5):
+    self.backend = backend
+    self.cache = TileCache(cache_size)
+    self.workers = workers
+    self.merge_ratio = merge_ratio
+    self.pending = {}
+    self.lock = threading.Lock()
+    self.executor = None
+    self.pid = None
+
+  def _check_process(self):
+    # thread pools and their pending reads do not survive forking
+    # into data loader workers.
+    if self.pid != os.getpid():
+      self.executor = None
+      self.pending = {}
+      self.lock = threading.Lock()
+      self.pid = os.getpid()
+
+  def _executor(self):
+    self._check_process()
+    if self.executor is None:
+      self.executor = ThreadPoolExecutor(self.workers)
+    return self.executor
+
+  def _mergeable(self, key, group):
+    level, x, y, width, height = key
+    downsample = self.backend.level_downsamples[level]
+    offset_x = (x - group[0][1]) / downsample
+    offset_y = (y - group[0][2]) / downsample
+    return (
+      abs(offset_x - round(offset_x)) < 1e-6 and
+      abs(offset_y - round(offset_y)) < 1e-6
+    )
+
+  def _bounds(self, group):
+    downsample = self.backend.level_downsamples[group[0][0]]
+    left = min(key[1] for key in group)
+    top = min(key[2] for key in group)
+    right = max(key[1] + key[3] * downsample for key in group)
+    bottom = max(key[2] + key[4] * downsample for key in group)
+    return left, top, right, bottom
+
+  def _groups(self, keys):
+    r"""Clusters tiles into groups read by a single region read."""
+    result = []
+    for level in sorted(set(key[0] for key in keys)):
+      downsample = self.backend.level_downsamples[level]
+      level_keys = sorted(
+        (key for key in keys if key[0] == level),
+        key=lambda key: (key[2], key[1])
+      )
+      group, area = [], 0
+      for key in level_keys:
+        key_area = key[3] * key[4] * downsample ** 2
+        if group:
+          left, top, right, bottom = self._bounds(group + [key])
+          merged_area = (right - left) * (bottom - top)
+          touches = (
+            key[1] <= group_bounds[2] and key[1] + key[3] * downsample >= group_bounds[0] and
+            key[2] <= group_bounds[3] and key[2] + key[4] * downsample >= group_bounds[1]
+          )
+          if (touches and merged_area <= self.merge_ratio * (area + key_area)
+              and self._mergeable(key, group)):
+            group.append(key)
+            area += key_area
+            group_bounds = (left, top, right, bottom)
+            continue
+          result.append(group)
+        group, area = [key], key_area
+        group_bounds = self._bounds(group)
+      if group:
+        result.append(group)
+    return result
+
+  def _read_group(self, group):
+    try:
+      if len(group) == 1:
+        level, x, y, width, height = group[0]
+        tiles = {group[0]: _to_tile(self.backend.read_region((x, y), level, (width, height)))}
+      else:
+        level = group[0][0]
+        downsample = self.backend.level_downsamples[level]
+        left, top, right, bottom = self._bounds(group)
+        width = int(round((right - left) / downsample))
+        height = int(round((bottom - top) / downsample))
+        region = self.backend.read_region((left, top), level, (width, height))
+        tiles = {}
+        for key in group:
+          offset_x = int(round((key[1] - left) / downsample))
+          offset_y = int(round((key[2] - top) / downsample))
+          tiles[key] = _to_tile(region[
+            offset_y:offset_y + key[4],
+            offset_x:offset_x + key[3]
+          ])
+      for key, tile in tiles.items():
+        self.cache.put(key, tile)
+      return tiles
+    finally:
+      with self.lock:
+        for key in group:
+          self.pending.pop(key, None)
+
+  def prefetch(self, keys):
+    r"""Schedules tiles to be read in the background.
+
+    Args:
+      keys (list): tile keys `(level, x, y, width, height)`.
+    """
+    if self.workers <= 0:
+      return
+    executor = self._executor()
+    with self.lock:
+      missing = list(OrderedDict.fromkeys(
+        key for key in keys
+        if key not in self.cache and key not in self.pending
+      ))
+      for group in self._groups(missing):
+        future = executor.submit(self._read_group, group)
+        for key in group:
+          self.pending[key] = future
+
+  def read(self, keys):
+    r"""Reads a list of tiles, using cached and prefetched tiles
+    where available.
+
+    Args:
+      keys (list): tile keys `(level, x, y, width, height)`.
+
+    Returns:
+      List of uint8 tensors of shape `(channels, height, width)`.
+    """
+    self._check_process()
+    result = {}
+    missing = []
+    for key in keys:
+      tile = self.cache.get(key)
+      if tile is not None:
+        result[key] = tile
+        continue
+      with self.lock:
+        future = self.pending.get(key)
+      if future is not None:
+        tiles = future.result()
+        result[key] = tiles[key]
+      elif key not in missing:
+        missing.append(key)
+    for group in self._groups(missing):
+      result.update(self._read_group(group))
+    return [result[key] for key in keys]
+
+  def close(self):
+    if self.executor is not None:
+      self.executor.shutdown(wait=True)
+      self.executor = None
+    self.cache.clear()
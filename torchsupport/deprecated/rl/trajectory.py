@@ -134,16 +134,21 @@ class Experience(Collatable, Chunkable, DeviceMovable):
       outputs=to_device(self.outputs, device)
     )
 
-  def chunk(self, targets):
-    initial_state = scatter_chunked(self.initial_state, targets)
-    final_state = scatter_chunked(self.final_state, targets)
-    action = scatter_chunked(self.action, targets)
-    reward = scatter_chunked(self.reward, targets)
-    terminal = scatter_chunked(self.terminal, targets)
+  def chunk_costs(self, cost="elements"):
+    return [1 for _ in range(len(self.reward))]
+
+  def chunk(self, targets, plan=None):
+    plan = plan or self.chunk_plan(targets)
+    targets = targets[:len(plan)]
+    initial_state = scatter_chunked(self.initial_state, targets, plan=plan, chunk_args=True)
+    final_state = scatter_chunked(self.final_state, targets, plan=plan, chunk_args=True)
+    action = scatter_chunked(self.action, targets, plan=plan, chunk_args=True)
+    reward = scatter_chunked(self.reward, targets, plan=plan, chunk_args=True)
+    terminal = scatter_chunked(self.terminal, targets, plan=plan, chunk_args=True)
 
     nones = [None] * len(targets)
-    logits = nones if self.logits is None else scatter_chunked(self.logits, targets)
-    outputs = nones if self.outputs is None else scatter_chunked(self.outputs, targets)
+    logits = nones if self.logits is None else scatter_chunked(self.logits, targets, plan=plan, chunk_args=True)
+    outputs = nones if self.outputs is None else scatter_chunked(self.outputs, targets, plan=plan, chunk_args=True)
     result = [
       Experience(*combination)
       for combination in zip(
@@ -11,11 +11,32 @@ class Outgoing(object):
   def __init__(self, data):
     self.data = data
 
+def _edge_tensor(edges):
+  if torch.is_tensor(edges):
+    return edges.long()
+  return torch.tensor(list(edges), dtype=torch.long).view(-1, 2).t()
+
+def _adjacency_edges(adjacency):
+  lengths = torch.tensor(list(map(len, adjacency)), dtype=torch.long)
+  nodes = torch.repeat_interleave(torch.arange(lengths.size(0)), lengths)
+  neighbours = torch.tensor([
+    item
+    for edges in adjacency
+    for item in edges
+  ], dtype=torch.long)
+  return torch.stack((nodes, neighbours), dim=0)
+
+def _edge_keys(edges, node_count):
+  return edges[0] * node_count + edges[1]
+
 class NodeGraphTensor(object):
   """Node-only graph tensor."""
 
   def __init__(self, graphdesc=None):
-    """Node-only graph tensor.
+    """Node-only graph tensor. Edges are stored as a `(2, E)` tensor of
+    node and neighbour indices, holding both directions of each undirected
+    edge. Edge insertions and deletions are buffered and applied at once
+    when the edges are next read.
 
     Args:
       graphdesc (dict): dictionary of graph parameters.
@@ -24,19 +45,23 @@ class NodeGraphTensor(object):
     self._adjacency_matrix = None
     self._recompute_laplacian = True
     self._laplacian = None
+    self._added = []
+    self._deleted = []
     self.offset = 0
     self.directed = False
 
     if graphdesc is None:
       self.num_graphs = 1
       self.graph_nodes = [0]
-      self.adjacency = []
+      self.node_count = 0
+      self._edges = torch.zeros(2, 0, dtype=torch.long)
 
       self.node_tensor = torch.Tensor([])
     else:
       self.num_graphs = graphdesc["num_graphs"]
       self.graph_nodes = graphdesc["graph_nodes"]
-      self.adjacency = graphdesc["adjacency"]
+      self.node_count = len(graphdesc["adjacency"])
+      self._edges = _adjacency_edges(graphdesc["adjacency"])
 
       self.node_tensor = graphdesc["node_tensor"]
 
@@ -44,11 +69,64 @@ class NodeGraphTensor(object):
     class_name = self.__class__.__name__
     graphs = self.num_graphs
     nodes = len(self.node_tensor)
-    edges = sum([len(edge) for edge in self.adjacency]) // 2
+    edges = self.edges.size(1)
+    if not self.directed:
+      edges = edges // 2
     adj = self._adjacency_matrix is not None
     lap = self._laplacian is not None
     return f"{class_name}({graphs}, {nodes}, {edges}, has_adjacency={adj}, has_laplacian={lap})"
 
+  def _flush(self):
+    """Applies buffered edge insertions and deletions."""
+    if not self._added and not self._deleted:
+      return
+    edges = torch.cat([self._edges] + self._added, dim=1)
+    if self._deleted:
+      deleted = torch.cat(self._deleted, dim=1)
+      keep = ~torch.isin(
+        _edge_keys(edges, self.node_count),
+        _edge_keys(deleted, self.node_count)
+      )
+      edges = edges[:, keep]
+    _, order = torch.sort(edges[0], stable=True)
+    self._edges = edges[:, order]
+    self._added = []
+    self._deleted = []
+
+  @property
+  def edges(self):
+    """Tensor of node and neighbour indices of all edges."""
+    self._flush()
+    return self._edges
+
+  @edges.setter
+  def edges(self, value):
+    self._decompute_adjacency_matrix()
+    self._decompute_laplacian()
+    self._added = []
+    self._deleted = []
+    self._edges = value
+
+  @property
+  def degree(self):
+    """Number of neighbours of each node."""
+    return torch.bincount(self.edges[0], minlength=self.node_count)
+
+  @property
+  def adjacency(self):
+    """List of neighbours of each node."""
+    pointers = [0] + self.degree.cumsum(dim=0).tolist()
+    neighbours = self.edges[1].tolist()
+    return [
+      neighbours[start:stop]
+      for start, stop in zip(pointers[:-1], pointers[1:])
+    ]
+
+  @adjacency.setter
+  def adjacency(self, value):
+    self.node_count = len(value)
+    self.edges = _adjacency_edges(value)
+
   @staticmethod
   def from_networkx(nx_graph, features=None):
     """Creates a new `NodeGraphTensor` from an `nx.Graph`.
@@ -61,26 +139,27 @@ class NodeGraphTensor(object):
       `NodeGraphTensor` containing the data from the input `nx.Graph`.
     """
     out = NodeGraphTensor()
-    for node in nx_graph.nodes:
-      feats = []
-      if not features:
-        feats = [1.0]
-      else:
-        for key in features:
-          feats.append(nx_graph.nodes[node][key])
-      feats = torch.Tensor(feats)
-      out.add_node(feats)
-    for source, target in nx_graph.edges:
-      out.add_edge(source, target)
+    nodes = list(nx_graph.nodes)
+    lookup = {node: idx for idx, node in enumerate(nodes)}
+    feats = torch.Tensor([
+      [nx_graph.nodes[node][key] for key in features] if features else [1.0]
+      for node in nodes
+    ])
+    out.node_tensor = feats.unsqueeze(1)
+    out.node_count = len(nodes)
+    out.graph_nodes = [len(nodes)]
+    out.add_edges([
+      (lookup[source], lookup[target])
+      for source, target in nx_graph.edges
+    ])
     return out
 
   def to_networkx(self):
     """Creates a networkx graph from a `NodeGraphTensor`."""
     out = nx.Graph()
-    for node, edges in enumerate(self.adjacency):
+    for node in range(self.node_count):
       out.add_node(node, features=self.node_tensor[node].numpy())
-      for edge in edges:
-        out.add_edge(node, edge)
+    out.add_edges_from(self.edges.t().tolist())
     return out
 
   def node_graph(self, node):
@@ -121,79 +200,63 @@ class NodeGraphTensor(object):
     rng = self.graph_range(idx)
     return slice(rng.start, rng.stop)
 
-  def _laplacian_element(self, i, j):
-    """Laplacian element.
-
-    Args:
-      i, j (int): position for element calculation.
-
-    Returns:
-      Element of the graph Laplacian at the subscript `i, j`.
-    """
-    if i == j:
-      return len(self.adjacency[i])
-    else:
-      return -int(j in self.adjacency[i])
-
   def _compute_laplacian(self):
     """Precomputes the graph Laplacian."""
     self._recompute_laplacian = False
-    indices = [
-      (node, edge)
-      for node, edges in enumerate(self.adjacency)
-      for edge in edges + [node]
-    ]
-    values = torch.zeros(len(indices))
-    for idx, index in enumerate(indices):
-      values[idx] = self._laplacian_element(*index)
-    indices = torch.Tensor(indices).t()
+    nodes = torch.arange(self.node_count)
+    edges = self.edges
+    indices = torch.cat((edges, torch.stack((nodes, nodes), dim=0)), dim=1)
+    values = torch.cat((
+      -torch.ones(edges.size(1)),
+      self.degree.float()
+    ), dim=0)
     self._laplacian = torch.sparse_coo_tensor(
-      indices, values,
-      (len(self.adjacency), len(self.adjacency))
-    )
+      indices, values, (self.node_count, self.node_count)
+    ).coalesce()
 
   def _decompute_laplacian(self):
     """Decomputes the graph Laplacian."""
     self._laplacian = None
     self._recompute_laplacian = True
 
+  def _normalize(self, out):
+    degree = self.degree.clamp(min=1).to(out.dtype)
+    return out / degree.view(-1, *(out.dim() - 1) * [1])
+
   def laplacian_action(self, vector, matrix_free=True, normalized=False):
     """Computes the action of the graph Laplacian on a `Tensor`.
 
     Args:
-      vector (Tensor): one-dimensional `Tensor` upon which the
+      vector (Tensor): `Tensor` of node values upon which the
         Laplacian shall act.
-      matrix_free (bool): compute the Laplacian action without
-        materializing the Laplacian?
+      matrix_free (bool): compute the Laplacian action by scattering
+        over edges without materializing the Laplacian?
+      normalized (bool): normalize the Laplacian by node degrees?
     """
     if matrix_free:
-      out = torch.zeros_like(vector)
-      for node, edges in enumerate(self.adjacency):
-        out[node] = len(edges) * vector[node] - vector[edges].sum(dim=0)
-        if normalized:
-          out[node] /= len(edges)
-      return out
-    if self._recompute_laplacian:
-      self._compute_laplacian()
-    out = self._laplacian.mm(vector)
+      nodes, neighbours = self.edges
+      degree = self.degree.to(vector.dtype).view(-1, *(vector.dim() - 1) * [1])
+      out = degree * vector - torch.zeros_like(vector).index_add_(
+        0, nodes, vector[neighbours]
+      )
+    else:
+      if self._recompute_laplacian:
+        self._compute_laplacian()
+      laplacian = self._laplacian.to(vector.dtype)
+      out = torch.sparse.mm(laplacian, vector.reshape(vector.size(0), -1))
+      out = out.view(vector.shape)
     if normalized:
-      norm = torch.Tensor([len(edges) for edges in self.adjacency])
-      out /= norm
+      out = self._normalize(out)
     return out
 
   def _compute_adjacency_matrix(self):
     """Computes the graph adjacency matrix."""
     self._recompute_adjacency_matrix = False
-    indices = torch.Tensor([
-      (node, edge)
-      for node, edges in enumerate(self.adjacency)
-      for edge in edges + [node]
-    ]).t()
-    values = torch.ones(indices.size(1))
+    edges = self.edges
     self._adjacency_matrix = torch.sparse_coo_tensor(
-      indices, values,
-      (len(self.adjacency), len(self.adjacency))
-    )
+      edges, torch.ones(edges.size(1)),
+      (self.node_count, self.node_count)
+    ).coalesce()
 
   def _decompute_adjacency_matrix(self):
     """Decomputes the graph adjacency matrix."""
@@ -204,29 +267,30 @@ class NodeGraphTensor(object):
     """Computes the action of the graph adjacency matrix on a `Tensor`.
 
     Args:
-      vector (Tensor): one-dimensional `Tensor` upon which the
+      vector (Tensor): `Tensor` of node values upon which the
         adjacency matrix shall act.
-      matrix_free (bool): compute the Laplacian action without
-        materializing the adjacency matrix?
+      matrix_free (bool): compute the adjacency action by scattering
+        over edges without materializing the adjacency matrix?
     """
     if matrix_free:
-      out = torch.zeros_like(vector)
-      for node, edges in enumerate(self.adjacency):
-        out[node] = vector[edges].sum(dim=0)
-      return out
-    else:
-      if self._recompute_adjacency_matrix:
-        self._compute_adjacency_matrix()
-      return self._adjacency_matrix(vector)
+      nodes, neighbours = self.edges
+      return torch.zeros_like(vector).index_add_(0, nodes, vector[neighbours])
+    if self._recompute_adjacency_matrix:
+      self._compute_adjacency_matrix()
+    adjacency = self._adjacency_matrix.to(vector.dtype)
+    out = torch.sparse.mm(adjacency, vector.reshape(vector.size(0), -1))
+    return out.view(vector.shape)
 
   def new_like(self):
     """Creates a new empty `NodeGraphTensor` with the same
     connectivity as `self`."""
     result = NodeGraphTensor()
     result.offset = self.offset
+    result.directed = self.directed
     result.num_graphs = self.num_graphs
     result.graph_nodes = deepcopy(self.graph_nodes)
-    result.adjacency = deepcopy(self.adjacency)
+    result.node_count = self.node_count
+    result._edges = self.edges
     return result
 
   def clone(self):
@@ -249,12 +313,13 @@ class NodeGraphTensor(object):
       The graph Laplacian and adjacency matrix need to be recomputed
       afterwards, if used.
     """
+    self._flush()
     self._decompute_adjacency_matrix()
     self._decompute_laplacian()
 
     assert self.num_graphs == 1
     self.graph_nodes[self.offset] += 1
-    self.adjacency.append([])
+    self.node_count += 1
     if self.node_tensor.size(0) == 0:
       self.node_tensor = node_tensor.unsqueeze(0).unsqueeze(0)
     else:
@@ -274,35 +339,35 @@ class NodeGraphTensor(object):
       The graph Laplacian and adjacency matrix need to be recomputed
       afterwards, if used.
     """
-    self._decompute_adjacency_matrix()
-    self._decompute_laplacian()
-
-    if self.directed:
-      self.adjacency[source].append(Outgoing(target))
-      self.adjacency[target].append(Incoming(source))
-    else:
-      self.adjacency[source].append(target)
-      self.adjacency[target].append(source)
-    return len(self.adjacency[source]) - 1
+    self.add_edges([(source, target)])
 
   def add_edges(self, edges):
     """Adds a list of edges to the graph.
 
     Args:
-      edges (list (tuple int)): list of edges to add.
+      edges (list (tuple int) or Tensor): edges to add, either as a list
+        of `(source, target)` tuples, or as a tensor of shape `(2, E)`.
 
     Note:
       The graph Laplacian and adjacency matrix need to be recomputed
       afterwards, if used.
     """
-    for edge in edges:
-      self.add_edge(*edge)
+    self._decompute_adjacency_matrix()
+    self._decompute_laplacian()
+
+    # keep buffered insertions and deletions in order:
+    if self._deleted:
+      self._flush()
+    edges = _edge_tensor(edges)
+    if not self.directed:
+      edges = torch.cat((edges, edges.flip(0)), dim=1)
+    self._added.append(edges)
 
   def delete_nodes(self, nodes):
     """Deletes a list of nodes from the graph.
 
     Args:
-      nodes (list int): list of nodes to be deleted.
+      nodes (list int or Tensor): nodes to be deleted.
 
     Note:
       The graph Laplacian and adjacency matrix need to be recomputed
@@ -311,33 +376,28 @@ class NodeGraphTensor(object):
     self._decompute_adjacency_matrix()
     self._decompute_laplacian()
 
-    nodes_to_keep = []
-    new_adjacency = []
-    nodes = sorted(nodes)
-    in_graph = 0
-    node_sum = self.nodes_including(in_graph)
-    nodes_removed = 0
-    removed_index = 0
-    for node in range(len(self.adjacency)):
-      if nodes[removed_index] == node:
-        while node > node_sum:
-          self.graph_nodes[in_graph] -= nodes_removed
-          in_graph += 1
-          node_sum = self.nodes_including(in_graph)
-          nodes_removed = 0
-        nodes_removed += 1
-        removed_index += 1
-      else:
-        nodes_to_keep.append(node)
-    for node in range(len(self.adjacency)):
-      new_adjacency.append([
-        nodes_to_keep.index(target)
-        for target in self.adjacency[node]
-        if target in nodes_to_keep
-      ])
-
+    nodes = torch.as_tensor(nodes, dtype=torch.long).view(-1)
+    keep = torch.ones(self.node_count, dtype=torch.bool)
+    keep[nodes] = False
+    graphs = torch.repeat_interleave(
+      torch.arange(len(self.graph_nodes)),
+      torch.tensor(self.graph_nodes, dtype=torch.long)
+    )
+    self.graph_nodes = torch.bincount(
+      graphs[keep], minlength=len(self.graph_nodes)
+    ).tolist()
+    nodes_to_keep = keep.nonzero().view(-1)
+    self._edges = self._induced_edges(nodes_to_keep)
     self.node_tensor = self.node_tensor[nodes_to_keep]
-    self.adjacency = new_adjacency
+    self.node_count = nodes_to_keep.size(0)
+
+  def _induced_edges(self, nodes):
+    """Edges between a set of nodes, relabeled to positions in `nodes`."""
+    edges = self.edges
+    lookup = torch.full((self.node_count,), -1, dtype=torch.long)
+    lookup[nodes] = torch.arange(nodes.size(0))
+    edges = lookup[edges]
+    return edges[:, (edges >= 0).all(dim=0)]
 
   def delete_node(self, node):
     """Deletes a single node from the graph.
@@ -361,77 +421,80 @@ class NodeGraphTensor(object):
       The graph Laplacian and adjacency matrix need to be recomputed
       afterwards, if used.
     """
-    self._decompute_adjacency_matrix()
-    self._decompute_laplacian()
-
-    self.adjacency[source] = [x for x in self.adjacency[source] if x != target]
-    self.adjacency[target] = [x for x in self.adjacency[target] if x != source]
+    self.delete_edges([(source, target)])
 
   def delete_edges(self, edges):
     """Deletes a list of edges from the graph.
 
     Args:
-      edges (list (tuple int)): list of edges to be deleted.
+      edges (list (tuple int) or Tensor): edges to be deleted. See
+        `add_edges`.
 
     Note:
       The graph Laplacian and adjacency matrix need to be recomputed
       afterwards, if used.
     """
-    for edge in edges:
-      self.delete_edge(*edge)
+    self._decompute_adjacency_matrix()
+    self._decompute_laplacian()
 
-  def __getitem__(self, idx):
-    assert isinstance(idx, (int, slice, tuple))
+    if self._added:
+      self._flush()
+    edges = _edge_tensor(edges)
+    if not self.directed:
+      edges = torch.cat((edges, edges.flip(0)), dim=1)
+    self._deleted.append(edges)
 
-    out = self.new_like()
+  def _index_nodes(self, idx):
     further_indices = None
     if isinstance(idx, tuple) and len(idx) > 1:
       further_indices = idx[1:]
       idx = idx[0]
     if isinstance(idx, int):
       out_range = self.graph_range(idx)
-      out.num_graphs = 1
-      out.graph_nodes = [self.graph_nodes[idx]]
+      graph_nodes = [self.graph_nodes[idx]]
     elif isinstance(idx, slice):
-      out_range = slice(
+      out_range = range(
         self.graph_range(idx.start).start,
         self.graph_range(idx.stop-1).stop
       )
-      out.num_graphs = max(0, idx.stop - idx.start)
-      out.graph_nodes = [
+      graph_nodes = [
         self.graph_nodes[k]
         for k in range(idx.start, idx.stop)
       ]
-    out.node_tensor = self.node_tensor[out_range.start:out_range.stop]
+    nodes = torch.arange(out_range.start, out_range.stop)
     if further_indices is not None:
-      out.node_tensor = out.node_tensor[further_indices]
-    out.adjacency = self.adjacency[out_range.start:out_range.stop]
+      nodes = nodes[further_indices[0]].view(-1)
+    return nodes, graph_nodes, further_indices
+
+  def __getitem__(self, idx):
+    assert isinstance(idx, (int, slice, tuple))
+
+    out = self.new_like()
+    nodes, graph_nodes, further_indices = self._index_nodes(idx)
+    out.num_graphs = len(graph_nodes)
+    out.graph_nodes = graph_nodes
+    out.node_tensor = self.node_tensor[nodes]
     if further_indices is not None:
-      out.adjacency = out.adjacency[further_indices[0]]
+      out.node_tensor = out.node_tensor[(slice(None),) + further_indices[1:]]
+    out._edges = self._induced_edges(nodes)
+    out.node_count = nodes.size(0)
     return out
 
   def __setitem__(self, idx, value):
     assert isinstance(idx, (int, slice, tuple))
 
-    further_indices = None
-    if isinstance(idx, tuple) and len(idx) > 1:
-      further_indices = idx[1:]
-      idx = idx[0]
-    if isinstance(idx, int):
-      out_range = self.graph_range(idx)
-    elif isinstance(idx, slice):
-      out_range = slice(
-        self.graph_range(idx.start).start,
-        self.graph_range(idx.stop-1).stop
-      )
-    if further_indices is not None:
-      self.node_tensor[out_range.start:out_range.stop, further_indices] = value.node_tensor
-    else:
-      self.node_tensor[out_range.start:out_range.stop] = value.node_tensor
+    nodes, _, further_indices = self._index_nodes(idx)
     if further_indices is not None:
-      self.adjacency[out_range.start:out_range.stop][further_indices[0]] = value.adjacency
+      self.node_tensor[(nodes,) + further_indices[1:]] = value.node_tensor
     else:
-      self.adjacency[out_range.start:out_range.stop] = value.adjacency
+      self.node_tensor[nodes] = value.node_tensor
+
+    # replace the edges among the indexed nodes by those of `value`:
+    inside = torch.zeros(self.node_count, dtype=torch.bool)
+    inside[nodes] = True
+    edges = self.edges
+    self.edges = edges[:, ~(inside[edges[0]] & inside[edges[1]])]
+    self._added.append(nodes[value.edges])
 
   def append(self, graph_tensor):
     """Appends a `NodeGraphTensor` to the end of an existing `NodeGraphTensor`.
@@ -444,8 +507,8 @@ class NodeGraphTensor(object):
 
     assert self.offset == 0
     self.num_graphs += graph_tensor.num_graphs
-    self.adjacency += list(map(
-      lambda x: x + len(self.adjacency), graph_tensor.adjacency))
+    self._edges = torch.cat((self.edges, graph_tensor.edges + self.node_count), dim=1)
+    self.node_count += graph_tensor.node_count
     self.graph_nodes += graph_tensor.graph_nodes
     self.node_tensor = torch.cat((self.node_tensor, graph_tensor.node_tensor), 0)
 
@@ -531,25 +594,23 @@ class PartitionedNodeGraphTensor(NodeGraphTensor):
     return node
 
   def delete_nodes(self, nodes):
-    nodes_to_keep = [
-      node
-      for node in range(len(self.adjacency))
-      if node not in nodes
-    ]
+    nodes = torch.as_tensor(nodes, dtype=torch.long).view(-1)
+    keep = torch.ones(self.node_count, dtype=torch.bool)
+    keep[nodes] = False
+    lookup = keep.long().cumsum(dim=0) - 1
+    def _remaining(members):
+      members = torch.tensor(members, dtype=torch.long)
+      return lookup[members[keep[members]]].tolist()
     self.partition = {
-      kind : [
-        nodes_to_keep.index(node)
-        for node in self.partition[kind]
-        if node not in nodes
-      ]
-      for kind in self.partition
+      kind : _remaining(members)
+      for kind, members in self.partition.items()
     }
     super(PartitionedNodeGraphTensor, self).delete_nodes(nodes)
 
   def append(self, graph_tensor):
     for kind in self.partition:
       self.partition[kind] += list(map(
-        lambda x: x + len(self.adjacency), graph_tensor.partition[kind]))
+        lambda x: x + self.node_count, graph_tensor.partition[kind]))
     super(PartitionedNodeGraphTensor, self).append(graph_tensor)
 
 def _batch_graphs(graphs):
@@ -558,7 +619,23 @@ def _batch_graphs(graphs):
   Args:
     graphs (iterable): graphs to be concatenated.
   """
+  graphs = list(graphs)
   result = graphs[0].clone()
-  for idx in range(1, len(graphs)):
-    result.append(graphs[idx])
+  if isinstance(graphs[0], PartitionedNodeGraphTensor):
+    for graph in graphs[1:]:
+      result.append(graph)
+    return result
+  offsets = torch.tensor([0] + [graph.node_count for graph in graphs[:-1]]).cumsum(dim=0)
+  result.num_graphs = sum(graph.num_graphs for graph in graphs)
+  result.graph_nodes = [
+    nodes
+    for graph in graphs
+    for nodes in graph.graph_nodes
+  ]
+  result.node_count = sum(graph.node_count for graph in graphs)
+  result.edges = torch.cat([
+    graph.edges + offset
+    for graph, offset in zip(graphs, offsets.tolist())
+  ], dim=1)
+  result.node_tensor = torch.cat([graph.node_tensor for graph in graphs], dim=0)
   return result
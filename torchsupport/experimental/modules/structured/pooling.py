@@ -2,7 +2,9 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as func
 
-from torchsupport.modules.structured.graphnn import StandardNodeTraversal
+from torchsupport.structured import scatter
+from torchsupport.structured.structures import ScatterStructure
+from torchsupport.structured.modules.spectral import structure_operator
 
 class ReNode(nn.Module):
   def __init__(self, reduction):
@@ -50,19 +52,26 @@ class ReNode(nn.Module):
     result.node_tensor = new_nodes
     return result
 
+def _segment_rank(values, indices):
+  # rank of each value within its segment, in descending order:
+  order = torch.argsort(values, descending=True)
+  order = order[torch.sort(indices[order], stable=True)[1]]
+  segment = scatter.segment_index(indices)
+  rank = torch.empty_like(order)
+  rank[order] = torch.arange(order.size(0), device=order.device)
+  return rank - segment.offsets[indices]
+
 class LearnedColorPool(nn.Module):
-  def __init__(self, channels, pooling, order=None,
-               traversal=StandardNodeTraversal(1),
+  def __init__(self, channels, pooling=scatter.max,
                attention_activation=nn.Tanh(),
                activation=nn.ReLU()):
     """Generalization of pooling from images to graphs, using learned
-    pooling centers and attention.
+    pooling centers and attention. The half of the nodes of each graph
+    with the largest attention are chosen as pooling centers.
 
     Args:
       channels (int): number of node features.
-      pooling (callable): pooling function.
-      order (callable): function specifying a sort order for nodes to be pooled.
-      traversal (callable): function computing a neighbourhood traversal for a given node.
+      pooling (callable): scatter reduction pooling the nodes of a cluster.
     """
     super(LearnedColorPool, self).__init__()
     self.embedding = nn.Linear(channels, channels)
@@ -70,40 +79,33 @@ class LearnedColorPool(nn.Module):
     self.activation = activation
     self.chosen = None
     self.color_pool = ColorPool(
-      pooling, order=order, coloring=lambda x: self.chosen, traversal=traversal
+      pooling, coloring=lambda data, structure: self.chosen
     )
 
-  def forward(self, graph):
-    embedding = self.embedding(graph)
-    attention = embedding.dot(graph)
-    all_topk = []
-    graph_sum = 0
-    for idx, graph_nodes in enumerate(graph.graph_nodes):
-      _, indices = torch.topk(
-        attention.node_tensor[graph.graph_range(idx)],
-        graph_nodes // 2
-      )
-      all_topk.append(indices + graph_sum)
-      graph_sum += graph_nodes
-    all_topk = torch.cat(all_topk, dim=0).reshape(-1)
-    attention.node_tensor = self.attention_activation(attention.node_tensor)
-    attended = self.activation(graph * abs(attention) + graph)
-    self.chosen = all_topk
-    return self.color_pool(attended)
+  def forward(self, data, structure, membership):
+    attention = (self.embedding(data) * data).sum(dim=-1)
+    counts = scatter.segment_index(membership).counts
+    rank = _segment_rank(attention, membership)
+    self.chosen = (rank < (counts // 2)[membership]).nonzero().view(-1)
+    attention = self.attention_activation(attention).unsqueeze(-1)
+    attended = self.activation(data * abs(attention) + data)
+    return self.color_pool(attended, structure)
 
 def MinimumDegreeNodeColoring():
   """Partitions a graph using a heuristic choosing all nodes with non-minimum
   connectivity in their neighbourhood.
   """
-  def color(graph):
-    chosen = []
-    for idx in range(len(graph.adjacency)):
-      lengths = [len(graph.adjacency[edge]) for edge in graph.adjacency[idx]]
-      self_length = len(graph.adjacency[idx])
-      minimum = min(lengths + [self_length])
-      if self_length != minimum:
-        chosen.append(idx)
-    return torch.LongTensor(chosen)
+  def color(data, structure):
+    node_count = int(structure.node_count)
+    degree = torch.bincount(structure.indices, minlength=node_count)
+    minimum = scatter.min(
+      degree[structure.connections], structure.indices, dim_size=node_count
+    )
+    minimum = minimum[0] if isinstance(minimum, tuple) else minimum
+    # isolated nodes only compare to themselves:
+    has_neighbours = degree > 0
+    chosen = has_neighbours & (degree > minimum)
+    return chosen.nonzero().view(-1)
   return color
 
 def MaximumEigenvectorNodeColoring(n_iter=2, matrix_free=True):
@@ -111,7 +113,8 @@ def MaximumEigenvectorNodeColoring(n_iter=2, matrix_free=True):
 
   Args:
     n_iter (int): number of power iterations for eigenvector estimate.
-    matrix_free (bool): construct Laplacian elements on the fly?
+    matrix_free (bool): apply the Laplacian by scattering over edges
+      instead of building a sparse matrix?
 
   Returns:
     graph partition obtained by choosing all nodes with values > 0
@@ -119,106 +122,125 @@ def MaximumEigenvectorNodeColoring(n_iter=2, matrix_free=True):
     graph Laplacian, obtained by power iteration.
 
   Note:
-    For large graphs and batch sizes, this may result in excessive
-    memory consumption if not using `matrix_free = True`. On the
-    other hand, setting `matrix_free = True` results in higher
-    computational load.
+    The sparse Laplacian is cached on the structure, which pays off
+    if the same structure is colored repeatedly.
   """
-  def color(graph):
-    values = func.normalize(torch.randn(graph.node_tensor.size(0), 1), dim=0)
+  def color(data, structure):
+    node_count = int(structure.node_count)
+    indices, connections = structure.indices, structure.connections
+    degree = torch.bincount(indices, minlength=node_count).to(data.dtype).unsqueeze(-1)
+    laplacian = None
+    if not matrix_free:
+      laplacian = structure_operator(
+        structure, "laplacian", dtype=data.dtype, device=data.device
+      )
+    values = func.normalize(torch.randn(node_count, 1, device=data.device), dim=0)
     for _ in range(n_iter):
-      values = func.normalize(graph.laplacian_action(values, matrix_free=matrix_free), dim=0)
-    chosen = (values > 0).reshape(-1).nonzero().numpy()
-    return torch.LongTensor(chosen)
+      if laplacian is not None:
+        values = torch.sparse.mm(laplacian, values)
+      else:
+        values = degree * values - scatter.add(
+          values[connections], indices, dim_size=node_count
+        )
+      values = func.normalize(values, dim=0)
+    return (values > 0).view(-1).nonzero().view(-1)
   return color
 
+def color_clusters(centers, structure):
+  r"""Assigns each node of a graph to a cluster around a set of pooling
+  centers. Nodes adjacent to a pooling center join the cluster of the
+  adjacent center of lowest index, other nodes form their own cluster.
+
+  Args:
+    centers (torch.Tensor): indices of pooling centers.
+    structure (ScatterStructure): graph structure.
+
+  Returns:
+    Cluster index of each node, numbered in order of the first node of
+    each cluster, and the number of clusters.
+  """
+  node_count = int(structure.node_count)
+  indices, connections = structure.indices, structure.connections
+  nodes = torch.arange(node_count, device=indices.device)
+  is_center = torch.zeros(node_count, dtype=torch.bool, device=indices.device)
+  is_center[centers] = True
+  candidate = torch.where(
+    is_center[connections], connections, torch.full_like(connections, node_count)
+  )
+  nearest = scatter.min(candidate, indices, dim_size=node_count)
+  nearest = nearest[0] if isinstance(nearest, tuple) else nearest
+  has_center = scatter.add(
+    is_center[connections].long(), indices, dim_size=node_count
+  ) > 0
+  nearest = torch.where(has_center, nearest, nodes)
+  roots = torch.where(is_center, nodes, nearest)
+  unique, assignment = torch.unique(roots, return_inverse=True)
+  return assignment, unique.size(0)
+
+def coarsen_structure(structure, assignment, cluster_count):
+  r"""Contracts the edges of a graph along a cluster assignment. Edges
+  within a cluster are removed and parallel edges merged.
+
+  Args:
+    structure (ScatterStructure): graph structure.
+    assignment (torch.Tensor): cluster index of each node.
+    cluster_count (int): number of clusters.
+
+  Returns:
+    :class:`ScatterStructure` on clusters.
+  """
+  indices = assignment[structure.indices]
+  connections = assignment[structure.connections]
+  keep = indices != connections
+  edges = torch.unique(indices[keep] * cluster_count + connections[keep])
+  return ScatterStructure(
+    structure.source, structure.target,
+    edges // cluster_count, edges % cluster_count,
+    node_count=cluster_count
+  )
+
 class ColorPool(nn.Module):
-  def __init__(self, pooling, order=None,
-               coloring=MaximumEigenvectorNodeColoring(),
-               traversal=StandardNodeTraversal(1)):
+  def __init__(self, pooling=scatter.max,
+               coloring=MaximumEigenvectorNodeColoring()):
     """Generalization of (maximum-) pooling from images to graphs.
     Chooses a set of pooling centers using a user specified `coloring`,
-    and pools the pooling centers' neighbourhoods generated using a user
-    specified `traversal` according to a `pooling` function.
+    and pools the pooling centers' neighbourhoods according to a
+    `pooling` function. Nodes in the neighbourhood of several pooling
+    centers are pooled into the center of lowest index, and nodes
+    outside of any neighbourhood are kept as is.
 
     Args:
-      pooling (callable): pooling function.
-      order (callable): function specifying a sort order for nodes to be pooled.
-      coloring (callable): function specifying pooling centers on a graph.
-      traversal (callable): function computing a neighbourhood traversal for a given node.
+      pooling (callable): scatter reduction pooling the nodes of a cluster.
+      coloring (callable): function specifying pooling centers given node
+        features and a graph structure.
     """
     super(ColorPool, self).__init__()
     self.pooling = pooling
-    self.order = order
     self.coloring = coloring
-    self.traversal = traversal
 
-  def _pooled_nodes(self, selected_nodes, neighbourhoods):
-    return [
-      node
-      for node in set(sum(neighbourhoods, []))
-      if node not in selected_nodes
-    ]
-
-  def _expanded_edges(self, graph, nodes_to_delete):
-    return [
-      (node, target)
-      for skip in nodes_to_delete
-      for idx, node in enumerate(graph.adjacency[skip])
-      for target in graph.adjacency[skip][idx+1:]
-      if (node not in nodes_to_delete) and (target not in nodes_to_delete)
-    ]
-
-  def _ordered_neighbourhoods(self, graph, selected_nodes):
-    neighbourhoods = []
-    for node in selected_nodes:
-      nodes = self.traversal(graph, node)
-      if self.order is not None:
-        nodes = self.order(graph, nodes)
-      neighbourhoods.append(nodes)
-    return neighbourhoods
-
-  def forward(self, graph):
-    # select pooling centers and compute pooling neighbourhoods:
-    pooling_centers = self.coloring(graph)
-    neighbourhoods = self._ordered_neighbourhoods(graph, pooling_centers)
-
-    # nodes and edges to be amended:
-    nodes_to_delete = self._pooled_nodes(pooling_centers, neighbourhoods)
-    edges_to_add = self._expanded_edges(graph, nodes_to_delete)
-
-    # pool and cull graph:
-    out = graph.clone()
-    out.add_edges(edges_to_add)
-    out.delete_nodes(nodes_to_delete)
-    out.node_tensor = torch.cat([
-      self.pooling(graph.node_tensor[[node] + neighbourhoods[idx]])
-      for idx, node in enumerate(pooling_centers)
-    ], dim=0)
-    return out, pooling_centers
+  def forward(self, data, structure):
+    pooling_centers = self.coloring(data, structure)
+    assignment, cluster_count = color_clusters(pooling_centers, structure)
+    pooled = self.pooling(data, assignment, dim_size=cluster_count)
+    pooled = pooled[0] if isinstance(pooled, tuple) else pooled
+    coarse = coarsen_structure(structure, assignment, cluster_count)
+    return pooled, coarse, assignment
 
 class ColorUnpool(nn.Module):
-  def __init__(self, unpool):
+  def __init__(self, unpool=None):
     """Generalization of (maximum-) unpooling from images to graphs.
-    Unpools a graph previously pooled using `ColorPool` by applying
-    a partial inverse unpool operation broadcasting data from pooling
-    centers to pooled nodes.
+    Unpools a graph previously pooled using `ColorPool` by broadcasting
+    data from each cluster to its nodes.
 
     Args:
-      unpool (callable): unpooling operation.
+      unpool (callable): optional operation combining the data of a
+        guide graph with the broadcast cluster data.
     """
     super(ColorUnpool, self).__init__()
     self.unpool = unpool
 
-  def forward(self, graph, indices, guide_graph):
-    out = guide_graph.new_like()
-    out.node_tensor = torch.zeros((guide_graph.size(0), *graph.size[1:]))
-    for node, edges in enumerate(guide_graph.adjacency):
-      if node in indices:
-        out.node_tensor[node] = graph.node_tensor[indices.index(node)]
-        for target in edges:
-          out.node_tensor[target] = self.unpool(
-            out.node_tensor[target],
-            graph.node_tensor[indices.index(node)]
-          )
-    return out
+  def forward(self, data, assignment, guide=None):
+    result = data[assignment]
+    if self.unpool is not None and guide is not None:
+      result = self.unpool(guide, result)
+    return result
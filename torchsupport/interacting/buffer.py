@@ -2,7 +2,7 @@ import torch
 import torch.multiprocessing as mp
 
 from torchsupport.interacting.control import ReadWriteControl
-from torchsupport.data.namedtuple import NamedTuple, namedtuple
+from torchsupport.data.namedtuple import Record, namedtuple
 
 class AbstractBuffer:
   def __getitem__(self, index):
@@ -284,11 +284,25 @@ class CombinedBuffer(AbstractBuffer):
     })
     return result
 
+  def raw_sample_batch(self, indices):
+    result = self.data_type.Batch(**{
+      key: self.buffers[key].raw_sample(indices)
+      for key in self.buffers
+    })
+    return result
+
   def sample(self, size):
     with self.ctrl.read:
       indices = torch.randint(len(self), (size,))
       return self.raw_sample(indices)
 
+  def sample_batch(self, size):
+    r"""Samples like :meth:`sample`, returning a :attr:`data_type.Batch`
+    which supports indexing and slicing along the sample dimension."""
+    with self.ctrl.read:
+      indices = torch.randint(len(self), (size,))
+      return self.raw_sample_batch(indices)
+
   def pull_changes(self):
     for key in self.buffers:
       self.buffers[key].pull_changes()
@@ -304,7 +318,7 @@ class CombinedBuffer(AbstractBuffer):
 
   def data_size(self, data):
     items = {}
-    if isinstance(data, NamedTuple):
+    if isinstance(data, Record):
       data = data.asdict()
     result_size = None
     for key in self.buffers:
@@ -435,7 +449,7 @@ def SchemaBuffer(schema, size, double=False):
       key : SchemaBuffer(schema[key], size)
       for key in schema
     })
-  elif isinstance(schema, NamedTuple):
+  elif isinstance(schema, Record):
     result = SchemaBuffer(schema.asdict(), size)
   else:
     raise ValueError(f"{type(schema)} is not a valid schema type.")
@@ -60,6 +60,7 @@ class EnvironmentCollector(AbstractCollector):
     self.discount = discount
     self.environment = environment
     self.policy = policy.move()
+    self.step_schema = None
 
   def pull_changes(self):
     self.policy.pull()
@@ -116,6 +117,26 @@ class EnvironmentCollector(AbstractCollector):
       result = [step.replace(returns=discounted)] + result
     return result
 
+  def process_trajectory_batch(self, trajectory):
+    r"""Computes discounted returns for a trajectory, stacking its steps
+    into a single batch instead of a list of steps.
+
+    Args:
+      trajectory (list): list of steps of type :attr:`data_type`.
+
+    Returns:
+      A :attr:`data_type.Batch` holding one tensor per field.
+    """
+    if self.step_schema is None:
+      self.step_schema = self.schema()
+    batch = self.data_type.Batch.stack(trajectory, schema=self.step_schema)
+    returns = torch.zeros_like(batch.rewards)
+    discounted = 0
+    for idx in reversed(range(len(batch))):
+      discounted = batch.rewards[idx] + self.discount * discounted
+      returns[idx] = discounted
+    return batch.replace(returns=returns)
+
   def compute_statistics(self, trajectory):
     total = sum(map(lambda x: x.rewards, trajectory))
     length = len(trajectory)
@@ -208,6 +229,13 @@ class EnergyCollector(AbstractCollector):
     ]
     return trajectory
 
+  def split_trajectory_batch(self, state):
+    r"""Wraps a batched sampler state as a single :attr:`data_type.Batch`
+    instead of splitting it into a list of samples."""
+    shaped_args = state.args or [None] * len(state.initial_state)
+    state = state.replace(args=shaped_args)
+    return self.data_type.Batch(**state.asdict())
+
   def sample_trajectory(self):
     self.pull_changes()
     self.initialize()
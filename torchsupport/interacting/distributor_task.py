@@ -17,16 +17,8 @@ class ChunkedDistributor(DefaultDistributor):
     self.chunk_size = chunk_size
 
   def stack(self, chunk):
-    tmp = {}
-    for item in chunk:
-      item = item._as_dict()
-      for field in item:
-        if field not in tmp:
-          tmp[field] = []
-        tmp[field].append(item[field].unsqueeze(0))
-    for field in tmp:
-      tmp[field] = torch.cat(tmp[field], dim=0)
-    return type(chunk[0])(**tmp)
+    kind = type(chunk[0])
+    return kind(**kind.Batch.stack(chunk).asdict())
 
   def schema(self, inputs):
     chunk = [inputs] * self.chunk_size
@@ -34,11 +26,12 @@ class ChunkedDistributor(DefaultDistributor):
     return result
 
   def commit_trajectory(self, results):
+    results = list(results)
     if len(results) < self.chunk_size:
-      results += results[-1] * (self.chunk_size - len(results))
+      results += [results[-1]] * (self.chunk_size - len(results))
 
     chunked = []
-    for idx, _ in enumerate(results[:self.chunk_size + 1]):
+    for idx in range(len(results) - self.chunk_size + 1):
       chunk = self.stack(results[idx:idx + self.chunk_size])
       chunked.append(chunk)
     return chunked
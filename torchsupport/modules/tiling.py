@@ -0,0 +1,262 @@
+import math
+import tempfile
+import warnings
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+def receptive_halo(net, scale=1):
+  r"""Estimates the number of input pixels on each side of an output pixel
+  which influence that pixel in a fully convolutional network. Nested
+  modules with a `hole` and a `downscale` attribute (see
+  :class:`torchsupport.modules.unet.NestedModule`) are assumed to run
+  their hole at a resolution reduced by `downscale`, pooling before and
+  upsampling after it. Pooling applied by calling functions, rather than
+  modules, is not counted.
+
+  Args:
+    net (nn.Module): fully convolutional network.
+    scale (int): size of one pixel at the resolution of `net` in input pixels.
+  """
+  if isinstance(net, nn.modules.conv._ConvNd):
+    return scale * max(
+      int(math.ceil((size - 1) * dilation / 2))
+      for size, dilation in zip(net.kernel_size, net.dilation)
+    )
+  if isinstance(net, (nn.MaxPool2d, nn.AvgPool2d)):
+    kernel = net.kernel_size
+    kernel = kernel if isinstance(kernel, int) else max(kernel)
+    return scale * kernel // 2
+  hole = getattr(net, "hole", None)
+  downscale = getattr(net, "downscale", 1)
+  result = 0
+  if hole is not None and downscale > 1:
+    # pooling and interpolation shift the pooling grid by up to one
+    # pooled pixel on either side:
+    result += 2 * scale * downscale
+  for child in net.children():
+    if hole is not None and child is hole:
+      result += receptive_halo(child, scale * downscale)
+    else:
+      result += receptive_halo(child, scale)
+  return result
+
+def downscale_factor(net):
+  r"""Computes the total downscaling factor of a nested network, which
+  tile positions need to be aligned to for tiled evaluation to reproduce
+  the pooling grid of full evaluation."""
+  hole = getattr(net, "hole", None)
+  result = 1
+  for child in net.children():
+    factor = downscale_factor(child)
+    if hole is not None and child is hole:
+      factor *= getattr(net, "downscale", 1)
+    result = max(result, factor)
+  return result
+
+def _functional_pooling(net):
+  return [
+    module for module in net.modules()
+    if callable(getattr(module, "pooling", None))
+    and not isinstance(module.pooling, nn.Module)
+  ]
+
+def _instance_statistics(net):
+  return [
+    module for module in net.modules()
+    if isinstance(module, (nn.modules.instancenorm._InstanceNorm, nn.GroupNorm))
+  ]
+
+def _round_up(value, multiple):
+  return int(math.ceil(value / multiple) * multiple)
+
+def blend_window(size, overlap):
+  r"""Weight window for blending overlapping tiles. Weights ramp up
+  linearly over `overlap` pixels at each edge and are one elsewhere."""
+  ramp = torch.ones(size)
+  if overlap > 0:
+    edge = (torch.arange(overlap, dtype=torch.float) + 0.5) / overlap
+    ramp[:overlap] = edge
+    ramp[-overlap:] = edge.flip(0)
+  return ramp[:, None] * ramp[None, :]
+
+class ArraySource(object):
+  r"""Tile source reading from an array of shape `(channels, height, width)`,
+  e.g. a memory-mapped numpy array. Regions outside the array are zero."""
+  def __init__(self, array):
+    self.array = array
+    self.size = (array.shape[2], array.shape[1])
+
+  def read(self, x, y, width, height):
+    result = np.zeros((self.array.shape[0], height, width), dtype=np.float32)
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + width, self.size[0]), min(y + height, self.size[1])
+    if left < right and top < bottom:
+      result[:, top - y:bottom - y, left - x:right - x] = \
+        self.array[:, top:bottom, left:right]
+    return torch.from_numpy(result)
+
+  def prefetch(self, windows):
+    pass
+
+class SlideSource(object):
+  r"""Tile source reading from a level of a
+  :class:`torchsupport.data.slides.SlideImage`."""
+  def __init__(self, slide, level=0):
+    self.slide = slide
+    self.level = level
+    self.downsample = slide.slide.level_downsamples[level]
+    self.size = slide.slide.level_dimensions[level]
+
+  def _position(self, x, y):
+    return (int(x * self.downsample), int(y * self.downsample))
+
+  def read(self, x, y, width, height):
+    return self.slide.tile_at(
+      self._position(x, y), level=self.level,
+      size=(width, height), origin=(0, 0)
+    )[0]
+
+  def prefetch(self, windows):
+    if not windows:
+      return
+    _, _, width, height = windows[0]
+    self.slide.prefetch(
+      [self._position(x, y) for x, y, _, _ in windows],
+      level=self.level, size=(width, height), origin=(0, 0)
+    )
+
+class TiledInference(object):
+  r"""Evaluates a fully convolutional network (e.g. :class:`UNetBackbone`)
+  on images too large to fit into memory. Tiles are read with a halo of
+  context sized to the network's receptive field, evaluated in batches,
+  cropped to their interior and blended into a (memory-mapped) output
+  array using linear ramp windows across tile overlaps. Peak memory
+  depends only on tile and batch size.
+
+  Tiled evaluation reproduces full evaluation away from image borders, as
+  long as the network does not use global statistics (e.g. instance
+  normalization) and the halo covers its receptive field. Networks
+  normalizing by per-image statistics therefore trigger a warning.
+  Networks pooling through a function stored in a `pooling` attribute
+  (e.g. :class:`torchsupport.networks.unet.UNet`) require an explicit
+  `halo` and `alignment`, as their receptive field cannot be estimated.
+
+  Args:
+    net (nn.Module): fully convolutional network producing outputs at
+      input resolution.
+    tile_size (int): size of the output region of each tile.
+    overlap (int): number of pixels across which neighbouring tiles are blended.
+    halo (int): context pixels read around each tile. Defaults to the
+      receptive field estimated by :func:`receptive_halo`.
+    alignment (int): multiple tile positions are aligned to. Defaults to
+      the downscaling factor estimated by :func:`downscale_factor`.
+    batch_size (int): number of tiles evaluated at once.
+    transform (callable): transformation applied to each batch of input tiles.
+    device (str): device to run the network on.
+  """
+  def __init__(self, net, tile_size=512, overlap=64, halo=None,
+               alignment=None, batch_size=4, transform=None, device="cpu"):
+    self.net = net
+    if _functional_pooling(net) and (halo is None or alignment is None):
+      raise ValueError(
+        "Networks using functional pooling need an explicit `halo` and "
+        "`alignment` for tiled inference."
+      )
+    if _instance_statistics(net):
+      warnings.warn(
+        "Network normalizes by per-image statistics, tiled inference "
+        "will not match whole-image inference."
+      )
+    alignment = alignment or downscale_factor(net)
+    self.tile_size = _round_up(tile_size, alignment)
+    self.overlap = _round_up(overlap, alignment) if overlap > 0 else 0
+    if self.overlap >= self.tile_size:
+      raise ValueError("`overlap` needs to be smaller than `tile_size`.")
+    halo = receptive_halo(net) if halo is None else halo
+    self.halo = _round_up(halo, alignment)
+    self.batch_size = batch_size
+    self.transform = transform or (lambda x: x)
+    self.device = device
+
+  def positions(self, width, height):
+    stride = self.tile_size - self.overlap
+    return [
+      (x, y)
+      for y in range(0, max(height - self.overlap, 1), stride)
+      for x in range(0, max(width - self.overlap, 1), stride)
+    ]
+
+  def _windows(self, positions):
+    size = self.tile_size + 2 * self.halo
+    return [
+      (x - self.halo, y - self.halo, size, size)
+      for x, y in positions
+    ]
+
+  def __call__(self, source, output=None, path=None, level=0):
+    r"""Evaluates the network on a full image.
+
+    Args:
+      source (SlideImage or array): image to process. Arrays are of shape
+        `(channels, height, width)`.
+      output (array): optional zero-initialized array of shape
+        `(channels, height, width)` to write results to.
+      path (str): optional path of a `.npy` file to memory-map the output to.
+      level (int): pyramid level of a :class:`SlideImage` to process.
+
+    Returns:
+      Array of network outputs of shape `(channels, height, width)`.
+    """
+    if hasattr(source, "tile_at"):
+      source = SlideSource(source, level=level)
+    elif not hasattr(source, "read"):
+      source = ArraySource(source)
+    width, height = source.size
+    positions = self.positions(width, height)
+    window = blend_window(self.tile_size, self.overlap)
+    weight_file = tempfile.TemporaryFile()
+    weights = np.memmap(weight_file, dtype=np.float32, mode="w+", shape=(height, width))
+
+    tile, halo = self.tile_size, self.halo
+    training = self.net.training
+    self.net.eval()
+    try:
+      batches = [
+        positions[start:start + self.batch_size]
+        for start in range(0, len(positions), self.batch_size)
+      ]
+      source.prefetch(self._windows(batches[0]) if batches else [])
+      with torch.no_grad():
+        for idx, batch in enumerate(batches):
+          if idx + 1 < len(batches):
+            source.prefetch(self._windows(batches[idx + 1]))
+          inputs = torch.stack([
+            source.read(*window_position)
+            for window_position in self._windows(batch)
+          ], dim=0)
+          inputs = self.transform(inputs).to(self.device)
+          outputs = self.net(inputs)[:, :, halo:halo + tile, halo:halo + tile]
+          outputs = (outputs.cpu().float() * window).numpy()
+          if output is None:
+            shape = (outputs.shape[1], height, width)
+            if path is None:
+              output = np.zeros(shape, dtype=np.float32)
+            else:
+              output = np.lib.format.open_memmap(
+                path, mode="w+", dtype=np.float32, shape=shape
+              )
+          for (x, y), result in zip(batch, outputs):
+            valid_x, valid_y = min(tile, width - x), min(tile, height - y)
+            output[:, y:y + valid_y, x:x + valid_x] += result[:, :valid_y, :valid_x]
+            weights[y:y + valid_y, x:x + valid_x] += window[:valid_y, :valid_x].numpy()
+      for y in range(0, height, tile):
+        output[:, y:y + tile] /= weights[None, y:y + tile]
+      if hasattr(output, "flush"):
+        output.flush()
+    finally:
+      self.net.train(training)
+      del weights
+      weight_file.close()
+    return output
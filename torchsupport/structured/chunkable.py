@@ -1,51 +1,303 @@
+from bisect import bisect_left
+
 import torch
 from torch.nn.parallel.scatter_gather import Scatter
 
-def chunk_sizes(lengths, num_targets):
-  num_entities = len(lengths)
-  chops = num_entities // num_targets
-  result = [
-    sum(lengths[idx * chops:(idx + 1) * chops])
-    for idx in range(num_targets)
-  ]
+COST_KINDS = ("elements", "edges")
+
+class ChunkPlan():
+  r"""Assignment of consecutive batch items to chunks. A single plan is
+  shared by all :class:`Chunkable` objects of a batch, such that their
+  chunks stay aligned.
+
+  Args:
+    counts (list): number of batch items assigned to each chunk.
+  """
+  def __init__(self, counts):
+    self.counts = list(counts)
+    self.offsets = [0]
+    for count in self.counts:
+      self.offsets.append(self.offsets[-1] + count)
+
+  @property
+  def total(self):
+    return self.offsets[-1]
+
+  def __len__(self):
+    return len(self.counts)
+
+  def split(self, items):
+    r"""Splits a per-item sequence according to the plan.
+
+    Args:
+      items (list or torch.Tensor): sequence with one entry per batch item.
+    """
+    return [
+      items[start:stop]
+      for start, stop in zip(self.offsets[:-1], self.offsets[1:])
+    ]
+
+  def sizes(self, lengths):
+    r"""Computes the number of elements contained in each chunk.
+
+    Args:
+      lengths (list or torch.Tensor): number of elements per batch item.
+    """
+    return [int(sum(chunk)) for chunk in self.split(lengths)]
+
+def _prefix_sums(costs):
+  result = [0.0]
+  for cost in costs:
+    result.append(result[-1] + cost)
   return result
 
+def _greedy_partition(costs, num_chunks):
+  prefix = _prefix_sums(costs)
+  total = prefix[-1]
+  boundaries = [0]
+  for idx in range(1, num_chunks):
+    lower = boundaries[-1] + 1
+    upper = len(costs) - (num_chunks - idx)
+    target = total * idx / num_chunks
+    position = bisect_left(prefix, target, lower, upper + 1)
+    position = min(max(position, lower), upper)
+    if position > lower:
+      if target - prefix[position - 1] < prefix[position] - target:
+        position -= 1
+    boundaries.append(position)
+  boundaries.append(len(costs))
+  return [
+    stop - start
+    for start, stop in zip(boundaries[:-1], boundaries[1:])
+  ]
+
+def _fill_partition(costs, bound):
+  counts = []
+  current = 0.0
+  count = 0
+  for cost in costs:
+    if count > 0 and current + cost > bound:
+      counts.append(count)
+      current, count = 0.0, 0
+    current += cost
+    count += 1
+  counts.append(count)
+  return counts
+
+def _contiguous_partition(costs, num_chunks):
+  lower, upper = max(costs), sum(costs)
+  for _ in range(64):
+    if upper - lower <= 1e-6 * max(upper, 1.0):
+      break
+    middle = (lower + upper) / 2
+    if len(_fill_partition(costs, middle)) <= num_chunks:
+      upper = middle
+    else:
+      lower = middle
+  counts = _fill_partition(costs, upper)
+
+  # splitting chunks never increases the maximum cost:
+  while len(counts) < num_chunks:
+    largest = max(
+      (idx for idx, count in enumerate(counts) if count > 1),
+      key=lambda idx: counts[idx]
+    )
+    half = counts[largest] // 2
+    counts[largest:largest + 1] = [half, counts[largest] - half]
+  return counts
+
+def plan_chunks(costs, num_targets, algorithm="contiguous"):
+  r"""Partitions a batch of items into at most `num_targets` chunks of
+  consecutive items with approximately equal total cost. Every chunk
+  receives at least one item and no item is dropped.
+
+  Args:
+    costs (list): cost of each batch item.
+    num_targets (int): maximum number of chunks.
+    algorithm (str): "contiguous" minimizes the maximum chunk cost,
+      "greedy" cuts the batch at evenly spaced cumulative costs.
+
+  Returns:
+    :class:`ChunkPlan` assigning items to chunks.
+  """
+  costs = [float(cost) for cost in costs]
+  if not costs:
+    return ChunkPlan([0])
+  if sum(costs) <= 0:
+    costs = [1.0 for _ in costs]
+  num_chunks = min(num_targets, len(costs))
+  if algorithm == "contiguous":
+    return ChunkPlan(_contiguous_partition(costs, num_chunks))
+  if algorithm == "greedy":
+    return ChunkPlan(_greedy_partition(costs, num_chunks))
+  raise ValueError(
+    f"Invalid chunking algorithm {algorithm}, expected "
+    f"'contiguous' or 'greedy'."
+  )
+
+def chunk_costs(obj, cost="elements"):
+  r"""Computes per-item costs of a :class:`Chunkable`.
+
+  Args:
+    obj (Chunkable): object to be chunked.
+    cost (str or callable): cost model. Either one of "elements" or "edges",
+      or a function mapping a :class:`Chunkable` to a list of per-item costs.
+  """
+  if callable(cost):
+    return list(cost(obj))
+  if cost not in COST_KINDS:
+    raise ValueError(
+      f"Invalid cost model {cost}, expected one of {COST_KINDS} or a callable."
+    )
+  return list(obj.chunk_costs(cost))
+
+def chunk_sizes(lengths, num_targets):
+  return plan_chunks(lengths, num_targets).sizes(lengths)
+
 def chunk_tensor(tensor, lengths, targets, dim=0):
   return Scatter.apply(targets, lengths, dim, tensor)
 
 class Chunkable():
-  def chunk(self, targets):
+  def chunk_costs(self, cost="elements"):
+    r"""Returns the cost of each batch item under a given cost model.
+
+    Args:
+      cost (str): one of "elements" or "edges".
+    """
     raise NotImplementedError("Abstract.")
 
-def scatter_chunked(inputs, target_gpus, dim=0):
+  def chunk_plan(self, targets, cost="elements", algorithm="contiguous"):
+    return plan_chunks(chunk_costs(self, cost), len(targets), algorithm=algorithm)
+
+  def chunk(self, targets, plan=None):
+    raise NotImplementedError("Abstract.")
+
+def _collect_chunkables(obj, result):
+  if isinstance(obj, Chunkable):
+    result.append(obj)
+  elif isinstance(obj, (tuple, list)):
+    for item in obj:
+      _collect_chunkables(item, result)
+  elif isinstance(obj, dict):
+    for item in obj.values():
+      _collect_chunkables(item, result)
+  return result
+
+def plan_batch(inputs, target_gpus, cost="elements", algorithm="contiguous"):
+  r"""Computes a common :class:`ChunkPlan` for all :class:`Chunkable`
+  objects contained in a batch, summing their per-item costs.
+
+  Args:
+    inputs: (nested) batch data.
+    target_gpus (list): devices to distribute chunks to.
+    cost (str or callable): cost model, see :func:`chunk_costs`.
+    algorithm (str): partitioning algorithm, see :func:`plan_chunks`.
+
+  Returns:
+    :class:`ChunkPlan`, or None if the batch contains no :class:`Chunkable`.
+  """
+  chunkables = _collect_chunkables(inputs, [])
+  if not chunkables:
+    return None
+  costs = None
+  for chunkable in chunkables:
+    item_costs = chunk_costs(chunkable, cost)
+    if costs is None:
+      costs = item_costs
+    elif len(item_costs) != len(costs):
+      raise ValueError(
+        f"Chunkable inputs disagree on the number of batch items "
+        f"({len(item_costs)} != {len(costs)}) and cannot be chunked consistently."
+      )
+    else:
+      costs = [
+        total + item
+        for total, item in zip(costs, item_costs)
+      ]
+  return plan_chunks(costs, len(target_gpus), algorithm=algorithm)
+
+def _is_marked(chunk_args, key):
+  if chunk_args is True:
+    return True
+  return chunk_args is not None and key is not None and key in chunk_args
+
+def scatter_chunked(inputs, target_gpus, dim=0, plan=None,
+                    cost="elements", algorithm="contiguous", chunk_args=None):
   r"""
   Slices tensors into approximately equal chunks and
   distributes them across given GPUs. Duplicates
   references to objects that are not tensors.
+  Chunkable objects are split according to a common plan balancing
+  the cost of each chunk. Tensors marked in `chunk_args` follow the
+  same plan and must have one entry per batch item along `dim`.
+
+  Args:
+    inputs: (nested) batch data.
+    target_gpus (list): devices to distribute chunks to.
+    dim (int): dimension along which to split tensors.
+    plan (ChunkPlan): optional plan. Defaults to a plan balancing the
+      :class:`Chunkable` objects in `inputs`.
+    cost (str or callable): cost model, see :func:`chunk_costs`.
+    algorithm (str): partitioning algorithm, see :func:`plan_chunks`.
+    chunk_args (list or bool): positions or keys of top-level entries of
+      `inputs` whose tensors are split according to the plan, or `True`
+      to split all tensors according to the plan. Other tensors are split
+      into equal chunks.
   """
-  def scatter_map(obj):
+  if plan is None:
+    plan = plan_batch(inputs, target_gpus, cost=cost, algorithm=algorithm)
+  targets = target_gpus if plan is None else target_gpus[:len(plan)]
+  def scatter_map(obj, chunked):
     if isinstance(obj, Chunkable):
-      return obj.chunk(target_gpus)
+      return obj.chunk(targets, plan=plan)
     if isinstance(obj, torch.Tensor):
-      return Scatter.apply(target_gpus, None, dim, obj)
+      if plan is not None and chunked:
+        if obj.dim() <= dim or obj.size(dim) != plan.total:
+          raise ValueError(
+            f"Chunked tensor of shape {tuple(obj.shape)} does not have one "
+            f"entry per batch item along dimension {dim} ({plan.total} items)."
+          )
+        return Scatter.apply(targets, plan.counts, dim, obj)
+      return Scatter.apply(targets, None, dim, obj)
 
     if isinstance(obj, tuple) and len(obj) > 0:
-      return list(zip(*map(scatter_map, obj)))
+      return list(zip(*(scatter_map(item, chunked) for item in obj)))
     if isinstance(obj, list) and len(obj) > 0:
-      return list(map(list, zip(*map(scatter_map, obj))))
+      return list(map(list, zip(*(scatter_map(item, chunked) for item in obj))))
     if isinstance(obj, dict) and len(obj) > 0:
-      return list(map(type(obj), zip(*map(scatter_map, obj.items()))))
-    return [obj for targets in target_gpus]
+      return list(map(type(obj), zip(*(scatter_map(item, chunked) for item in obj.items()))))
+    return [obj for _ in targets]
 
   try:
-    return scatter_map(inputs)
+    if isinstance(inputs, (tuple, list)) and len(inputs) > 0:
+      parts = [
+        scatter_map(item, _is_marked(chunk_args, idx))
+        for idx, item in enumerate(inputs)
+      ]
+      result = list(zip(*parts))
+      return result if isinstance(inputs, tuple) else list(map(list, result))
+    if isinstance(inputs, dict) and len(inputs) > 0:
+      parts = [
+        scatter_map((key, value), _is_marked(chunk_args, key))
+        for key, value in inputs.items()
+      ]
+      return list(map(type(inputs), zip(*parts)))
+    return scatter_map(inputs, _is_marked(chunk_args, None))
   finally:
     scatter_map = None
 
-def scatter_chunked_kwargs(inputs, kwargs, target_gpus, dim=0):
-  r"""Scatter with support for kwargs dictionary"""
-  inputs = scatter_chunked(inputs, target_gpus, dim) if inputs else []
-  kwargs = scatter_chunked(kwargs, target_gpus, dim) if kwargs else []
+def scatter_chunked_kwargs(inputs, kwargs, target_gpus, dim=0,
+                           cost="elements", algorithm="contiguous",
+                           chunk_args=None):
+  r"""Scatter with support for kwargs dictionary. Integer entries of
+  `chunk_args` mark positional inputs, string entries keyword inputs."""
+  plan = plan_batch((inputs, kwargs), target_gpus, cost=cost, algorithm=algorithm)
+  inputs = scatter_chunked(
+    inputs, target_gpus, dim, plan=plan, chunk_args=chunk_args
+  ) if inputs else []
+  kwargs = scatter_chunked(
+    kwargs, target_gpus, dim, plan=plan, chunk_args=chunk_args
+  ) if kwargs else []
   if len(inputs) < len(kwargs):
     inputs.extend([() for _ in range(len(kwargs) - len(inputs))])
   elif len(kwargs) < len(inputs):
@@ -5,6 +5,7 @@ import torch.nn.functional as func
 from torchsupport.structured.structures import (
   ConstantStructure, ScatterStructure, MessageMode
 )
+from torchsupport.structured.structures.lowering import lower, is_iterative
 from .. import scatter
 
 def flatten_message(message):
@@ -35,10 +36,20 @@ def unflatten_message(output, message):
   return output.view(*message.shape[:2], *output.shape[1:])
 
 class ConnectedModule(nn.Module):
-  def __init__(self, has_scatter=False):
-    """Applies a reduction function to the neighbourhood of each entity."""
+  accepts_segments = False
+  accepts_implicit = False
+  def __init__(self, has_scatter=False, lowering=True):
+    """Applies a reduction function to the neighbourhood of each entity.
+
+    Args:
+      has_scatter (bool): does the module implement `reduce_scatter`?
+      lowering (bool): run structures passing messages in iterative mode
+        through an equivalent vectorized structure, if the module
+        implements `reduce_scatter`?
+    """
     super(ConnectedModule, self).__init__()
     self.has_scatter = has_scatter
+    self.lowering = lowering
 
   def reduce(self, own_data, source_messages):
     raise NotImplementedError("Abstract")
@@ -53,14 +64,37 @@ class ConnectedModule(nn.Module):
       own_data (torch.Tensor): tensor containing target features for each node.
       source_message (torch.Tensor): tensor containing neighbourhood features
         for each node neighbourhood.
-      indices (torch.Tensor): long tensor of indices. Features of each neighbourhood
-        are marked with a unique neighbourhood index.
+      indices (torch.Tensor or SegmentIndex): long tensor of indices. Features of
+        each neighbourhood are marked with a unique neighbourhood index. Modules
+        setting `accepts_segments` receive the structure's cached
+        :class:`SegmentIndex` instead.
       node_count (int): total number of nodes in the graph. Used to fill up features
         of nodes for which the neighbourhood is empty.
     """
     raise NotImplementedError("Abstract")
 
+  def reduce_implicit(self, own_data, source_data, segments):
+    r"""Aggregates neighbourhood information on fully connected segments of
+    a ragged tensor, where each node receives messages from all source
+    nodes of its segment. Modules implementing this set `accepts_implicit`
+    and never see the edges of a fully connected structure.
+
+    Args:
+      own_data (torch.Tensor): tensor containing target features for each node.
+      source_data (torch.Tensor): tensor containing source features for each node.
+      segments (SegmentIndex): segment of each node.
+    """
+    raise NotImplementedError("Abstract")
+
   def forward(self, source, target, structure):
+    if structure.mode_is(MessageMode.implicit):
+      if self.accepts_implicit:
+        source, target, segments = structure.message(source, target)
+        return self.reduce_implicit(target, source, segments)
+      structure = structure.explicit()
+    if self.has_scatter and self.lowering and is_iterative(structure):
+      structure = lower(structure) or structure
+
     # constant-width neighbourhoods:
     if structure.mode_is(MessageMode.constant):
       return self.reduce(target, structure.message(source, target))
@@ -70,6 +104,10 @@ class ConnectedModule(nn.Module):
           "Scattering-based implementation not supported for {self.__class__.__name__}."
         )
       source, target, indices, node_count = structure.message(source, target)
+      if self.accepts_segments:
+        segments = getattr(structure, "segments", None)
+        if segments is not None and segments.indices is indices:
+          indices = segments
       return self.reduce_scatter(target, source, indices, node_count)
 
     results = []
@@ -97,6 +135,8 @@ class NeighbourLinear(ConnectedModule):
         and neighbours.
     - Output: :math:`(\sum_i N_i, C_{target})`
   """
+  accepts_segments = True
+  accepts_implicit = True
   def __init__(self, source_channels, target_channels, normalization=lambda x: x):
     super(NeighbourLinear, self).__init__(has_scatter=True)
     self.linear = normalization(nn.Linear(source_channels, target_channels))
@@ -107,6 +147,10 @@ class NeighbourLinear(ConnectedModule):
       indices, dim_size=node_count
     )
 
+  def reduce_implicit(self, own_data, source_data, segments):
+    out = scatter.mean(func.relu(self.linear(source_data)), segments)
+    return own_data + out[segments.indices]
+
   def reduce(self, own_data, source_message):
     inputs = flatten_message(source_message)
     out = unflatten_message(self.linear(inputs), source_message)
@@ -191,6 +235,8 @@ class NeighbourAttention(ConnectedModule):
         and neighbours.
     - Output: :math:`(\sum_i N_i, C_{out})`
   """
+  accepts_segments = True
+  accepts_implicit = True
   def __init__(self, in_size, out_size, query_size=None, attention_size=None):
     """Aggregates a node neighbourhood using a pairwise dot-product attention mechanism.
     Args:
@@ -230,6 +276,16 @@ class NeighbourAttention(ConnectedModule):
     )
     return result
 
+  def reduce_implicit(self, own_data, source_data, segments):
+    result = scatter.attention(
+      self.query(own_data).unsqueeze(1),
+      self.key(source_data).unsqueeze(1),
+      self.value(source_data).unsqueeze(1),
+      segments, similarity=lambda key, query: self.attend(query, key),
+      parameters=self.parameters()
+    )
+    return result.squeeze(1)
+
   def reduce(self, own_data, source_message):
     target = self.query(own_data)
     inputs = flatten_message(source_message)
@@ -317,6 +373,8 @@ class NeighbourMultiHeadAttention(ConnectedModule):
         and neighbours.
     - Output: :math:`(\sum_i N_i, C_{out})`
   """
+  accepts_segments = True
+  accepts_implicit = True
   def __init__(self, in_size, out_size, attention_size, query_size=None, heads=64,
                normalization=lambda x: x):
     super(NeighbourMultiHeadAttention, self).__init__(has_scatter=True)
@@ -346,7 +404,7 @@ class NeighbourMultiHeadAttention(ConnectedModule):
     raise NotImplementedError("Abstract.")
 
   def reduce_scatter(self, own_data, source_message, indices, node_count):
-    if indices.size(0) == 0:
+    if len(indices) == 0:
       return torch.zeros(node_count, self.out_size, dtype=own_data.dtype, device=own_data.device)
     target = self.query(own_data).view(*own_data.shape[:-1], -1, self.heads)
     source = self.key(source_message).view(*source_message.shape[:-1], -1, self.heads)
@@ -360,6 +418,21 @@ class NeighbourMultiHeadAttention(ConnectedModule):
     result = self.output(result.view(*result.shape[:-2], -1))
     return result
 
+  def reduce_implicit(self, own_data, source_data, segments):
+    def _heads(data):
+      return data.view(data.size(0), -1, self.heads).transpose(1, 2)
+    def _similarity(key, query):
+      return self.attend(query.transpose(-1, -2), key.transpose(-1, -2))
+    result = scatter.attention(
+      _heads(self.query(own_data)),
+      _heads(self.key(source_data)),
+      _heads(self.value(source_data)),
+      segments, similarity=_similarity,
+      parameters=self.parameters()
+    )
+    result = result.transpose(1, 2).reshape(result.size(0), -1)
+    return self.output(result)
+
   def reduce(self, own_data, source_message):
     target = self.query(own_data).view(*own_data.shape[:-1], -1, self.heads)
     source = flatten_message(source_message)
@@ -434,10 +507,23 @@ class NeighbourAddMultiHeadAttention(NeighbourMultiHeadAttention):
   def attend(self, query, data):
     return (query + data).sum(dim=-2)
 
+_SEGMENT_REDUCTIONS = {
+  torch.mean: scatter.mean,
+  torch.sum: scatter.add,
+  torch.min: scatter.min,
+  torch.max: scatter.max
+}
+
 class NeighbourReducer(ConnectedModule):
   def __init__(self, reduction):
     super(NeighbourReducer, self).__init__()
     self.reduction = reduction
+    self.accepts_implicit = reduction in _SEGMENT_REDUCTIONS
+
+  def reduce_implicit(self, own_data, source_data, segments):
+    result = _SEGMENT_REDUCTIONS[self.reduction](source_data, segments)
+    result = result[0] if isinstance(result, tuple) else result
+    return result[segments.indices]
 
   def reduce(self, own_data, source_message):
     return self.reduction(source_message, dim=1)
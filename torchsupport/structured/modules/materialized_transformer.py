@@ -1,11 +1,13 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as func
+from torch.utils.checkpoint import checkpoint
 
 from torchsupport.modules import ReZero
 
 class MaterializedMultiHeadAttention(nn.Module):
   def __init__(self, node_in_size, node_out_size, edge_in_size, edge_out_size,
-               attention_size=32, heads=8, value_size=32):
+               attention_size=32, heads=8, value_size=32, chunk_size=None):
     r"""Self-attention with materialized attention maps and "edge-features" on these
     attention maps. Warning: Implementing this on a hunch after seeing the AlphaFold
     blogpost - this may not train or make sense at all.
@@ -21,8 +23,13 @@ class MaterializedMultiHeadAttention(nn.Module):
       attention_size (int): size of vectors compared in dot-product attention.
       heads (int): number of attention heads.
       value_size (int): size of the value embedding.
+      chunk_size (int): if given, compute attention for blocks of this many
+        query rows at a time, recomputing each block in the backward pass.
+        Peak memory then scales with the block size instead of the full
+        attention map.
     """
     super().__init__()
+    self.chunk_size = chunk_size
     self.heads = heads
     self.attention_size = attention_size
     self.query = nn.Conv1d(node_in_size, attention_size * heads, 1, bias=False)
@@ -31,7 +38,54 @@ class MaterializedMultiHeadAttention(nn.Module):
     self.out = nn.Conv1d(value_size * heads, node_out_size, 1, bias=False)
     self.edge_out = nn.Conv2d(2 * value_size * heads + edge_in_size, edge_out_size, 1, bias=False)
 
+  def _attend_rows(self, nodes, edges, mask, start, stop):
+    query = self.query(nodes[:, :, start:stop])[:, :, :, None]
+    rows = nodes[:, :, start:stop, None].expand(-1, -1, -1, edges.shape[-1])
+    node_edges = torch.cat((rows, edges[:, :, start:stop]), dim=1)
+    key = self.key(node_edges)
+    value = self.value(node_edges)
+    value = value.view(value.size(0), self.heads, -1, *value.shape[2:])
+
+    sim = (query * key).view(key.size(0), self.heads, self.attention_size, *key.shape[2:])
+    sim = sim.sum(dim=2) / torch.tensor(self.attention_size, dtype=torch.float).sqrt()
+    sim = sim.masked_fill(~mask[:, None, None, :], -float("inf"))
+    sim = sim.softmax(dim=-1)
+
+    mm = mask[:, None, None, :] * mask[:, None, start:stop, None]
+    sim = sim * mm.expand_as(sim).float()
+    value = value * mm[:, None].expand_as(value).float()
+    return (sim[:, :, None] * value).sum(dim=-1)
+
+  def _forward_chunked(self, nodes, edges, mask):
+    size = nodes.size(-1)
+    node_features = []
+    for start in range(0, size, self.chunk_size):
+      stop = min(start + self.chunk_size, size)
+      if torch.is_grad_enabled():
+        features = checkpoint(
+          self._attend_rows, nodes, edges, mask, start, stop,
+          use_reentrant=False
+        )
+      else:
+        features = self._attend_rows(nodes, edges, mask, start, stop)
+      node_features.append(features)
+    node_features = torch.cat(node_features, dim=-1)
+    node_features = node_features.view(nodes.size(0), -1, size)
+    node_out = self.out(node_features)
+
+    # split edge_out into its row, column and edge parts instead of
+    # concatenating node features onto the full edge map:
+    channels = node_features.size(1)
+    weight = self.edge_out.weight
+    rows = func.conv1d(node_features, weight[:, :channels, :, 0])
+    columns = func.conv1d(node_features, weight[:, channels:2 * channels, :, 0])
+    edge_out = func.conv2d(edges, weight[:, 2 * channels:])
+    edge_out = edge_out + rows[:, :, :, None] + columns[:, :, None, :]
+    return node_out, edge_out
+
   def forward(self, nodes, edges, mask):
+    if self.chunk_size is not None:
+      return self._forward_chunked(nodes, edges, mask)
     query = self.query(nodes)[:, :, :, None]
     node_edges = torch.cat((nodes[:, :, :, None].expand(*nodes.shape, edges.shape[-1]), edges), dim=1)
     key = self.key(node_edges)
@@ -63,7 +117,7 @@ class MaterializedMultiHeadAttention(nn.Module):
 class MaterializedTransformerBlock(nn.Module):
   def __init__(self, node_in_size, node_out_size, edge_in_size, edge_out_size,
                attention_size=32, heads=8, value_size=32, dropout=0.1,
-               kernel_size=1, dilation=1, activation=nn.ReLU()):
+               kernel_size=1, dilation=1, activation=nn.ReLU(), chunk_size=None):
     r"""Transformer block with materialized attention maps and "edge-features" on these
     attention maps. Warning: Implementing this on a hunch after seeing the AlphaFold
     blogpost - this may not train or make sense at all.
@@ -83,13 +137,16 @@ class MaterializedTransformerBlock(nn.Module):
       dilation (int): dilation of the local block, if applicable.
       dropout (float): dropout of the transformer block.
       activation (nn.Module): nonlinear activation function. Defaults to ReLU.
+      chunk_size (int): number of query rows per block of the attention
+        map, if computed in blocks.
     """
     super().__init__()
     padding = kernel_size // 2 * dilation
     self.dropout = nn.Dropout(dropout)
     self.attention = MaterializedMultiHeadAttention(
       node_in_size, node_out_size, edge_in_size, edge_out_size,
-      attention_size=attention_size, heads=heads, value_size=value_size
+      attention_size=attention_size, heads=heads, value_size=value_size,
+      chunk_size=chunk_size
     )
     if node_in_size != node_out_size:
       self.project_node = nn.Conv1d(node_in_size, node_out_size, 1, bias=False)
@@ -4,8 +4,36 @@ from torchsupport.structured.chunkable import scatter_chunked_kwargs
 from torchsupport.data.collate import gather_collated
 
 class DataParallel(nn.DataParallel):
+  r"""Data parallel wrapper with support for :class:`Chunkable` inputs.
+
+  Args:
+    module (nn.Module): module to be parallelized.
+    device_ids (list): devices to distribute the module to.
+    output_device (int): device to gather outputs on.
+    dim (int): dimension along which to split tensors.
+    cost (str or callable): cost model used to balance chunks.
+      One of "elements", "edges" or a function returning per-item costs.
+    algorithm (str): chunking algorithm, "contiguous" or "greedy".
+    chunk_args (list): positions or names of tensor arguments with one
+      entry per batch item, which are split consistently with the
+      :class:`Chunkable` arguments.
+  """
+  def __init__(self, module, device_ids=None, output_device=None, dim=0,
+               cost="elements", algorithm="contiguous", chunk_args=None):
+    super(DataParallel, self).__init__(
+      module, device_ids=device_ids,
+      output_device=output_device, dim=dim
+    )
+    self.cost = cost
+    self.algorithm = algorithm
+    self.chunk_args = chunk_args
+
   def scatter(self, inputs, kwargs, device_ids):
-    return scatter_chunked_kwargs(inputs, kwargs, device_ids, dim=self.dim)
+    return scatter_chunked_kwargs(
+      inputs, kwargs, device_ids, dim=self.dim,
+      cost=self.cost, algorithm=self.algorithm,
+      chunk_args=self.chunk_args
+    )
 
   def gather(self, outputs, output_device):
     return gather_collated(outputs, output_device, dim=self.dim)
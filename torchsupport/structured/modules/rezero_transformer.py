@@ -22,15 +22,19 @@ class RezeroTransformerBlock(nn.Module):
     out_size (int): output size (for multiheadatention)
     function (callable): Conv1d/Conv2D/Conv3D
     dropout (int): dropout parameter
+    tile_size (int): number of queries and keys compared at a time in
+      the attention kernel
   '''
   def __init__(self, size, n_heads=8, hidden_size=128,
-               attention_size=128, value_size=128, depth=2, dropout=0.1):
+               attention_size=128, value_size=128, depth=2, dropout=0.1,
+               tile_size=None):
     super().__init__()
     self.attention = SequenceMultiHeadAttention(
       size, size,
       attention_size=attention_size,
       hidden_size=value_size,
-      heads=n_heads
+      heads=n_heads,
+      tile_size=tile_size
     )
     self.ff = MLP(size, size, hidden_size=hidden_size, depth=2, batch_norm=False)
     self.rezero = ReZero(size)
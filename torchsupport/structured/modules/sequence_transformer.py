@@ -2,7 +2,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as func
 
-from torchsupport.structured.scatter import pad, unpad
+from torchsupport.structured.scatter import add, cumsum, segment_index, attention
 
 def dot_attention(x, y):
   return (x * y * torch.tensor(x.shape[-1]).rsqrt()).sum(dim=-1)
@@ -27,6 +27,8 @@ class SequenceMultiHeadAttention(nn.Module):
     attention_size (int): size of the query and key vectors.
     heads (int): number of concurrent attention heads.
     similarity (callable): kernel comparing key and query vectors.
+    tile_size (int): number of queries and keys compared at a time.
+      Defaults to a tile size fitting into a fixed memory budget.
 
   Shape:
     - Inputs: :math:`(\sum_i N_i, F_{in})`
@@ -35,8 +37,9 @@ class SequenceMultiHeadAttention(nn.Module):
   """
   def __init__(self, in_size, out_size,
                hidden_size=128, attention_size=128,
-               heads=8, similarity=None):
+               heads=8, similarity=None, tile_size=None):
     super().__init__()
+    self.tile_size = tile_size
     self.attention_size = attention_size
     self.hidden_size = hidden_size
     self.heads = heads
@@ -50,26 +53,21 @@ class SequenceMultiHeadAttention(nn.Module):
     key = self.key(inputs).view(inputs.size(0), self.heads, self.attention_size)
     query = self.query(inputs).view(inputs.size(0), self.heads, self.attention_size)
     value = self.value(inputs).view(inputs.size(0), self.heads, self.hidden_size)
-    key, _, indices, _ = pad(key, index)
-    query, _, indices, _ = pad(query, index)
-    value, _, indices, _ = pad(value, index)
-    sim = self.sim(key[:, :, None], query[:, None, :]).unsqueeze(-1)
-
-    # mask bad values
-    mask = torch.ones_like(sim, dtype=torch.bool)
-    mask.view(-1, *mask.shape[2:])[indices] = False
-    sim[mask] = -float("inf")
-    sim = sim.softmax(dim=1)
-
-    result = (value[:, :, None] * sim).sum(dim=1)
-    result = result.view(*result.shape[:-2], -1)
-    result = unpad(result, indices)
+    similarity = None if self.sim is dot_attention else self.sim
+    result = attention(
+      query, key, value, index,
+      similarity=similarity, tile_size=self.tile_size
+    )
+    result = result.view(result.size(0), -1)
     result = self.out(result)
     return result
 
 class SequenceLinearAttention(SequenceMultiHeadAttention):
   r"""Implements linear-order multi-head attention for a non-structured sets.
-  Computes multi-head attention on a ragged tensor.
+  Computes multi-head attention on a ragged tensor. Key-value summaries
+  are computed per set by segment sums, or by segment-wise cumulative
+  sums in causal mode, such that each element only attends to itself and
+  the elements preceding it in its set.
 
   Args:
     in_size (int): size of the input embedding.
@@ -78,36 +76,40 @@ class SequenceLinearAttention(SequenceMultiHeadAttention):
     attention_size (int): size of the query and key vectors.
     heads (int): number of concurrent attention heads.
     similarity (callable): features to apply to query and key vectors.
+    causal (bool): attend only to preceding elements of each set?
 
   Shape:
     - Inputs: :math:`(\sum_i N_i, F_{in})`
     - Index: :math:`\sum_i N_i`
     - Outputs: :math:`(\sum_i N_i, F_{out})`
   """
-  def __init__(self, *args, similarity=None, **kwargs):
+  def __init__(self, *args, similarity=None, causal=False, **kwargs):
     super().__init__(
       *args, similarity=similarity or elu_features, **kwargs
     )
+    self.causal = causal
 
   def forward(self, inputs, index):
     key = self.key(inputs).view(inputs.size(0), self.heads, self.attention_size)
     query = self.query(inputs).view(inputs.size(0), self.heads, self.attention_size)
     value = self.value(inputs).view(inputs.size(0), self.heads, self.hidden_size)
-    key, _, indices, _ = pad(self.sim(key), index)
-    query, _, indices, _ = pad(self.sim(query), index)
-    value, _, indices, _ = pad(value, index)
+    key, query = self.sim(key), self.sim(query)
+    index = segment_index(index)
 
     # (N, heads, D, V)
-    key_value = (key[:, :, :, :, None] * value[:, :, :, None, :]).sum(dim=1)
-    # (N, heads, D)
-    sum_key = key.sum(dim=1)
-    # (N, L, heads, V)
-    query_key_value = (query[:, :, :, :, None] * key_value[:, None, :, :, :]).sum(dim=2)
-    # (N, L, heads, 1)
-    query_sum_key = (query * sum_key[:, None, :, :]).sum(dim=-1).unsqueeze(-1)
+    key_value = key[:, :, :, None] * value[:, :, None, :]
+    if self.causal:
+      key_value = cumsum(key_value, index)
+      sum_key = cumsum(key, index)
+    else:
+      key_value = add(key_value, index)[index.indices]
+      sum_key = add(key, index)[index.indices]
+    # (N, heads, V)
+    query_key_value = torch.einsum("nhd,nhdv->nhv", query, key_value)
+    # (N, heads, 1)
+    query_sum_key = (query * sum_key).sum(dim=-1).unsqueeze(-1)
     result = query_key_value / (query_sum_key + 1e-6)
 
-    result = result.view(result.shape[:2], -1)
-    result = unpad(result, indices)
+    result = result.view(result.size(0), -1)
     result = self.out(result)
     return result
@@ -3,22 +3,145 @@ import torch.nn as nn
 import torch.nn.functional as func
 
 from torchsupport.structured.modules.basic import ConnectedModule
+from torchsupport.structured.structures import (
+  ConnectionStructure, ConstantStructure, ScatterStructure
+)
 from torchsupport.structured import scatter
 
-class AdjacencyAction(ConnectedModule):
+def _structure_edges(structure):
+  if isinstance(structure, ConnectionStructure):
+    return structure.indices, structure.columns, len(structure)
+  if isinstance(structure, ScatterStructure) and structure.connections.dim() == 1:
+    return structure.indices, structure.connections, int(structure.node_count)
+  if isinstance(structure, ConstantStructure) and structure.connections.dim() == 2:
+    nodes, width = structure.connections.shape
+    indices = torch.arange(nodes, device=structure.connections.device)
+    return indices.repeat_interleave(width), structure.connections.view(-1), nodes
+  return None
+
+def _sparse_matrix(rows, columns, values, size):
+  matrix = torch.sparse_coo_tensor(
+    torch.stack((rows, columns), dim=0), values, (size, size)
+  ).coalesce()
+  if hasattr(matrix, "to_sparse_csr"):
+    matrix = matrix.to_sparse_csr()
+  return matrix
+
+def _adjacency_matrix(indices, connections, node_count, dtype):
+  degree = torch.bincount(indices, minlength=node_count).to(dtype)
+  nodes = (degree > 0).nonzero().view(-1)
+  weight = 1 / (degree + 1)
+  return _sparse_matrix(
+    torch.cat((indices, nodes), dim=0),
+    torch.cat((connections, nodes), dim=0),
+    torch.cat((weight[indices], weight[nodes]), dim=0),
+    node_count
+  )
+
+def _laplacian_matrix(indices, connections, node_count, dtype, normalized=False):
+  degree = torch.bincount(indices, minlength=node_count).to(dtype)
+  nodes = (degree > 0).nonzero().view(-1)
+  if normalized:
+    diagonal = torch.ones_like(degree[nodes])
+    weight = -1 / degree[indices]
+  else:
+    diagonal = degree[nodes]
+    weight = -torch.ones_like(degree[indices])
+  return _sparse_matrix(
+    torch.cat((indices, nodes), dim=0),
+    torch.cat((connections, nodes), dim=0),
+    torch.cat((weight, diagonal), dim=0),
+    node_count
+  )
+
+def structure_operator(structure, kind="adjacency", normalized=False,
+                       dtype=torch.float, device=None):
+  r"""Builds the sparse matrix of the action of a :class:`AdjacencyAction`
+  or :class:`LaplacianAction` on a structure whose sources and targets
+  are the same nodes. Matrices are cached on the structure, such that
+  they are built once for each structure.
+
+  Args:
+    structure (AbstractStructure): scatter, constant or connection structure.
+    kind (str): `"adjacency"` or `"laplacian"`.
+    normalized (bool): normalize the Laplacian by node degrees?
+    dtype (torch.dtype): matrix data type.
+    device (torch.device): matrix device.
+
+  Returns:
+    Sparse CSR matrix of shape :math:`(N, N)`, or `None` for unsupported
+    structures.
+  """
+  edges = _structure_edges(structure)
+  if edges is None:
+    return None
+  indices, connections, node_count = edges
+  device = device or indices.device
+  key = (kind, normalized, dtype, str(device))
+  operators = getattr(structure, "_operators", None)
+  if operators is None:
+    operators = structure._operators = {}
+  cached = operators.get(key)
+  if cached is not None and cached[0] is indices and cached[1] is connections:
+    return cached[2]
+  if connections.numel() > 0 and int(connections.max()) >= node_count:
+    return None
+  if kind == "adjacency":
+    matrix = _adjacency_matrix(indices, connections, node_count, dtype)
+  else:
+    matrix = _laplacian_matrix(indices, connections, node_count, dtype, normalized)
+  operators[key] = (indices, connections, matrix.to(device))
+  return operators[key][2]
+
+def _apply(matrix, data):
+  result = torch.sparse.mm(matrix, data.reshape(data.size(0), -1))
+  return result.view(data.size(0), *data.shape[1:])
+
+class SparseAction(ConnectedModule):
+  r"""Base class of modules acting on node features by a sparse matrix
+  derived from a structure. If sources and targets are the same tensor,
+  the cached sparse matrix is applied directly. Otherwise, messages are
+  passed as usual.
+
+  Args:
+    sparse (bool): use a cached sparse matrix where possible?
+  """
+  accepts_segments = True
+  kind = None
+  def __init__(self, normalized=False, sparse=True):
+    super(SparseAction, self).__init__(has_scatter=True)
+    self.normalized = normalized
+    self.sparse = sparse
+
+  def operator(self, structure, data):
+    return structure_operator(
+      structure, kind=self.kind, normalized=self.normalized,
+      dtype=data.dtype, device=data.device
+    )
+
+  def forward(self, source, target, structure):
+    if self.sparse and source is target:
+      matrix = self.operator(structure, source)
+      if matrix is not None:
+        return _apply(matrix, source)
+    return super(SparseAction, self).forward(source, target, structure)
+
+class AdjacencyAction(SparseAction):
   r"""Computes the action of the adjacency matrix defined by a given
   structure in the framework of message-passing neural networks.
 
   Args:
     normalized (bool): normalize contribution of the central node to its
       neighbours?
+    sparse (bool): use a cached sparse matrix where possible?
   """
-  def __init__(self, normalized=False):
-    super().__init__(has_scatter=True)
+  kind = "adjacency"
+  def __init__(self, normalized=False, sparse=True):
+    super().__init__(normalized=normalized, sparse=sparse)
 
   def reduce_scatter(self, own_data, source_message, indices, node_count):
-    _, counts = indices.unique(return_counts=True)
-    message_size = torch.repeat_interleave(counts, counts).float()
+    message_size = scatter.segment_index(indices, dim_size=node_count).element_counts
+    message_size = message_size.to(source_message.dtype).unsqueeze(-1)
     own_norm = message_size * (message_size + 1)
     return scatter.add(
       own_data / own_norm + source_message / (message_size + 1),
@@ -28,21 +151,22 @@ class AdjacencyAction(ConnectedModule):
   def reduce(self, data, message):
     return (data + message.sum(dim=0)) / (message.size(0) + 1)
 
-class LaplacianAction(ConnectedModule):
+class LaplacianAction(SparseAction):
   r"""Computes the action of the graph Laplacian defined by a given
   structure in the framework of message-passing neural networks.
 
   Args:
     normalized (bool): normalize contribution of the central node to its
       neighbours?
+    sparse (bool): use a cached sparse matrix where possible?
   """
-  def __init__(self, normalized=False):
-    super(LaplacianAction, self).__init__(has_scatter=True)
-    self.normalized = normalized
+  kind = "laplacian"
+  def __init__(self, normalized=False, sparse=True):
+    super(LaplacianAction, self).__init__(normalized=normalized, sparse=sparse)
 
   def reduce_scatter(self, own_data, source_message, indices, node_count):
-    _, counts = indices.unique(return_counts=True)
-    message_size = torch.repeat_interleave(counts, counts).float()
+    message_size = scatter.segment_index(indices, dim_size=node_count).element_counts
+    message_size = message_size.to(source_message.dtype).unsqueeze(-1)
     factor = 1
     if self.normalized:
       factor = 1 / message_size
@@ -57,7 +181,39 @@ class LaplacianAction(ConnectedModule):
       factor = 1 / message.size(0)
     return factor * (message.size(0) * data - message.sum(dim=0))
 
-class GCN(nn.Module):
+class PropagationMixin():
+  r"""Mixin for modules transforming node features as
+  :math:`\sigma(P_S(wX + \mathbf{b}))`, where :math:`P_S` is a linear
+  propagation along the structure :math:`S`. As
+  :math:`P_S(wX + \mathbf{b}) = w P_S(X) + P_S(\mathbf{1}) \mathbf{b}`,
+  the propagated input features can be computed once and reused for
+  a fixed graph and fixed input features, as in SGC and APPNP. Propagated
+  features are recomputed whenever the input tensor, its contents or the
+  structure change. No gradients flow into precomputed input features.
+  """
+  def propagate(self, data, structure):
+    raise NotImplementedError("Abstract.")
+
+  def precomputed(self, data, structure):
+    cached = getattr(self, "_precomputed", None)
+    if cached is None or cached[0] is not data or \
+       cached[1] != data._version or cached[2] is not structure:
+      with torch.no_grad():
+        ones = data.new_ones(data.size(0), 1)
+        propagated = self.propagate(torch.cat((data, ones), dim=1), structure)
+      self._precomputed = (data, data._version, structure, propagated)
+    propagated = self._precomputed[3]
+    result = func.linear(propagated[:, :-1], self.linear.weight)
+    if self.linear.bias is not None:
+      result = result + propagated[:, -1:] * self.linear.bias
+    return result
+
+  def transform(self, data, structure):
+    if self.precompute:
+      return self.precomputed(data, structure)
+    return self.propagate(self.linear(data), structure)
+
+class GCN(PropagationMixin, nn.Module):
   r"""Standard Graph Convolutional Neural Network (GCN).
   Transforms graph features by applying a non-linear transformation to
   all node features, followed by acting with the adjacency matrix, resulting
@@ -73,21 +229,27 @@ class GCN(nn.Module):
     out_size (int): number of output feature maps.
     depth (int): exponent of the adjacency matrix action. Default: 1.
     activation (callable): nonlinear activation function.
+    precompute (bool): cache propagated input features for a fixed graph
+      (SGC). See :class:`PropagationMixin`.
   """
-  def __init__(self, in_size, out_size, depth=1, activation=func.relu):
+  def __init__(self, in_size, out_size, depth=1, activation=func.relu,
+               precompute=False):
     super(GCN, self).__init__()
     self.linear = nn.Linear(in_size, out_size)
     self.connected = AdjacencyAction()
     self.activation = activation
     self.depth = depth
+    self.precompute = precompute
 
-  def forward(self, data, structure):
-    out = self.linear(data)
+  def propagate(self, out, structure):
     for _ in range(self.depth):
       out = self.connected(out, out, structure)
-    return self.activation(out)
+    return out
 
-class Chebyshev(nn.Module):
+  def forward(self, data, structure):
+    return self.activation(self.transform(data, structure))
+
+class Chebyshev(PropagationMixin, nn.Module):
   r"""Chebyshev Graph Convolutional Neural Network.
   Transforms graph features by applying a non-linear transformation to
   all node features, followed by repeatedly acting with the graph Laplacian
@@ -98,24 +260,30 @@ class Chebyshev(nn.Module):
     out_size (int): number of output feature maps.
     depth (int): order of the Chebyshev polynomial approximation. Default: 1.
     activation (callable): nonlinear activation function.
+    precompute (bool): cache propagated input features for a fixed graph.
+      See :class:`PropagationMixin`.
   """
-  def __init__(self, in_size, out_size, depth=1, activation=func.relu):
+  def __init__(self, in_size, out_size, depth=1, activation=func.relu,
+               precompute=False):
     super(Chebyshev, self).__init__()
     self.linear = nn.Linear(in_size, out_size)
     self.connected = LaplacianAction(normalized=True)
     self.activation = activation
     self.depth = depth
+    self.precompute = precompute
 
   def forward(self, data, structure):
-    out_2 = self.linear(data)
+    return self.activation(self.transform(data, structure))
+
+  def propagate(self, out_2, structure):
     out_1 = self.connected(out_2, out_2, structure)
     out = out_1 + out_2
     for _ in range(self.depth):
       tmp = out_1
       out_1 = 2 * self.connected(out_1, out_1, structure) - out_2
       out_2 = tmp
-      out += out_1
-    return self.activation(out)
+      out = out + out_1
+    return out
 
 class ConvSkip(nn.Module):
   r"""Graph Convolutional Neural Network with skip connections.
@@ -203,30 +371,35 @@ class ARMA(nn.Module):
     out = out.reshape(data.size(0), -1, self.width)
     return func.adaptive_avg_pool1d(out, 1)
 
-class APP(nn.Module):
+class APP(PropagationMixin, nn.Module):
   def __init__(self, in_size, out_size,
                depth=10, teleport=0.5, activation=func.relu,
-               connected=LaplacianAction(normalized=True)):
+               connected=LaplacianAction(normalized=True),
+               precompute=False):
     super(APP, self).__init__()
     self.linear = nn.Linear(in_size, out_size)
     self.teleport = teleport
     self.depth = depth
     self.activation = activation
     self.connected = connected
+    self.precompute = precompute
 
-  def forward(self, data, structure):
-    embedding = self.linear(data)
+  def propagate(self, embedding, structure):
     out = embedding
     for _ in range(self.depth):
       out = (1 - self.teleport) * self.connected(out, out, structure)
-      out += self.teleport * embedding
-    return self.activation(out)
+      out = out + self.teleport * embedding
+    return out
+
+  def forward(self, data, structure):
+    return self.activation(self.transform(data, structure))
 
 class MultiScaleAPP(nn.Module):
   def __init__(self, in_size, out_size,
                depth=10, teleports=[0.1, 0.2, 0.3],
                activation=func.relu,
-               connected=LaplacianAction(normalized=True)):
+               connected=LaplacianAction(normalized=True),
+               precompute=False):
     super(MultiScaleAPP, self).__init__()
     self.source_attention = nn.Linear(in_size, out_size)
     self.target_attention = nn.Linear(out_size, out_size)
@@ -235,7 +408,8 @@ class MultiScaleAPP(nn.Module):
         in_size, out_size,
         depth=depth, teleport=teleport,
         activation=activation,
-        connected=connected
+        connected=connected,
+        precompute=precompute
       )
       for teleport in teleports
     ])
@@ -72,7 +72,9 @@ class ConvTransformer(UniversalTransformer):
     )
 
   def local(self, data, structure):
-    return scatter.batched(self.local_block, data, structure.indices)
+    return scatter.batched(
+      self.local_block, data, getattr(structure, "segments", structure.indices)
+    )
 
 class Halting(nn.Module):
   def __init__(self, module, size, threshold=0.5, max_iter=5):
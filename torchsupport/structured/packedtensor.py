@@ -3,9 +3,7 @@ import torch
 from torchsupport.data.collate import Collatable
 from torchsupport.data.io import DeviceMovable
 from torchsupport.data.tensor_provider import TensorProvider
-from torchsupport.structured.chunkable import (
-  Chunkable, chunk_sizes, chunk_tensor
-)
+from torchsupport.structured.chunkable import Chunkable, chunk_tensor
 
 class PackedTensor(DeviceMovable, Collatable, Chunkable, TensorProvider):
   def __init__(self, tensors, lengths=None, split=True, box=False):
@@ -42,14 +40,21 @@ class PackedTensor(DeviceMovable, Collatable, Chunkable, TensorProvider):
   def tensors(self):
     return [self.tensor]
 
-  def chunk(self, targets):
-    sizes = chunk_sizes(self.lengths, len(targets))
-    chunks = chunk_tensor(self.tensor, sizes, targets, dim=0)
+  def chunk_costs(self, cost="elements"):
+    if cost == "edges":
+      return [0 for _ in self.lengths]
+    return list(self.lengths)
+
+  def chunk(self, targets, plan=None):
+    plan = plan or self.chunk_plan(targets)
+    sizes = plan.sizes(self.lengths)
+    chunks = chunk_tensor(self.tensor, sizes, targets[:len(plan)], dim=0)
     result = []
-    step = len(self.lengths) // len(targets)
-    for idx, chunk in enumerate(chunks):
-      the_tensor = PackedTensor(chunk, split=self.split, box=self.box)
-      the_tensor.lengths = self.lengths[idx * step:(idx + 1) * step]
+    for lengths, chunk in zip(plan.split(self.lengths), chunks):
+      the_tensor = PackedTensor(
+        chunk, lengths=list(lengths),
+        split=self.split, box=self.box
+      )
       the_tensor = the_tensor if self.box else the_tensor.tensor
       result.append(the_tensor)
     return result
@@ -1,52 +1,212 @@
+import builtins
+from copy import copy
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as func
+from torch.autograd.function import once_differentiable
+
+def _dim_size(indices, out=None, dim_size=None):
+  if out is not None:
+    return out.size(0)
+  if dim_size is not None:
+    return int(dim_size)
+  if isinstance(indices, SegmentIndex):
+    return indices.dim_size
+  return int(indices.max()) + 1 if indices.numel() > 0 else 0
+
+def _is_sorted(indices):
+  return indices.numel() < 2 or bool((indices[1:] >= indices[:-1]).all())
+
+class SegmentIndex(object):
+  r"""Index tensor of a ragged tensor together with lazily computed and
+  cached segment metadata. Building a :class:`SegmentIndex` once per batch
+  allows all scatter operations on that batch to share counts, offsets and
+  padding maps instead of recomputing them. All scatter operations accept a
+  :class:`SegmentIndex` in place of an index tensor.
+
+  Args:
+    indices (torch.Tensor): segment index of each element.
+    dim_size (int): number of segments. Defaults to `indices.max() + 1`.
+    counts (torch.Tensor): optional number of elements per segment.
+    is_sorted (bool): optional sortedness of `indices`.
+
+  Shape:
+    - Indices: :math:`(\sum_i N_i)`
+    - Counts: :math:`(S)`
+  """
+  def __init__(self, indices, dim_size=None, counts=None, is_sorted=None):
+    if dim_size is None and counts is not None:
+      dim_size = counts.size(0)
+    self.indices = indices
+    self.dim_size = _dim_size(indices, dim_size=dim_size)
+    self._cache = {}
+    if counts is not None:
+      self._cache["counts"] = counts
+    if is_sorted is not None:
+      self._cache["sorted"] = is_sorted
+
+  def _cached(self, name, compute):
+    if name not in self._cache:
+      self._cache[name] = compute()
+    return self._cache[name]
+
+  @property
+  def device(self):
+    return self.indices.device
+
+  def __len__(self):
+    return self.indices.size(0)
+
+  @property
+  def counts(self):
+    r"""Number of elements in each segment, including empty segments."""
+    return self._cached("counts", lambda: torch.bincount(
+      self.indices, minlength=self.dim_size
+    ))
 
-def _compute_indices(data, indices, counts, max_count):
-  offset = max_count - counts
-  offset = offset.roll(1, 0)
-  offset[0] = 0
-  offset = torch.repeat_interleave(offset.cumsum(dim=0), counts, dim=0)
-  offset = offset.to(data.device)
+  @property
+  def offsets(self):
+    r"""Position of the first element of each segment in sorted order."""
+    return self._cached("offsets", lambda: self.counts.cumsum(dim=0) - self.counts)
+
+  @property
+  def sorted(self):
+    r"""Are elements ordered by segment?"""
+    return self._cached("sorted", lambda: _is_sorted(self.indices))
+
+  @property
+  def max_count(self):
+    r"""Number of elements in the largest segment."""
+    return self._cached(
+      "max_count", lambda: int(self.counts.max()) if self.dim_size > 0 else 0
+    )
 
-  index = offset + torch.arange(len(indices)).to(data.device)
-  return index
+  @property
+  def pointers(self):
+    r"""Row pointers of sorted segments, such that segment `i` spans
+    elements `pointers[i]` to `pointers[i + 1]`."""
+    return self._cached("pointers", lambda: torch.cat((
+      self.offsets, self.counts.sum().view(1)
+    ), dim=0))
+
+  @property
+  def unique(self):
+    r"""Indices of all non-empty segments."""
+    return self._cached("unique", lambda: self.counts.nonzero().view(-1))
+
+  @property
+  def unique_counts(self):
+    r"""Number of elements in each non-empty segment."""
+    return self._cached("unique_counts", lambda: self.counts[self.unique])
+
+  @property
+  def element_counts(self):
+    r"""Number of elements in the segment of each element."""
+    return self._cached("element_counts", lambda: self.counts[self.indices])
+
+  def _positions(self):
+    arange = torch.arange(len(self), device=self.device)
+    if self.sorted:
+      return arange - self.offsets[self.indices]
+    _, order = torch.sort(self.indices, stable=True)
+    positions = torch.empty_like(self.indices)
+    positions[order] = arange - self.offsets[self.indices[order]]
+    return positions
+
+  @property
+  def positions(self):
+    r"""Position of each element within its segment."""
+    return self._cached("positions", self._positions)
+
+  def _pad_index(self):
+    rank = (self.counts > 0).long().cumsum(dim=0) - 1
+    return rank[self.indices] * self.max_count + self.positions
+
+  @property
+  def pad_index(self):
+    r"""Position of each element in a flattened padded tensor of shape
+    :math:`(S_{nonempty} \cdot \max_i N_i, ...)`, as used by :func:`pad`
+    and :func:`unpad`."""
+    return self._cached("pad_index", self._pad_index)
+
+  def precompute(self, pad=False):
+    r"""Computes and caches segment metadata ahead of time, e.g. at collate
+    time.
+
+    Args:
+      pad (bool): also compute padding maps?
+    """
+    names = ["counts", "offsets", "sorted", "max_count", "unique_counts"]
+    if pad:
+      names.append("pad_index")
+    for name in names:
+      getattr(self, name)
+    return self
+
+  def resize(self, dim_size=None):
+    r"""Returns a :class:`SegmentIndex` with a given number of segments,
+    reusing this one if the number of segments matches."""
+    if dim_size is None or int(dim_size) == self.dim_size:
+      return self
+    return SegmentIndex(
+      self.indices, dim_size=dim_size,
+      is_sorted=self._cache.get("sorted")
+    )
+
+  def to(self, device):
+    result = copy(self)
+    result.indices = self.indices.to(device)
+    result._cache = {
+      name: value.to(device) if torch.is_tensor(value) else value
+      for name, value in self._cache.items()
+    }
+    return result
+
+def segment_index(indices, dim_size=None):
+  r"""Wraps an index tensor into a :class:`SegmentIndex`. Returns
+  :class:`SegmentIndex` inputs as-is, if `dim_size` matches."""
+  if isinstance(indices, SegmentIndex):
+    return indices.resize(dim_size)
+  return SegmentIndex(indices, dim_size=dim_size)
+
+def index_tensor(indices):
+  r"""Returns the raw index tensor of an index tensor or :class:`SegmentIndex`."""
+  if isinstance(indices, SegmentIndex):
+    return indices.indices
+  return indices
 
 def pad(data, indices, value=0):
-  unique, counts = indices.unique(return_counts=True)
-  result_indices = unique
-  max_count = counts.max()
-  index = _compute_indices(data, indices, counts, max_count)
-  result = torch.zeros(
-    len(counts), max_count, *data.shape[1:],
+  segment = segment_index(indices)
+  index = segment.pad_index
+  result = torch.full(
+    (segment.unique.size(0), segment.max_count, *data.shape[1:]), value,
     dtype=data.dtype, device=data.device
   )
   result.view(-1, *data.shape[1:])[index] = data
-  return result, result_indices, index, counts
+  return result, segment.unique, index, segment.unique_counts
 
 def unpad(data, index):
+  if isinstance(index, SegmentIndex):
+    index = index.pad_index
   return data.contiguous().view(-1, *data.shape[2:])[index]
 
 def pack(data, indices):
-  unique, counts = indices.unique(return_counts=True)
-  result_indices = unique
-  tensors = []
-  offset = 0
-  for count in counts:
-    tensors.append(data[offset:offset + count])
-    offset += count
+  segment = segment_index(indices)
+  counts = segment.unique_counts
+  tensors = data.split(counts.tolist(), dim=0)
   result = nn.utils.rnn.pack_sequence(
     tensors, enforce_sorted=False
   )
-  return result, result_indices, counts
+  return result, segment.unique, counts
 
 def repack(data, indices, target_indices):
   out = torch.zeros(
     target_indices.size(0), *data.shape[1:],
     dtype=data.dtype, device=data.device
   )
-  unique, lengths = indices.unique(return_counts=True)
-  unique, target_lengths = target_indices.unique(return_counts=True)
+  lengths = segment_index(indices).unique_counts
+  target_lengths = segment_index(target_indices).unique_counts
   offset = target_lengths - lengths
   offset = offset.roll(1, 0)
   offset[0] = 0
@@ -56,12 +216,80 @@ def repack(data, indices, target_indices):
   out[index] = data
   return data, target_indices
 
+def _broadcast(indices, data):
+  return indices.view(-1, *(data.dim() - 1) * [1]).expand_as(data)
+
+def _fill_empty(result, counts, fill_value):
+  empty = (counts == 0).view(-1, *(result.dim() - 1) * [1])
+  return torch.where(empty, torch.full_like(result, fill_value), result)
+
+HAS_SEGMENT_REDUCE = hasattr(torch, "segment_reduce")
+_SEGMENT_REDUCE = {"sum": "sum", "mean": "mean", "amax": "max", "amin": "min"}
+
+def _native_op(reduce, value=0):
+  def _op(data, indices, dim=0, out=None, dim_size=None, fill_value=value):
+    if out is not None:
+      indices = index_tensor(indices)
+      if reduce == "sum":
+        return out.index_add_(0, indices, data)
+      if reduce == "mean":
+        # like torch_scatter, existing entries of `out` are not counted:
+        out.index_add_(0, indices, data)
+        counts = torch.bincount(indices, minlength=out.size(0)).clamp(min=1)
+        counts = counts.view(-1, *(out.dim() - 1) * [1]).to(out.dtype)
+        if out.is_floating_point():
+          return out.div_(counts)
+        return out.div_(counts, rounding_mode="floor")
+      return out.scatter_reduce_(
+        0, _broadcast(indices, data), data, reduce, include_self=True
+      )
+    segment = segment_index(indices, dim_size=dim_size)
+    size, counts, indices = segment.dim_size, segment.counts, segment.indices
+    if (HAS_SEGMENT_REDUCE and reduce in _SEGMENT_REDUCE and segment.sorted
+        and data.is_floating_point()):
+      # contiguous segments reduce without atomics. segment_reduce only
+      # supports floating point data:
+      result = torch.segment_reduce(
+        data, _SEGMENT_REDUCE[reduce], lengths=counts, axis=0, unsafe=True
+      )
+    else:
+      result = torch.zeros(
+        size, *data.shape[1:],
+        dtype=data.dtype, device=data.device
+      )
+      if reduce == "sum":
+        result = result.index_add(0, indices, data)
+      else:
+        result = result.scatter_reduce(
+          0, _broadcast(indices, data), data, reduce, include_self=False
+        )
+    return _fill_empty(result, counts, fill_value)
+  return _op
+
 HAS_SCATTER = True
 try:
   import torch_scatter as tsc
+  BACKEND = "torch_scatter"
+except ImportError:
+  HAS_SCATTER = False
+  BACKEND = "native" if hasattr(torch.Tensor, "scatter_reduce_") else "padded"
+
+_segment_csr = None
+if BACKEND == "torch_scatter":
+  _segment_csr = getattr(tsc, "segment_csr", None)
+elif BACKEND == "native" and HAS_SEGMENT_REDUCE:
+  def _segment_csr(data, pointers, reduce="sum"):
+    lengths = pointers[1:] - pointers[:-1]
+    return torch.segment_reduce(data, reduce, lengths=lengths, axis=0, unsafe=True)
+
+if BACKEND == "torch_scatter":
   def _scatter_op(operation):
-    def _op(*args, **kwargs):
-      return operation(*args, **kwargs, dim=0)
+    def _op(data, indices, dim=0, out=None, dim_size=None, **kwargs):
+      if out is None and dim_size is None and isinstance(indices, SegmentIndex):
+        dim_size = indices.dim_size
+      return operation(
+        data, index_tensor(indices), dim=0, out=out, dim_size=dim_size, **kwargs
+      )
     try:
       return _op
     finally:
@@ -74,14 +302,25 @@ try:
   div = _scatter_op(tsc.scatter_div)
   std = _scatter_op(tsc.scatter_std)
   mean = _scatter_op(tsc.scatter_mean)
-except ImportError:
+elif BACKEND == "native":
+  add = _native_op("sum", value=0)
+  mean = _native_op("mean", value=0)
+  min = _native_op("amin", value=float("inf"))
+  max = _native_op("amax", value=float("-inf"))
+  mul = _native_op("prod", value=1)
+
+  def sub(data, indices, dim=0, out=None, dim_size=None, fill_value=0):
+    return add(-data, indices, dim=dim, out=out, dim_size=dim_size, fill_value=fill_value)
+
+  def div(data, indices, dim=0, out=None, dim_size=None, fill_value=1):
+    return mul(1.0 / data, indices, dim=dim, out=out, dim_size=dim_size, fill_value=fill_value)
+else:
   def _scatter_op(operation, update, value=0):
     def _op(data, indices, dim=0, out=None, dim_size=None, fill_value=value):
       padded, pad_indices, _, counts = pad(data, indices, value=value)
       processed = operation(padded, counts.unsqueeze(1))
-      if dim_size is None:
-        dim_size = processed.size(0)
       if out is None:
+        dim_size = _dim_size(indices, dim_size=dim_size)
         out = torch.zeros(
           dim_size, *processed.shape[1:],
           dtype=data.dtype,
@@ -123,38 +362,160 @@ except ImportError:
   mul = _scatter_op(lambda x, y: x.prod(dim=1), _update_mul, value=1)
   div = _scatter_op(lambda x, y: 1.0 / x.prod(dim=1), _update_mul, value=1)
 
+if BACKEND != "torch_scatter":
   def var(data, indices, dim=0, out=None, dim_size=None, unbiased=True):
-    if out is None and dim_size is None:
-      out = torch.zeros(
-        indices.max() + 1, *data.shape[1:],
-        dtype=data.dtype, device=data.device
-      )
-    if dim_size is None:
-      dim_size = out.size(0)
-    _, counts = indices.unique(return_counts=True)
-    counts = counts.float()
-    factor = counts / (counts - 1)
-    factor = factor.unsqueeze(1)
-    mean_value = mean(data, indices, dim_size=dim_size)[indices]
-    out = factor * mean((data - mean_value) ** 2, indices, dim_size=dim_size)
-    return out
+    segment = segment_index(indices, dim_size=_dim_size(indices, out=out, dim_size=dim_size))
+    counts = segment.counts.to(data.dtype)
+    counts = counts.view(-1, *(data.dim() - 1) * [1])
+    mean_value = mean(data, segment)[segment.indices]
+    out = add((data - mean_value) ** 2, segment)
+    return out / (counts - int(unbiased)).clamp(min=1)
 
   def std(data, indices, dim=0, out=None, dim_size=None, unbiased=True):
     return torch.sqrt(var(
       data, indices, dim=dim, out=out, dim_size=dim_size, unbiased=unbiased
     ))
 
+def _segment_reduce(data, segment, reduce):
+  if segment.sorted and data.is_floating_point() and _segment_csr is not None:
+    # contiguous segments reduce in a single pass over row pointers:
+    return _segment_csr(data, segment.pointers, reduce=reduce)
+  result = (max if reduce == "max" else add)(data, segment)
+  return result[0] if isinstance(result, tuple) else result
+
+def _stable_maximum(data, segment):
+  maximum = _segment_reduce(data, segment, "max")
+  # segments which are empty or entirely -inf are shifted by zero:
+  return torch.where(torch.isfinite(maximum), maximum, torch.zeros_like(maximum))
+
+class _SegmentSoftmax(torch.autograd.Function):
+  @staticmethod
+  def forward(ctx, data, segment, log):
+    indices = segment.indices
+    shifted = data - _stable_maximum(data, segment)[indices]
+    exp = shifted.exp()
+    total = _segment_reduce(exp, segment, "sum")
+    if log:
+      result = shifted - total.log()[indices]
+    else:
+      result = exp / total[indices]
+    ctx.segment = segment
+    ctx.log = log
+    ctx.save_for_backward(result)
+    return result
+
+  @staticmethod
+  def backward(ctx, grad_output):
+    result, = ctx.saved_tensors
+    segment = ctx.segment
+    indices = segment.indices
+    if ctx.log:
+      total = _segment_reduce(grad_output, segment, "sum")
+      grad = grad_output - result.exp() * total[indices]
+    else:
+      total = _segment_reduce(grad_output * result, segment, "sum")
+      grad = result * (grad_output - total[indices])
+    return grad, None, None
+
+class _SegmentLogSumExp(torch.autograd.Function):
+  @staticmethod
+  def forward(ctx, data, segment):
+    maximum = _stable_maximum(data, segment)
+    total = _segment_reduce((data - maximum[segment.indices]).exp(), segment, "sum")
+    result = maximum + total.log()
+    ctx.segment = segment
+    ctx.save_for_backward(data, result)
+    return result
+
+  @staticmethod
+  def backward(ctx, grad_output):
+    data, result = ctx.saved_tensors
+    indices = ctx.segment.indices
+    shift = torch.where(torch.isfinite(result), result, torch.zeros_like(result))
+    grad = grad_output[indices] * (data - shift[indices]).exp()
+    return grad, None
+
 def softmax(data, indices, dim_size=None):
-  if dim_size is None:
-    dim_size = indices.max() + 1
-  out = data - max(data, indices, dim_size=dim_size)[indices]
-  out = out.exp()
-  out = out / (add(out, indices, dim_size=dim_size)[indices] + 1e-6)
-  return out
+  r"""Computes the softmax of each segment of a ragged tensor. The
+  maximum, exponent and sum are computed once in the forward pass, and
+  only the result is kept for the backward pass. Trailing dimensions,
+  such as attention heads, are normalized independently in one call.
+
+  Args:
+    data (torch.Tensor): ragged input tensor.
+    indices (torch.Tensor or SegmentIndex): segment index of each element.
+    dim_size (int): number of segments.
+
+  Shape:
+    - Data: :math:`(\sum_i N_i, ...)`
+    - Indices: :math:`(\sum_i N_i)`
+    - Output: :math:`(\sum_i N_i, ...)`
+  """
+  return _SegmentSoftmax.apply(data, segment_index(indices, dim_size=dim_size), False)
+
+def log_softmax(data, indices, dim_size=None):
+  r"""Computes the log-softmax of each segment of a ragged tensor.
+  See :func:`softmax`.
+
+  Shape:
+    - Data: :math:`(\sum_i N_i, ...)`
+    - Indices: :math:`(\sum_i N_i)`
+    - Output: :math:`(\sum_i N_i, ...)`
+  """
+  return _SegmentSoftmax.apply(data, segment_index(indices, dim_size=dim_size), True)
+
+def logsumexp(data, indices, dim_size=None):
+  r"""Computes the log-sum-exp of each segment of a ragged tensor.
+  Empty segments result in `-inf`.
+
+  Args:
+    data (torch.Tensor): ragged input tensor.
+    indices (torch.Tensor or SegmentIndex): segment index of each element.
+    dim_size (int): number of segments.
+
+  Shape:
+    - Data: :math:`(\sum_i N_i, ...)`
+    - Indices: :math:`(\sum_i N_i)`
+    - Output: :math:`(S, ...)`
+  """
+  return _SegmentLogSumExp.apply(data, segment_index(indices, dim_size=dim_size))
+
+def cumsum(data, indices):
+  r"""Computes the cumulative sum of each segment of a ragged tensor in
+  order of its elements.
+
+  Args:
+    data (torch.Tensor): ragged input tensor.
+    indices (torch.Tensor or SegmentIndex): segment index of each element.
+
+  Shape:
+    - Data: :math:`(\sum_i N_i, ...)`
+    - Indices: :math:`(\sum_i N_i)`
+    - Output: :math:`(\sum_i N_i, ...)`
+  """
+  segment = segment_index(indices)
+  order = None
+  if not segment.sorted:
+    _, order = torch.sort(segment.indices, stable=True)
+    data = data[order]
+    segment = SegmentIndex(
+      segment.indices[order], dim_size=segment.dim_size,
+      counts=segment.counts, is_sorted=True
+    )
+  # accumulate in double precision, such that later segments do not lose
+  # precision to the running total of all segments before them:
+  accumulated = data.double() if data.is_floating_point() else data
+  total = accumulated.cumsum(dim=0)
+  # subtract the running total before the start of each segment:
+  start = (total - accumulated)[segment.offsets[segment.indices]]
+  result = (total - start).to(data.dtype)
+  if order is not None:
+    result = torch.empty_like(result).index_copy(0, order, result)
+  return result
 
 def autoregressive(module, data, indices):
-  _e, counts = indices.unique(return_counts=True)
-  max_count = counts.max()
+  segment = segment_index(indices)
+  max_count = segment.max_count
   out = data
   values = []
   state = None
@@ -163,11 +524,8 @@ def autoregressive(module, data, indices):
     values.append(out.unsqueeze(0))
 
   values = torch.cat(values, dim=0)
-  access_0 = torch.cat([
-    torch.arange(0, count, dtype=torch.long, device=values.device)
-    for count in counts
-  ], dim=0)
-  access_1 = indices
+  access_0 = segment.positions
+  access_1 = segment.indices
   result = values[access_0, access_1]
   return result
 
@@ -181,11 +539,9 @@ def reduced_sequential(module, data, indices, out=None, dim_size=None):
   result, hidden = module(packed)
   last = torch.cumsum(counts, dim=0) - 1
 
-  if dim_size is None:
-    dim_size = indices.max() + 1
   if out is None:
     out = torch.zeros(
-      dim_size, result.shape[1:],
+      _dim_size(indices, dim_size=dim_size), *result.shape[1:],
       dtype=data.dtype, device=data.device
     )
   out_hidden = torch.zeros_like(out)
@@ -204,11 +560,9 @@ def reduced_batched(module, data, indices, out=None,
   padded, pad_indices, _, counts = pad(data, indices, value=padding_value)
   result = module(padded.transpose(1, 2)).transpose(1, 2)
   result = result.sum(dim=1) / counts.float()
-  if dim_size is None:
-    dim_size = result.size(0)
   if out is None:
     out = torch.zeros(
-      dim_size, *result.shape[1:],
+      _dim_size(indices, dim_size=dim_size), *result.shape[1:],
       dtype=data.dtype, device=data.device
     )
   out[pad_indices] += result
@@ -257,7 +611,8 @@ def pairwise(op, data, indices, padding_value=0):
   return result, batch_indices, first_indices, second_indices, access
 
 def pairwise_no_pad(op, data, indices):
-  unique, counts = indices.unique(return_counts=True)
+  segment = segment_index(indices)
+  counts = segment.unique_counts
   expansion = torch.cumsum(counts, dim=0)
   expansion = torch.repeat_interleave(expansion, counts)
   offset = torch.arange(0, counts.sum(), device=data.device)
@@ -274,8 +629,319 @@ def pairwise_no_pad(op, data, indices):
   access = access - torch.repeat_interleave(expansion.roll(1).cumsum(dim=0), expansion) + off_start + expansion_offset
 
   result = op(expanded, data[access.to(data.device)])
-  return result, torch.repeat_interleave(indices, expansion, dim=0)
+  return result, torch.repeat_interleave(segment.indices, expansion, dim=0)
 
 def pairwise_get(data, access, idx):
   index = access[0][idx[0]] + access[1][idx[0]] * idx[1] + idx[2]
   return data[index]
+
+def _pairwise_tile_size(op, data, memory):
+  probe = op(data[:1].unsqueeze(1), data[:1].unsqueeze(0))
+  pair_bytes = (probe[0, 0].numel() + 2 * data[0].numel()) * data.element_size()
+  return int(builtins.max(1, (memory // pair_bytes) ** 0.5))
+
+def _pairwise_update(state, tile, mask, first, second, reduce, k):
+  mask = mask.view(*mask.shape, *(tile.dim() - 2) * [1]).expand_as(tile)
+  if reduce is None:
+    pairs = mask[(slice(None), slice(None)) + (tile.dim() - 2) * (0,)]
+    first, second = first.unsqueeze(1), second.unsqueeze(0)
+    first, second = torch.broadcast_tensors(first, second)
+    state = state or []
+    state.append((tile[pairs], first[pairs], second[pairs]))
+    return state
+  if reduce == "sum":
+    value = torch.where(mask, tile, torch.zeros_like(tile)).sum(dim=1)
+    return value if state is None else state + value
+  masked = torch.where(mask, tile, torch.full_like(tile, -float("inf")))
+  if reduce == "max":
+    value = masked.amax(dim=1)
+    return value if state is None else torch.maximum(state, value)
+  if reduce == "logsumexp":
+    value = masked.logsumexp(dim=1)
+    return value if state is None else torch.logaddexp(state, value)
+  if reduce == "topk":
+    candidates = second.view(1, -1, *(tile.dim() - 2) * [1]).expand_as(tile)
+    candidates = torch.where(mask, candidates, torch.full_like(candidates, -1))
+    if state is not None:
+      masked = torch.cat((state[0], masked), dim=1)
+      candidates = torch.cat((state[1], candidates), dim=1)
+    values, position = masked.topk(min(k, masked.size(1)), dim=1)
+    return values, candidates.gather(1, position)
+  raise ValueError(f"Unknown pairwise reduction {reduce}.")
+
+def _pairwise_finalize(state, reduce, k):
+  if reduce is None:
+    return tuple(map(lambda x: torch.cat(x, dim=0), zip(*state)))
+  if reduce == "topk":
+    values, candidates = state
+    missing = k - values.size(1)
+    if missing > 0:
+      shape = (values.size(0), missing, *values.shape[2:])
+      values = torch.cat((values, values.new_full(shape, -float("inf"))), dim=1)
+      candidates = torch.cat((candidates, candidates.new_full(shape, -1)), dim=1)
+    return values, candidates
+  return state
+
+def blockwise_pairwise(op, data, indices, reduce=None, k=1, tile_size=None,
+                       memory=2 ** 28, diagonal=True):
+  r"""Applies a pairwise operation to all pairs of elements within each
+  segment of a ragged tensor. The pairs of each segment are visited in
+  square tiles of pairs, to each of which `op` and an optional reduction
+  over the second element are applied. Unless no reduction is given, the
+  full set of pairs is never materialized.
+
+  Args:
+    op (callable): pairwise operation on broadcastable tensors of first
+      elements of shape :math:`(R, 1, ...)` and second elements of shape
+      :math:`(1, C, ...)`, returning a tensor of shape :math:`(R, C, ...)`.
+    data (torch.Tensor): ragged input tensor.
+    indices (torch.Tensor or SegmentIndex): segment index of each element.
+    reduce (str): reduction over the second element. One of `None`,
+      `"sum"`, `"max"`, `"logsumexp"` or `"topk"`.
+    k (int): number of largest values kept by `"topk"`.
+    tile_size (int): number of first and second elements per tile.
+      Defaults to the largest tile fitting into `memory`.
+    memory (int): approximate number of bytes per tile.
+    diagonal (bool): include pairs of an element with itself?
+
+  Returns:
+    For no reduction, a tuple of pairwise results of all pairs with the
+    indices of their first and second elements. For `"topk"`, the `k`
+    largest values per element together with the indices of their second
+    elements, padded with `-inf` and `-1` for segments with fewer than
+    `k` elements. Otherwise, the reduced value for each element.
+
+  Shape:
+    - Data: :math:`(\sum_i N_i, ...)`
+    - Indices: :math:`(\sum_i N_i)`
+    - Output: :math:`(\sum_i N_i^2, ...)` without reduction,
+      :math:`(\sum_i N_i, k, ...)` for `"topk"` and
+      :math:`(\sum_i N_i, ...)` otherwise.
+  """
+  segment = segment_index(indices)
+  order = None
+  if not segment.sorted:
+    _, order = torch.sort(segment.indices, stable=True)
+    data = data[order]
+    segment = SegmentIndex(
+      segment.indices[order], dim_size=segment.dim_size,
+      counts=segment.counts, is_sorted=True
+    )
+  indices = segment.indices
+  total = indices.size(0)
+  if total == 0:
+    raise ValueError("Pairwise operations need at least one element.")
+  tile_size = tile_size or _pairwise_tile_size(op, data, memory)
+
+  # each tile of first elements pairs with the segments it intersects:
+  starts = segment.offsets[indices]
+  stops = starts + segment.counts[indices]
+  results = []
+  for row in range(0, total, tile_size):
+    row_stop = builtins.min(row + tile_size, total)
+    first = torch.arange(row, row_stop, device=data.device)
+    column_start, column_stop = int(starts[row]), int(stops[row_stop - 1])
+    state = None
+    for column in range(column_start, column_stop, tile_size):
+      second = torch.arange(
+        column, builtins.min(column + tile_size, column_stop),
+        device=data.device
+      )
+      mask = indices[first].unsqueeze(1) == indices[second].unsqueeze(0)
+      if not diagonal:
+        mask = mask & (first.unsqueeze(1) != second.unsqueeze(0))
+      tile = op(data[first].unsqueeze(1), data[second].unsqueeze(0))
+      state = _pairwise_update(state, tile, mask, first, second, reduce, k)
+    results.append(_pairwise_finalize(state, reduce, k))
+
+  if reduce is None:
+    values, first, second = map(lambda x: torch.cat(x, dim=0), zip(*results))
+    if order is not None:
+      first, second = order[first], order[second]
+    return values, first, second
+  if reduce == "topk":
+    values, candidates = map(lambda x: torch.cat(x, dim=0), zip(*results))
+    if order is not None:
+      candidates = torch.where(
+        candidates >= 0, order[candidates.clamp(min=0)], candidates
+      )
+      values = torch.empty_like(values).index_copy(0, order, values)
+      candidates = torch.empty_like(candidates).index_copy(0, order, candidates)
+    return values, candidates
+  result = torch.cat(results, dim=0)
+  if order is not None:
+    result = torch.empty_like(result).index_copy(0, order, result)
+  return result
+
+def _dot_similarity(key, query):
+  scale = query.size(-1) ** -0.5
+  return torch.einsum("...ha,...ha->...h", key, query) * scale
+
+def _attention_tiles(segment, tile_size):
+  indices = segment.indices
+  total = indices.size(0)
+  starts = segment.offsets[indices]
+  stops = starts + segment.counts[indices]
+  for row in range(0, total, tile_size):
+    row_stop = builtins.min(row + tile_size, total)
+    column_start, column_stop = int(starts[row]), int(stops[row_stop - 1])
+    columns = [
+      (column, builtins.min(column + tile_size, column_stop))
+      for column in range(column_start, column_stop, tile_size)
+    ]
+    yield (row, row_stop), columns
+
+def _attention_scores(similarity, query, key, query_indices, key_indices):
+  score = similarity(key.unsqueeze(0), query.unsqueeze(1))
+  mask = query_indices.unsqueeze(1) == key_indices.unsqueeze(0)
+  mask = mask.view(*mask.shape, *(score.dim() - 2) * [1])
+  return score, mask
+
+def _similarity_parameters(similarity):
+  owner = getattr(similarity, "__self__", similarity)
+  if isinstance(owner, nn.Module):
+    return list(owner.parameters())
+  return []
+
+class _SegmentAttention(torch.autograd.Function):
+  @staticmethod
+  def forward(ctx, query, key, value, segment, similarity, tile_size, *parameters):
+    indices = segment.indices
+    output = value.new_zeros(query.size(0), *value.shape[1:])
+    lse = query.new_zeros(query.shape[:2])
+    for rows, columns in _attention_tiles(segment, tile_size):
+      first = slice(*rows)
+      maximum = total = accumulator = None
+      for column in columns:
+        second = slice(*column)
+        score, mask = _attention_scores(
+          similarity, query[first], key[second], indices[first], indices[second]
+        )
+        score = torch.where(mask, score, torch.full_like(score, -float("inf")))
+        tile_maximum = score.amax(dim=1)
+        if maximum is not None:
+          tile_maximum = torch.maximum(maximum, tile_maximum)
+        shift = torch.where(
+          torch.isfinite(tile_maximum), tile_maximum, torch.zeros_like(tile_maximum)
+        )
+        weight = (score - shift.unsqueeze(1)).exp()
+        update = torch.einsum("rch,chv->rhv", weight, value[second])
+        if maximum is None:
+          total, accumulator = weight.sum(dim=1), update
+        else:
+          # rescale the running sums to the new maximum:
+          rescale = (maximum - shift).exp()
+          total = total * rescale + weight.sum(dim=1)
+          accumulator = accumulator * rescale.unsqueeze(-1) + update
+        maximum = tile_maximum
+      output[first] = accumulator / total.unsqueeze(-1)
+      lse[first] = shift + total.log()
+    ctx.segment = segment
+    ctx.similarity = similarity
+    ctx.tile_size = tile_size
+    # parameters are kept by reference, as the similarity uses them directly:
+    ctx.parameters = parameters
+    ctx.save_for_backward(query, key, value, output, lse)
+    return output
+
+  @staticmethod
+  @once_differentiable
+  def backward(ctx, grad_output):
+    query, key, value, output, lse = ctx.saved_tensors
+    indices = ctx.segment.indices
+    grad_query = torch.zeros_like(query)
+    grad_key = torch.zeros_like(key)
+    grad_value = torch.zeros_like(value)
+    grad_parameters = [None for _ in ctx.parameters]
+    delta = (grad_output * output).sum(dim=-1)
+    for rows, columns in _attention_tiles(ctx.segment, ctx.tile_size):
+      first = slice(*rows)
+      for column in columns:
+        second = slice(*column)
+        # scores are recomputed instead of stored:
+        with torch.enable_grad():
+          tile_query = query[first].detach().requires_grad_()
+          tile_key = key[second].detach().requires_grad_()
+          score, mask = _attention_scores(
+            ctx.similarity, tile_query, tile_key, indices[first], indices[second]
+          )
+        weight = torch.where(
+          mask, (score.detach() - lse[first].unsqueeze(1)).exp(),
+          torch.zeros_like(score)
+        )
+        grad_value[second] += torch.einsum("rch,rhv->chv", weight, grad_output[first])
+        grad_weight = torch.einsum("rhv,chv->rch", grad_output[first], value[second])
+        grad_score = weight * (grad_weight - delta[first].unsqueeze(1))
+        tile_grad_query, tile_grad_key, *tile_grad_parameters = torch.autograd.grad(
+          score, (tile_query, tile_key, *ctx.parameters), grad_score,
+          allow_unused=True
+        )
+        grad_query[first] += tile_grad_query
+        grad_key[second] += tile_grad_key
+        for idx, grad in enumerate(tile_grad_parameters):
+          if grad is None:
+            continue
+          if grad_parameters[idx] is None:
+            grad_parameters[idx] = grad
+          else:
+            grad_parameters[idx] = grad_parameters[idx] + grad
+    return (grad_query, grad_key, grad_value, None, None, None, *grad_parameters)
+
+def attention(query, key, value, indices, similarity=None,
+              tile_size=None, memory=2 ** 26, parameters=None):
+  r"""Computes softmax attention between all elements of each segment of
+  a ragged tensor without padding. Keys are visited in tiles, over which
+  the softmax is accumulated online by rescaling running sums to the
+  current maximum score. Only the output and the log-sum-exp of scores
+  per query are kept for the backward pass, which recomputes the scores
+  of each tile.
+
+  Args:
+    query (torch.Tensor): ragged query tensor.
+    key (torch.Tensor): ragged key tensor.
+    value (torch.Tensor): ragged value tensor.
+    indices (torch.Tensor or SegmentIndex): segment index of each element.
+    similarity (callable): kernel comparing key and query vectors of
+      shapes :math:`(1, C, H, A)` and :math:`(R, 1, H, A)`. Defaults to
+      the scaled dot product.
+    tile_size (int): number of queries and keys per tile. Defaults to
+      the largest tile fitting into `memory`.
+    memory (int): approximate number of bytes per tile.
+    parameters (iterable): parameters of a learned similarity, which
+      receive gradients. Defaults to the parameters of `similarity` if
+      it is a :class:`torch.nn.Module` or one of its methods. Other
+      similarities are treated as parameter-free.
+
+  Shape:
+    - Query: :math:`(\sum_i N_i, H, A)`
+    - Key: :math:`(\sum_i N_i, H, A)`
+    - Value: :math:`(\sum_i N_i, H, V)`
+    - Indices: :math:`(\sum_i N_i)`
+    - Output: :math:`(\sum_i N_i, H, V)`
+  """
+  segment = segment_index(indices)
+  if segment.indices.size(0) == 0:
+    return value.new_zeros(0, *value.shape[1:])
+  if tile_size is None:
+    size = query.size(1) * (value.size(-1) + 2)
+    if similarity is not None:
+      size += query[0].numel()
+    tile_size = int(builtins.max(1, (memory // (size * query.element_size())) ** 0.5))
+  similarity = similarity or _dot_similarity
+  order = None
+  if not segment.sorted:
+    _, order = torch.sort(segment.indices, stable=True)
+    query, key, value = query[order], key[order], value[order]
+    segment = SegmentIndex(
+      segment.indices[order], dim_size=segment.dim_size,
+      counts=segment.counts, is_sorted=True
+    )
+  if parameters is None:
+    parameters = _similarity_parameters(similarity)
+  parameters = [parameter for parameter in parameters if parameter.requires_grad]
+  result = _SegmentAttention.apply(
+    query, key, value, segment, similarity, tile_size, *parameters
+  )
+  if order is not None:
+    result = torch.empty_like(result).index_copy(0, order, result)
+  return result
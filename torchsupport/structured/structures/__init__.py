@@ -1,2 +1,3 @@
 from .basic import *
 from .connection import *
+from .lowering import *
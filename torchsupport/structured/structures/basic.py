@@ -5,6 +5,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as func
 
+from torchsupport.structured.scatter import SegmentIndex, segment_index
 from .connection import (
   AbstractStructure, ConnectionStructure,
   SubgraphStructure, ConstantStructureMixin,
@@ -53,8 +54,8 @@ def random_substructure(structure, num_nodes, depth):
 
 class FullyConnectedScatter(ScatterStructure):
   def __init__(self, indices):
-    unique, counts = indices.unique(return_counts=True)
-    structure_indices = torch.arange(counts.sum(), device=indices.device)
+    counts = segment_index(indices).unique_counts
+    structure_indices = torch.arange(counts.sum(), device=counts.device)
     structure_indices = torch.repeat_interleave(
       structure_indices, torch.repeat_interleave(
         counts, counts
@@ -73,29 +74,31 @@ class FullyConnectedScatter(ScatterStructure):
     base = base.cumsum(dim=0)
     base = torch.repeat_interleave(torch.repeat_interleave(base, counts), repeated_counts)
 
-    structure_connections = torch.arange((counts * counts).sum(), device=indices.device)
+    structure_connections = torch.arange((counts * counts).sum(), device=counts.device)
     structure_connections = structure_connections - offset + base
 
     super(FullyConnectedScatter, self).__init__(
       0, 0,
       structure_indices,
-      structure_connections
+      structure_connections,
+      node_count=repeated_counts.size(0)
+    )
+    # every node receives one message per member of its subgraph:
+    self._segments = SegmentIndex(
+      structure_indices, counts=repeated_counts, is_sorted=True
     )
 
   @classmethod
   def collate(cls, structures):
     return structures[0].update_to(
       cls.collate_parameters(structures)
-    )
+    ).prepare_segments()
 
 class FullyConnectedConstant(ConstantStructure):
   def __init__(self, batch, width):
-    # prepare offsets of connections:
-    offset_factors = torch.arange(width * batch) * width
-    offset = torch.repeat_interleave(offset_factors, width)
-
-    structure_connections = torch.arange(width * width * batch) - offset
-    structure_connections = structure_connections.reshape(batch * width, width)
+    # each node connects to all nodes of its batch entry:
+    offset = torch.arange(batch * width) // width * width
+    structure_connections = offset.unsqueeze(1) + torch.arange(width).unsqueeze(0)
     super(FullyConnectedConstant, self).__init__(
       0, 0,
       structure_connections
@@ -107,16 +110,81 @@ class FullyConnectedConstant(ConstantStructure):
       cls.collate_parameters(structures)
     )
 
+class FullyConnectedImplicit(AbstractStructure):
+  r"""Fully connected structure on the segments of a ragged tensor, which
+  only stores segment metadata. Modules implementing `reduce_implicit`
+  aggregate over each segment directly, while other modules receive the
+  explicit edges of a :class:`FullyConnectedScatter`, built on demand.
+
+  Args:
+    indices (torch.Tensor or SegmentIndex): segment index of each node.
+  """
+  message_modes = {MessageMode.implicit, MessageMode.scatter}
+  current_mode = MessageMode.implicit
+  def __init__(self, indices):
+    self.segments = segment_index(indices)
+    self.node_count = len(self.segments)
+    self._explicit = None
+
+  @classmethod
+  def collate(cls, structures):
+    indices = []
+    offset = 0
+    for struc in structures:
+      indices.append(struc.segments.indices + offset)
+      offset += struc.segments.dim_size
+    return cls(SegmentIndex(torch.cat(indices, dim=0), dim_size=offset))
+
+  def move_to(self, device):
+    result = copy(self)
+    result.segments = self.segments.to(device)
+    result._explicit = None
+    return result
+
+  def __len__(self):
+    return self.node_count
+
+  def explicit(self):
+    r"""Equivalent :class:`FullyConnectedScatter` with explicit edges."""
+    if self._explicit is None:
+      self._explicit = FullyConnectedScatter(self.segments.indices)
+    return self._explicit
+
+  def message_implicit(self, source, target):
+    return source, target, self.segments
+
+  def message_scatter(self, source, target):
+    return self.explicit().message(source, target)
+
 class FullyConnectedStructure(AbstractStructure):
+  r"""Structure connecting all nodes within each segment of a ragged
+  tensor, or within each row of a batch of constant width.
+
+  Args:
+    indices (torch.Tensor): segment index of each node.
+    batch (int): number of segments of constant width.
+    width (int): number of nodes per segment.
+    implicit (bool): only store segment metadata instead of the
+      :math:`\sum_i N_i^2` edges of all segments?
+  """
   message_modes = set()
-  def __init__(self, indices=None, batch=None, width=None):
-    if batch is not None and width is not None:
-      self.message_modes.update({MessageMode.constant})
-      self.message_mode = MessageMode.constant
+  def __init__(self, indices=None, batch=None, width=None, implicit=False):
+    if implicit:
+      if indices is None and batch is not None and width is not None:
+        indices = torch.repeat_interleave(torch.arange(batch), width)
+      if indices is None:
+        raise ValueError("Either `indices` or `batch` and `width` "
+                         "need to be not `None`.")
+      self.message_modes = {MessageMode.implicit, MessageMode.scatter}
+      self.current_mode = MessageMode.implicit
+      self.structure = FullyConnectedImplicit(indices)
+    elif batch is not None and width is not None:
+      self.message_modes = {MessageMode.constant}
+      self.current_mode = MessageMode.constant
       self.structure = FullyConnectedConstant(batch, width)
     elif indices is not None:
-      self.message_modes.update({MessageMode.scatter})
-      self.message_mode = MessageMode.scatter
+      self.message_modes = {MessageMode.scatter}
+      self.current_mode = MessageMode.scatter
       self.structure = FullyConnectedScatter(indices)
     else:
       raise ValueError("Either `indices` or `batch` and `width` "
@@ -137,11 +205,29 @@ class FullyConnectedStructure(AbstractStructure):
     the_copy.structure = superstructure
     return the_copy
 
+  def move_to(self, device):
+    result = copy(self)
+    result.structure = self.structure.move_to(device)
+    return result
+
+  @property
+  def segments(self):
+    return self.structure.segments
+
+  def explicit(self):
+    r"""Equivalent structure with explicit edges."""
+    if isinstance(self.structure, FullyConnectedImplicit):
+      return self.structure.explicit()
+    return self.structure
+
+  def message_implicit(self, source, target):
+    return self.structure.message_implicit(source, target)
+
   def message_scatter(self, source, target):
-    return self.structure.message_scatter(source, target)
+    return self.explicit().message(source, target)
 
   def message_constant(self, source, target):
-    return self.structure.message_constant(source, target)
+    return self.structure.message(source, target)
 
 class DropoutStructure(AbstractStructure):
   def __init__(self, structure, p=0.5):
@@ -153,16 +239,21 @@ class DropoutStructure(AbstractStructure):
     """
     super(DropoutStructure, self).__init__()
     self.structure = structure
-    self.message_modes.update(self.structure.message_modes)
+    self.message_modes = self.structure.message_modes & {
+      MessageMode.iterative, MessageMode.scatter
+    }
     self.p = p
 
   def message_scatter(self, source, target):
     indices = self.structure.indices
-    connections = self.structure.connections
+    if isinstance(self.structure, ConnectionStructure):
+      connections = self.structure.columns
+    else:
+      connections = self.structure.connections
     total = indices.size(0)
     keep, _ = torch.randperm(total)[:int((1 - self.p) * total)].sort()
     indices = indices[keep]
-    connections = indices[keep]
+    connections = connections[keep]
     return source[connections], target[indices], indices, self.structure.node_count
 
   def message_iterative(self, source, target):
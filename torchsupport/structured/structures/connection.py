@@ -7,14 +7,14 @@ import networkx as nx
 
 from torchsupport.data.collate import Collatable
 from torchsupport.data.io import DeviceMovable
-from torchsupport.structured.chunkable import (
-  Chunkable, chunk_sizes, chunk_tensor
-)
+from torchsupport.structured.chunkable import Chunkable
+from torchsupport.structured.scatter import SegmentIndex
 
 class MessageMode(Enum):
   iterative = 0
   constant = 1
   scatter = 2
+  implicit = 3
 
 class AbstractStructure(DeviceMovable, Chunkable, Collatable):
   message_modes = set()
@@ -58,13 +58,106 @@ class AbstractStructure(DeviceMovable, Chunkable, Collatable):
       return self.message_mode(the_mode, *args, **kwargs)
     raise ValueError("No valid MessageMode found.")
 
+class CSRConnections(object):
+  r"""Read-only list-of-lists view of an adjacency in compressed sparse
+  row (CSR) format.
+
+  Args:
+    rows (torch.Tensor): row pointers of shape `(targets + 1,)`.
+    columns (torch.Tensor): source node of each edge, grouped by target.
+  """
+  def __init__(self, rows, columns):
+    self.rows = rows
+    self.columns = columns
+
+  def __len__(self):
+    return self.rows.size(0) - 1
+
+  def __getitem__(self, idx):
+    start, stop = self.rows[idx:idx + 2].tolist()
+    return self.columns[start:stop].tolist()
+
+  def __iter__(self):
+    rows = self.rows.tolist()
+    columns = self.columns.tolist()
+    for start, stop in zip(rows[:-1], rows[1:]):
+      yield columns[start:stop]
+
+def _csr(connections):
+  if isinstance(connections, CSRConnections):
+    return connections.rows, connections.columns
+  lengths = torch.tensor(list(map(len, connections)), dtype=torch.long)
+  rows = torch.zeros(lengths.size(0) + 1, dtype=torch.long)
+  rows[1:] = lengths.cumsum(dim=0)
+  columns = torch.tensor([
+    item
+    for connection in connections
+    for item in connection
+  ], dtype=torch.long)
+  return rows, columns
+
 class ConnectionStructure(AbstractStructure):
-  message_modes = {MessageMode.iterative}
+  r"""Structure connecting each target node to a list of source nodes.
+  The adjacency is stored in compressed sparse row (CSR) format as a
+  tensor of row pointers and a tensor of source nodes, and exposed as a
+  list of lists through `connections`.
+
+  Args:
+    source (str): source node type.
+    target (str): target node type.
+    connections (list): list of source nodes for each target node.
+  """
+  message_modes = {MessageMode.iterative, MessageMode.scatter}
+  current_mode = MessageMode.iterative
   def __init__(self, source, target, connections):
     self.source = source
     self.target = target
-    self.connections = connections
-    self.lengths = [len(connections)]
+    self.rows, self.columns = _csr(connections)
+    self.lengths = [len(self)]
+
+  @classmethod
+  def from_csr(cls, source, target, rows, columns):
+    r"""Creates a structure from row pointers and source nodes."""
+    return cls(source, target, CSRConnections(rows, columns))
+
+  @property
+  def connections(self):
+    return CSRConnections(self.rows, self.columns)
+
+  @connections.setter
+  def connections(self, value):
+    self.rows, self.columns = _csr(value)
+
+  def __len__(self):
+    return self.rows.size(0) - 1
+
+  @property
+  def node_count(self):
+    r"""Number of target nodes."""
+    return len(self)
+
+  @property
+  def counts(self):
+    r"""Number of source nodes of each target node."""
+    return self.rows[1:] - self.rows[:-1]
+
+  @property
+  def indices(self):
+    r"""Target node of each edge."""
+    return self.segments.indices
+
+  @property
+  def segments(self):
+    r"""Cached :class:`SegmentIndex` of the target node of each edge."""
+    rows, segments = getattr(self, "_segments", None) or (None, None)
+    if rows is not self.rows:
+      counts = self.counts
+      indices = torch.repeat_interleave(
+        torch.arange(len(self), device=counts.device), counts
+      )
+      segments = SegmentIndex(indices, counts=counts, is_sorted=True)
+      self._segments = (self.rows, segments)
+    return segments
 
   @classmethod
   def reachable_nodes(cls, start_nodes, structures, depth=1):
@@ -88,32 +181,40 @@ class ConnectionStructure(AbstractStructure):
     assert structures
     assert all(map(lambda x: x.source == structures[0].source, structures))
     assert all(map(lambda x: x.target == structures[0].target, structures))
-    connections = []
-    offset = 0
-    lengths = []
-    for structure in structures:
-      connections += list(map(
-        lambda x: list(map(lambda y: y + offset, x)),
-        structure.connections
-      ))
-      lengths.append(len(structure.connections))
-      offset += len(structure.connections)
-    result = cls(
-      structures[0].source,
-      structures[0].target,
-      connections
-    )
-    result.lengths = lengths
+    node_counts = torch.tensor([len(struc) for struc in structures])
+    edge_counts = torch.tensor([struc.columns.size(0) for struc in structures])
+    node_offsets = node_counts.cumsum(dim=0) - node_counts
+    edge_offsets = edge_counts.cumsum(dim=0) - edge_counts
+    rows = torch.cat([torch.zeros(1, dtype=torch.long)] + [
+      struc.rows[1:] - struc.rows[0]
+      for struc in structures
+    ], dim=0)
+    rows[1:] += torch.repeat_interleave(edge_offsets, node_counts)
+    columns = torch.cat([struc.columns for struc in structures], dim=0)
+    columns = columns + torch.repeat_interleave(node_offsets, edge_counts)
+    result = copy(structures[0])
+    result.rows, result.columns = rows, columns
+    result._segments = None
+    result.lengths = [
+      length
+      for struc in structures
+      for length in struc.lengths
+    ]
     return result
 
   @classmethod
   def from_edges(cls, edges, source, target, nodes, directed=False):
-    connections = [[] for _ in range(nodes)]
-    for s, t in edges:
-      connections[t].append(s)
-      if not directed:
-        connections[s].append(t)
-    return cls(source, target, connections)
+    edges = torch.as_tensor(edges, dtype=torch.long).view(-1, 2)
+    sources, targets = edges[:, 0], edges[:, 1]
+    if not directed:
+      sources, targets = (
+        torch.stack((sources, targets), dim=1).view(-1),
+        torch.stack((targets, sources), dim=1).view(-1)
+      )
+    _, order = torch.sort(targets, stable=True)
+    rows = torch.zeros(nodes + 1, dtype=torch.long)
+    rows[1:] = torch.bincount(targets, minlength=nodes).cumsum(dim=0)
+    return cls.from_csr(source, target, rows, sources[order])
 
   @classmethod
   def from_nx(cls, graph, source, target):
@@ -134,25 +235,48 @@ class ConnectionStructure(AbstractStructure):
     return cls(source, target, connections)
 
   def move_to(self, device):
-    return self
+    result = copy(self)
+    result.rows = self.rows.to(device)
+    result.columns = self.columns.to(device)
+    rows, segments = getattr(self, "_segments", None) or (None, None)
+    if rows is self.rows:
+      result._segments = (result.rows, segments.to(device))
+    return result
+
+  def chunk_costs(self, cost="elements"):
+    if cost == "edges":
+      boundaries = torch.tensor([0] + list(self.lengths)).cumsum(dim=0)
+      edges = self.rows.cpu()[boundaries]
+      return (edges[1:] - edges[:-1]).tolist()
+    return list(self.lengths)
 
-  def chunk(self, targets):
-    sizes = chunk_sizes(self.lengths, len(targets))
+  def chunk(self, targets, plan=None):
+    plan = plan or self.chunk_plan(targets)
+    sizes = plan.sizes(self.lengths)
     result = []
     offset = 0
-    for size in sizes:
+    for size, lengths in zip(sizes, plan.split(self.lengths)):
+      rows = self.rows[offset:offset + size + 1]
+      start, stop = rows[0].item(), rows[-1].item()
       the_copy = copy(self)
-      the_copy.connections = [
-        [
-          item - offset
-          for item in connection
-        ]
-        for connection in self.connections[offset:offset + size]
-      ]
+      the_copy.rows = rows - start
+      the_copy.columns = self.columns[start:stop] - offset
+      the_copy._segments = None
+      the_copy.lengths = list(lengths)
       result.append(the_copy)
       offset += size
     return result
 
+  def _edges_of(self, targets):
+    starts = self.rows[targets]
+    counts = self.rows[targets + 1] - starts
+    edge_targets = torch.repeat_interleave(
+      torch.arange(targets.size(0), device=targets.device), counts
+    )
+    first = torch.repeat_interleave(starts - (counts.cumsum(dim=0) - counts), counts)
+    positions = first + torch.arange(edge_targets.size(0), device=targets.device)
+    return edge_targets, self.columns[positions]
+
   def select(self, sources, targets=None):
     """Selects a sub-adjacency structure from an adjacency structure
        given a set of source and target nodes to keep.
@@ -164,24 +288,43 @@ class ConnectionStructure(AbstractStructure):
     Returns:
       Subsampled adjacency structure containing only the desired nodes.
     """
-    result = ConnectionStructure(self.source, self.target, [])
-    if targets is None:
-      targets = sources
-    for target in targets:
-      result.connections.append([
-        sources.index(source)
-        for source in self.connections[target]
-        if source in sources
-      ])
-    return result
+    device = self.rows.device
+    sources = torch.as_tensor(sources, dtype=torch.long, device=device).view(-1)
+    targets = sources if targets is None else torch.as_tensor(
+      targets, dtype=torch.long, device=device
+    ).view(-1)
+    edge_targets, edge_sources = self._edges_of(targets)
+
+    # map kept source nodes to their position, and all other nodes to -1:
+    size = max(
+      sources.max().item() if sources.numel() else -1,
+      self.columns.max().item() if self.columns.numel() else -1
+    ) + 1
+    table = torch.full((size,), -1, dtype=torch.long, device=device)
+    table[sources] = torch.arange(sources.size(0), device=device)
+    edge_sources = table[edge_sources]
+    keep = edge_sources >= 0
+    rows = torch.zeros(targets.size(0) + 1, dtype=torch.long, device=device)
+    rows[1:] = torch.bincount(
+      edge_targets[keep], minlength=targets.size(0)
+    ).cumsum(dim=0)
+    return ConnectionStructure.from_csr(
+      self.source, self.target, rows, edge_sources[keep]
+    )
 
-  def message(self, source, target):
+  def message_iterative(self, source, target):
+    rows = self.rows.tolist()
     for idx, _ in enumerate(target):
-      if self.connections[idx]:
-        yield source[self.connections[idx]].unsqueeze(0)
+      start, stop = rows[idx], rows[idx + 1]
+      if stop > start:
+        yield source[self.columns[start:stop]].unsqueeze(0)
       else:
         yield torch.zeros_like(source[0:1]).unsqueeze(0)
 
+  def message_scatter(self, source, target):
+    indices = self.indices
+    return source[self.columns], target[indices], indices, len(self)
+
 class CompoundStructure(AbstractStructure):
   message_modes = {MessageMode.iterative}
   current_mode = MessageMode.iterative
@@ -196,12 +339,20 @@ class CompoundStructure(AbstractStructure):
       for idx, substructure in enumerate(structure.structures):
         slots[idx].append(substructure)
     for idx, slot in enumerate(slots):
-      slots[idx] = ConnectionStructure.cat(slot)
+      slots[idx] = slot[0].__class__.collate(slot)
     return cls(slots)
 
-  def chunk(self, targets):
+  def chunk_costs(self, cost="elements"):
+    costs = [
+      structure.chunk_costs(cost)
+      for structure in self.structures
+    ]
+    return [sum(item) for item in zip(*costs)]
+
+  def chunk(self, targets, plan=None):
+    plan = plan or self.chunk_plan(targets)
     result = [
-      structure.chunk(targets)
+      structure.chunk(targets, plan=plan)
       for structure in self.structures
     ]
     n_chunks = len(result[0])
@@ -236,16 +387,22 @@ class ConstantStructure(AbstractStructure):
     result.connections = result.connections.to(device)
     return result
 
-  def chunk(self, targets):
+  def chunk_costs(self, cost="elements"):
+    if cost == "edges":
+      width = self.connections.size(1) if self.connections.dim() > 1 else 1
+      return [length * width for length in self.lengths]
+    return list(self.lengths)
+
+  def chunk(self, targets, plan=None):
+    plan = plan or self.chunk_plan(targets)
     connections = []
-    sizes = chunk_sizes(self.lengths, len(targets))
-    step = len(self.lengths) // len(targets)
+    sizes = plan.sizes(self.lengths)
     offset = 0
-    for idx, size in enumerate(sizes):
+    for target, size, lengths in zip(targets, sizes, plan.split(self.lengths)):
       the_connections = self.connections[offset:offset + size] - offset
-      the_connections = the_connections.to(targets[idx])
+      the_connections = the_connections.to(target)
       result = ConstantStructure(self.source, self.target, the_connections)
-      result.lengths = self.lengths[step * idx:step * (idx + 1)]
+      result.lengths = list(lengths)
       connections.append(result)
       offset += size
     return connections
@@ -309,12 +466,18 @@ class ConstantifiedStructure(ConstantStructure):
   @classmethod
   def collate(cls, structures):
     structure_class = structures[0].structure.__class__
-    return cls(structure_class.cat(structures))
+    return cls(structure_class.collate([
+      struc.structure
+      for struc in structures
+    ]))
+
+  def chunk_costs(self, cost="elements"):
+    return self.structure.chunk_costs(cost)
 
-  def chunk(self, targets):
+  def chunk(self, targets, plan=None):
     return [
       ConstantifiedStructure(the_chunk)
-      for the_chunk in self.structure.chunk(targets)
+      for the_chunk in self.structure.chunk(targets, plan=plan)
     ]
 
   def message(self, source, target):
@@ -343,6 +506,24 @@ class ScatterStructure(AbstractStructure):
     self.lengths = [len(self.indices)]
     self.node_counts = [self.node_count]
 
+  @property
+  def segments(self):
+    r"""Cached :class:`SegmentIndex` of the structure's indices, rebuilt
+    whenever the indices change."""
+    segments = getattr(self, "_segments", None)
+    if segments is None or segments.indices is not self.indices:
+      segments = SegmentIndex(self.indices, dim_size=self.node_count)
+      self._segments = segments
+    return segments
+
+  def prepare_segments(self):
+    r"""Precomputes segment metadata, such that it is shared by all
+    layers operating on this structure."""
+    self._segments = SegmentIndex(
+      self.indices, dim_size=self.node_count
+    ).precompute()
+    return self
+
   @classmethod
   def from_connections(cls, source, target, connections):
     node_count = len(connections)
@@ -364,6 +545,12 @@ class ScatterStructure(AbstractStructure):
 
   @classmethod
   def from_connection_structure(cls, structure):
+    if isinstance(structure, ConnectionStructure):
+      return cls(
+        structure.source, structure.target,
+        structure.indices, structure.columns,
+        node_count=len(structure)
+      )
     return cls.from_connections(
       structure.source, structure.target,
       structure.connections
@@ -424,22 +611,29 @@ class ScatterStructure(AbstractStructure):
     result.node_count = offset
     result.node_counts = node_counts
     result.lengths = lengths
-    return result
+    return result.prepare_segments()
+
+  def chunk_costs(self, cost="elements"):
+    if cost == "edges":
+      return list(self.lengths)
+    return list(self.node_counts)
 
-  def chunk(self, targets):
-    sizes = chunk_sizes(self.lengths, len(targets))
-    step = len(self.lengths) // len(targets)
+  def chunk(self, targets, plan=None):
+    plan = plan or self.chunk_plan(targets)
+    sizes = plan.sizes(self.lengths)
     result = []
     offset = 0
     index_offset = 0
-    for idx, size in enumerate(sizes):
+    for target, size, lengths, node_counts in zip(
+        targets, sizes, plan.split(self.lengths), plan.split(self.node_counts)
+    ):
       the_copy = copy(self)
       the_copy.indices = self.indices[offset:offset + size] - index_offset
       the_copy.connections = self.connections[offset:offset + size] - index_offset
-      the_copy.lengths = self.lengths[idx * step:(idx + 1) * step]
-      the_copy.node_counts = self.node_counts[idx * step:(idx + 1) * step]
+      the_copy.lengths = list(lengths)
+      the_copy.node_counts = list(node_counts)
       the_copy.node_count = sum(the_copy.node_counts)
-      result.append(the_copy.to(targets[idx]))
+      result.append(the_copy.move_to(target))
       offset += size
       index_offset += the_copy.node_count
     return result
@@ -447,7 +641,12 @@ class ScatterStructure(AbstractStructure):
   def move_to(self, device):
     result = copy(self)
     result.connections = result.connections.to(device)
-    result.indices = result.indices.to(device)
+    segments = getattr(self, "_segments", None)
+    if segments is not None and segments.indices is self.indices:
+      result._segments = segments.to(device)
+      result.indices = result._segments.indices
+    else:
+      result.indices = result.indices.to(device)
     return result
 
   def __len__(self):
@@ -465,9 +664,9 @@ class SubgraphStructure(AbstractStructure):
   current_mode = MessageMode.scatter
   def __init__(self, membership):
     self.indices = membership
-    unique, counts = self.indices.unique(return_counts=True)
-    self.unique = unique
-    self.counts = counts
+    self.segments = SegmentIndex(membership).precompute(pad=True)
+    self.unique = self.segments.unique
+    self.counts = self.segments.unique_counts
 
   @classmethod
   def collate(cls, structures):
@@ -480,22 +679,35 @@ class SubgraphStructure(AbstractStructure):
     result = structure_class(torch.cat(indices, dim=0))
     return result
 
-  def chunk(self, targets):
-    sizes = chunk_sizes(self.counts, len(targets))
+  def chunk_costs(self, cost="elements"):
+    if cost == "edges":
+      return [0 for _ in range(self.counts.size(0))]
+    return self.counts.tolist()
+
+  def chunk(self, targets, plan=None):
+    plan = plan or self.chunk_plan(targets)
+    sizes = plan.sizes(self.counts.tolist())
     result = []
     offset = 0
-    for idx, size in enumerate(sizes):
+    for target, size in zip(targets, sizes):
       the_copy = copy(self)
       the_copy.indices = self.indices[offset:offset + size]
       the_copy.indices = the_copy.indices - the_copy.indices[0]
-      the_copy.indices = the_copy.indices.to(targets[idx])
-      the_copy.unique, the_copy.counts = the_copy.indices.unique(return_counts=True)
+      the_copy.indices = the_copy.indices.to(target)
+      the_copy.segments = SegmentIndex(the_copy.indices).precompute(pad=True)
+      the_copy.unique = the_copy.segments.unique
+      the_copy.counts = the_copy.segments.unique_counts
       result.append(the_copy)
       offset += the_copy.indices.size(0)
     return result
 
   def move_to(self, device):
-    return SubgraphStructure(self.indices.to(device))
+    result = copy(self)
+    result.segments = self.segments.to(device)
+    result.indices = result.segments.indices
+    result.unique = result.segments.unique
+    result.counts = result.segments.unique_counts
+    return result
 
   def message_iterative(self, source, target):
     for subgraph in self.unique:
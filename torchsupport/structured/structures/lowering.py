@@ -0,0 +1,134 @@
+import torch
+
+from .connection import (
+  AbstractStructure, ConnectionStructure, CompoundStructure,
+  SubgraphStructure, ConstantStructure, ScatterStructure, MessageMode
+)
+
+class LoweredScatterStructure(ScatterStructure):
+  r"""Scatter form of an iterative structure. Each edge may carry the
+  source nodes of several structures, whose messages are concatenated
+  along the feature dimension. Source node `-1` denotes the zero message
+  sent to nodes with an empty neighbourhood in iterative mode.
+
+  Args:
+    source (str): source node type.
+    target (str): target node type.
+    indices (torch.Tensor): target node of each edge.
+    connections (torch.Tensor): source nodes of each edge, one column per
+      concatenated structure.
+    node_count (int): number of target nodes.
+  """
+  def __init__(self, source, target, indices, connections, node_count=None):
+    super(LoweredScatterStructure, self).__init__(
+      source, target, indices, connections, node_count=node_count
+    )
+    self.has_empty = bool((connections < 0).any())
+
+  def message(self, source, target):
+    if self.has_empty:
+      source = torch.cat((source, source.new_zeros(1, *source.shape[1:])), dim=0)
+    source_message = torch.cat([
+      source[connections]
+      for connections in self.connections.unbind(dim=1)
+    ], dim=1)
+    return source_message, target[self.indices], self.indices, self.node_count
+
+def _is_plain(structure, base):
+  the_class = type(structure)
+  return (
+    isinstance(structure, base) and
+    the_class.message is AbstractStructure.message and
+    the_class.message_iterative is base.message_iterative
+  )
+
+def _filled_connections(structure):
+  counts = structure.counts
+  empty = counts == 0
+  if not empty.any():
+    return structure.indices, structure.columns
+  # empty neighbourhoods receive a single zero message:
+  filled = torch.where(empty, torch.ones_like(counts), counts)
+  indices = torch.repeat_interleave(
+    torch.arange(counts.size(0), device=counts.device), filled
+  )
+  columns = torch.full_like(indices, -1)
+  columns[~empty[indices]] = structure.columns
+  return indices, columns
+
+def _lower(structure):
+  if _is_plain(structure, ConnectionStructure):
+    counts = structure.counts
+    if counts.numel() > 0 and bool((counts == counts[0]).all()) and int(counts[0]) > 0:
+      return ConstantStructure(
+        structure.source, structure.target,
+        structure.columns.view(len(structure), -1)
+      )
+    indices, columns = _filled_connections(structure)
+    return LoweredScatterStructure(
+      structure.source, structure.target,
+      indices, columns.unsqueeze(1), node_count=len(structure)
+    )
+  if type(structure) is CompoundStructure:
+    parts = structure.structures
+    if not all(_is_plain(part, ConnectionStructure) for part in parts):
+      return None
+    if not all(torch.equal(part.rows, parts[0].rows) for part in parts):
+      return None
+    filled = [_filled_connections(part) for part in parts]
+    return LoweredScatterStructure(
+      parts[0].source, parts[0].target, filled[0][0],
+      torch.stack([columns for _, columns in filled], dim=1),
+      node_count=len(parts[0])
+    )
+  if type(structure) is SubgraphStructure:
+    indices = structure.indices.view(-1)
+    return LoweredScatterStructure(
+      "nodes", "subgraphs", indices,
+      torch.arange(indices.size(0), device=indices.device).unsqueeze(1),
+      node_count=structure.unique.size(0)
+    )
+  return None
+
+def _lowering_key(structure):
+  if isinstance(structure, ConnectionStructure):
+    return (structure.rows, structure.columns)
+  if isinstance(structure, CompoundStructure):
+    return tuple(
+      tensor
+      for part in structure.structures
+      for tensor in _lowering_key(part)
+    )
+  return (getattr(structure, "indices", None),)
+
+def lower(structure):
+  r"""Converts a structure passing messages in iterative mode into an
+  equivalent vectorized structure. Structures with a constant number of
+  neighbours per node become a :class:`ConstantStructure`, other
+  structures a :class:`ScatterStructure`. The result is cached on the
+  structure until its adjacency changes.
+
+  Args:
+    structure (AbstractStructure): structure to lower.
+
+  Returns:
+    Vectorized structure, or `None` if the structure cannot be lowered,
+    e.g. because it defines custom messages.
+  """
+  key = _lowering_key(structure)
+  cached = getattr(structure, "_lowered", None)
+  if cached is not None and len(cached[0]) == len(key) and all(
+      first is second for first, second in zip(cached[0], key)
+  ):
+    return cached[1]
+  lowered = _lower(structure)
+  structure._lowered = (key, lowered)
+  return lowered
+
+def is_iterative(structure):
+  r"""Does a structure pass messages in iterative mode by default?"""
+  return (
+    structure.mode_is(MessageMode.iterative) and
+    not structure.mode_is(MessageMode.constant) and
+    not structure.mode_is(MessageMode.scatter)
+  )
@@ -0,0 +1,47 @@
+import numpy as np
+import torch
+from torchsupport.data.asap_xml import (
+  GridIndex, fill_polygons, PolygonAnnotation, PointSetAnnotation,
+  CoordinateAnnotation
+)
+
+def contains(polygon, x, y):
+  inside = False
+  for (x0, y0), (x1, y1) in zip(polygon, np.roll(polygon, -1, axis=0)):
+    if min(y0, y1) <= y < max(y0, y1):
+      if x < x0 + (y - y0) / (y1 - y0) * (x1 - x0):
+        inside = not inside
+  return inside
+
+def test_fill_polygons_matches_pixel_centers():
+  polygons = [
+    np.array([[2.0, 2.0], [6.0, 2.0], [6.0, 6.0], [2.0, 6.0]]),
+    np.array([[10.3, 1.2], [19.7, 4.1], [12.2, 13.9], [15.0, 6.0]]),
+  ]
+  mask = fill_polygons(polygons, (0.0, 0.0), (16, 24))
+  expected = np.zeros((16, 24), dtype=bool)
+  for row in range(16):
+    for column in range(24):
+      expected[row, column] = any(
+        contains(polygon, column + 0.5, row + 0.5)
+        for polygon in polygons
+      )
+  assert (mask == expected).all()
+  assert mask[2:6, 2:6].all() and mask[:, :2].sum() == 0
+
+def test_grid_index_query():
+  index = GridIndex([[0, 0, 10, 10], [100, 100, 120, 130], [5, 90, 300, 95]], cell_size=32)
+  assert list(index.query((0, 0, 20, 20))) == [0]
+  assert list(index.query((110, 80, 200, 100))) == [1, 2]
+  assert len(index.query((200, 200, 210, 210))) == 0
+
+def test_annotation_tiles():
+  polygons = PolygonAnnotation([[[0, 0], [64, 0], [64, 64], [0, 64]]])
+  points = PointSetAnnotation([[[8, 8], [40, 40]]], radius=0)
+  annotation = CoordinateAnnotation({"tumor": polygons, "cells": points})
+  tile = annotation.tile_at((32, 32), size=(32, 32), origin=(0, 0), downsample=2)
+  assert tile.shape == (2, 32, 32)
+  assert tile[0, :16, :16].all() and tile[0, 16:].sum() == 0
+  assert tile[1].sum() == 1 and tile[1, 4, 4] == 1
+  cached = polygons.tile_at((32, 32), size=(32, 32), origin=(0, 0), downsample=2)
+  assert cached is polygons.tile_at((32, 32), size=(32, 32), origin=(0, 0), downsample=2)
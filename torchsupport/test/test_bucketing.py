@@ -0,0 +1,30 @@
+import pytest
+import torch
+from torchsupport.data.bucketing import BucketBatchSampler
+
+SIZES = torch.randint(1, 100, (257,), generator=torch.Generator().manual_seed(0))
+
+@pytest.mark.parametrize(
+  "batch_size, max_size, shuffle", [
+    (batch_size, max_size, shuffle)
+    for batch_size, max_size in ((16, None), (None, 400), (4, 400))
+    for shuffle in (True, False)
+  ]
+)
+def test_bucket_sampler_covers_dataset(batch_size, max_size, shuffle):
+  sampler = BucketBatchSampler(
+    SIZES, batch_size=batch_size, max_size=max_size, shuffle=shuffle
+  )
+  batches = list(sampler)
+  indices = sorted(index for batch in batches for index in batch)
+  assert indices == list(range(len(SIZES)))
+  if max_size is not None:
+    for batch in batches:
+      padded = len(batch) * int(SIZES[batch].max())
+      assert padded <= max_size or len(batch) == 1
+  if batch_size is not None:
+    assert all(len(batch) <= batch_size for batch in batches)
+
+def test_bucket_sampler_length():
+  sampler = BucketBatchSampler(SIZES, max_size=400)
+  assert len(sampler) == len(list(sampler))
@@ -0,0 +1,57 @@
+import pytest
+import torch
+from torchsupport.structured.chunkable import plan_chunks, scatter_chunked
+from torchsupport.structured import PackedTensor, ScatterStructure
+
+COSTS = [
+  [1, 1, 1, 1, 1, 1, 1],
+  [100, 1, 1, 1, 1, 1, 1, 1],
+  [3, 7, 2, 9, 4, 4, 1, 8, 5],
+  [5, 5]
+]
+
+@pytest.mark.parametrize(
+  "costs, targets, algorithm", [
+    (costs, targets, algorithm)
+    for costs in COSTS
+    for targets in (1, 2, 3, 4)
+    for algorithm in ("contiguous", "greedy")
+  ]
+)
+def test_plan_keeps_all_items(costs, targets, algorithm):
+  plan = plan_chunks(costs, targets, algorithm=algorithm)
+  assert len(plan) == min(targets, len(costs))
+  assert plan.total == len(costs)
+  assert all(count > 0 for count in plan.counts)
+  assert sum(plan.sizes(costs)) == sum(costs)
+
+@pytest.mark.parametrize("costs", COSTS)
+def test_contiguous_plan_is_balanced(costs):
+  plan = plan_chunks(costs, 2, algorithm="contiguous")
+  best = min(
+    max(sum(costs[:idx]), sum(costs[idx:]))
+    for idx in range(1, len(costs))
+  )
+  assert max(plan.sizes(costs)) == best
+
+def test_chunk_costs_aligned():
+  lengths = [2, 5, 3]
+  packed = PackedTensor([torch.randn(length, 4) for length in lengths])
+  structure = ScatterStructure.collate([
+    ScatterStructure(
+      0, 0,
+      torch.arange(length),
+      torch.arange(length),
+      node_count=length
+    )
+    for length in lengths
+  ])
+  assert packed.chunk_costs() == lengths
+  assert [int(count) for count in structure.chunk_costs()] == lengths
+  assert structure.chunk_costs("edges") == lengths
+
+def test_chunked_tensor_size_mismatch():
+  packed = PackedTensor([torch.randn(length, 4) for length in (2, 5, 3)])
+  edges = torch.randn(7, 2)
+  with pytest.raises(ValueError):
+    scatter_chunked((edges, packed), [0, 1], chunk_args=[0])
@@ -0,0 +1,52 @@
+import torch
+from torchsupport.structured import ScatterStructure, scatter
+from torchsupport.experimental.modules.structured.pooling import (
+  ColorPool, ColorUnpool, MinimumDegreeNodeColoring,
+  MaximumEigenvectorNodeColoring
+)
+
+def _path_structure(nodes):
+  first = torch.arange(nodes - 1)
+  indices = torch.cat((first, first + 1))
+  connections = torch.cat((first + 1, first))
+  return ScatterStructure("nodes", "nodes", indices, connections, node_count=nodes)
+
+def _sorted_path_structure(nodes):
+  structure = _path_structure(nodes)
+  order = torch.argsort(structure.indices * nodes + structure.connections)
+  return ScatterStructure(
+    "nodes", "nodes", structure.indices[order], structure.connections[order],
+    node_count=nodes
+  )
+
+def test_color_pool_path():
+  structure = _path_structure(5)
+  data = torch.arange(5, dtype=torch.float).unsqueeze(1)
+  pool = ColorPool(pooling=scatter.add, coloring=lambda data, structure: torch.tensor([1, 3]))
+  pooled, coarse, assignment = pool(data, structure)
+  # 0 joins 1, 2 joins the lower center 1, 4 joins 3:
+  assert assignment.tolist() == [0, 0, 0, 1, 1]
+  assert pooled.view(-1).tolist() == [3.0, 7.0]
+  assert sorted(zip(coarse.indices.tolist(), coarse.connections.tolist())) == [(0, 1), (1, 0)]
+  assert torch.equal(ColorUnpool()(pooled, assignment), pooled[assignment])
+
+def test_minimum_degree_coloring():
+  structure = _path_structure(4)
+  chosen = MinimumDegreeNodeColoring()(None, structure)
+  assert chosen.tolist() == [1, 2]
+
+def test_colorings_sorted_structure():
+  structure = _sorted_path_structure(5)
+  assert MinimumDegreeNodeColoring()(None, structure).tolist() == [1, 3]
+  data = torch.zeros(5, 1)
+  for matrix_free in (True, False):
+    chosen = MaximumEigenvectorNodeColoring(matrix_free=matrix_free)(data, structure)
+    assert ((chosen >= 0) & (chosen < 5)).all()
+
+def test_color_pool_sorted_structure():
+  structure = _sorted_path_structure(5)
+  data = torch.arange(5, dtype=torch.float).unsqueeze(1)
+  pool = ColorPool(pooling=scatter.add, coloring=MinimumDegreeNodeColoring())
+  pooled, coarse, assignment = pool(data, structure)
+  assert assignment.tolist() == [0, 0, 0, 1, 1]
+  assert pooled.view(-1).tolist() == [3.0, 7.0]
@@ -0,0 +1,62 @@
+import torch
+from torchsupport.structured import ConnectionStructure, MessageMode
+from torchsupport.structured.structures.basic import DropoutStructure
+
+def _structure():
+  return ConnectionStructure("nodes", "nodes", [[1, 2], [], [0], [0, 1, 2]])
+
+def test_csr_connections():
+  structure = _structure()
+  assert structure.rows.tolist() == [0, 2, 2, 3, 6]
+  assert structure.columns.tolist() == [1, 2, 0, 0, 1, 2]
+  assert list(structure.connections) == [[1, 2], [], [0], [0, 1, 2]]
+  assert structure.connections[3] == [0, 1, 2]
+  assert structure.indices.tolist() == [0, 0, 2, 3, 3, 3]
+
+def test_from_edges():
+  structure = ConnectionStructure.from_edges([(0, 1), (1, 2)], "nodes", "nodes", 3)
+  assert list(structure.connections) == [[1], [0, 2], [1]]
+  directed = ConnectionStructure.from_edges(
+    [(0, 1), (1, 2)], "nodes", "nodes", 3, directed=True
+  )
+  assert list(directed.connections) == [[], [0], [1]]
+
+def test_collate_and_chunk():
+  first, second = _structure(), ConnectionStructure("nodes", "nodes", [[1], [0]])
+  result = ConnectionStructure.collate([first, second])
+  assert list(result.connections) == [[1, 2], [], [0], [0, 1, 2], [5], [4]]
+  assert result.lengths == [4, 2]
+  assert result.chunk_costs("edges") == [6, 2]
+  chunks = result.chunk([0, 1])
+  assert [list(chunk.connections) for chunk in chunks] == [
+    list(first.connections), list(second.connections)
+  ]
+
+def test_select():
+  selected = _structure().select([2, 0, 3])
+  assert list(selected.connections) == [[1], [0], [1, 0]]
+
+def test_message_modes():
+  structure = _structure()
+  source = torch.randn(4, 3)
+  iterative = list(structure.message(source, source))
+  assert torch.equal(iterative[0][0], source[[1, 2]])
+  assert torch.equal(iterative[1], torch.zeros(1, 1, 3))
+  sources, targets, indices, node_count = structure.mode(
+    MessageMode.scatter
+  ).message(source, source)
+  assert node_count == 4
+  assert torch.equal(sources, source[[1, 2, 0, 0, 1, 2]])
+  assert torch.equal(targets, source[[0, 0, 2, 3, 3, 3]])
+
+def test_dropout_connection_structure():
+  structure = _structure()
+  assert structure.node_count == 4
+  dropout = DropoutStructure(structure, p=0.0)
+  assert dropout.message_modes == {MessageMode.iterative, MessageMode.scatter}
+  source = torch.arange(4, dtype=torch.float).unsqueeze(1)
+  source_message, target_message, indices, node_count = dropout.message(source, source)
+  assert node_count == 4
+  assert indices.tolist() == [0, 0, 2, 3, 3, 3]
+  assert source_message.view(-1).tolist() == [1.0, 2.0, 0.0, 0.0, 1.0, 2.0]
+  assert target_message.view(-1).tolist() == [0.0, 0.0, 2.0, 3.0, 3.0, 3.0]
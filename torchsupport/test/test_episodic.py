@@ -0,0 +1,62 @@
+import pytest
+import torch
+from torch.utils.data import Dataset
+from torchsupport.data.episodic import LabelIndex, EpisodeSampler, split_episode
+
+class LabelledData(Dataset):
+  def __init__(self, labels):
+    self.labels = labels
+
+  def __len__(self):
+    return len(self.labels)
+
+  def __getitem__(self, idx):
+    raise AssertionError("Items should not be loaded to build an index.")
+
+def test_label_index_build(tmp_path):
+  path = str(tmp_path / "labels.pt")
+  data = LabelledData([2, 0, 1, 0, 2, 2, 1, 0])
+  index = LabelIndex.build(data, path=path)
+  assert len(index) == 3
+  assert index.counts.tolist() == [3, 2, 3]
+  assert sorted(index.order[index.offsets[1]:][:2].tolist()) == [2, 6]
+
+  loaded = LabelIndex.build(LabelledData([9] * 8), path=path, fingerprint=8)
+  assert loaded.labels.tolist() == [9] * 8
+  cached = LabelIndex.build(LabelledData([0] * 8), path=path, fingerprint=8)
+  assert cached.labels.tolist() == [9] * 8
+  relabelled = LabelIndex.build(LabelledData([1, 0, 1, 0, 2, 2, 1, 0]), path=path)
+  assert relabelled.labels.tolist() == [1, 0, 1, 0, 2, 2, 1, 0]
+  rebuilt = LabelIndex.build(LabelledData([0, 1]), path=path)
+  assert rebuilt.labels.tolist() == [0, 1]
+
+def test_label_index_too_few_items():
+  index = LabelIndex([0, 0, 0, 1, 2, 2])
+  with pytest.raises(ValueError, match=r"\[1\]"):
+    index.sample(torch.tensor([0, 1, 2]), 2)
+  with pytest.raises(ValueError, match=r"\[0, 1, 2\]"):
+    index.sample(torch.tensor([0, 1, 2]), 4)
+
+def test_episode_sampler():
+  labels = torch.arange(5).repeat_interleave(torch.tensor([4, 6, 1, 5, 4]))
+  index = LabelIndex(labels)
+  ways, shots, queries = 3, 2, 2
+  sampler = EpisodeSampler(index, ways, shots, queries, episodes=20)
+  assert len(sampler) == 20
+  for batch in sampler:
+    batch = torch.tensor(batch)
+    assert batch.size(0) == ways * (shots + queries)
+    assert batch.unique().size(0) == batch.size(0)
+    support, support_labels, query, query_labels = split_episode(
+      labels[batch], ways, shots, queries
+    )
+    assert support_labels.tolist() == [0, 0, 1, 1, 2, 2]
+    assert query_labels.tolist() == [0, 0, 1, 1, 2, 2]
+    classes = support.view(ways, shots)[:, 0]
+    assert 2 not in classes.tolist()
+    assert classes.unique().size(0) == ways
+    assert (support.view(ways, shots) == classes[:, None]).all()
+    assert (query.view(ways, queries) == classes[:, None]).all()
+
+  with pytest.raises(ValueError):
+    EpisodeSampler(index, 5, shots, queries)
@@ -0,0 +1,32 @@
+import pytest
+import torch
+from torchsupport.structured import (
+  FullyConnectedStructure, NeighbourLinear, NeighbourDotAttention,
+  NeighbourDotMultiHeadAttention, NeighbourMean, NeighbourMax
+)
+
+MODULES = [
+  lambda size: NeighbourLinear(size, size),
+  lambda size: NeighbourDotAttention(size, 4),
+  lambda size: NeighbourDotMultiHeadAttention(size, 4, 2, heads=3),
+]
+
+@pytest.mark.parametrize("make_module", MODULES)
+def test_implicit_fully_connected(make_module):
+  indices = torch.tensor([0, 0, 0, 1, 3, 3, 3, 3, 4])
+  source = torch.randn(indices.size(0), 3)
+  module = make_module(3)
+  expected = module(source, source, FullyConnectedStructure(indices=indices))
+  implicit = FullyConnectedStructure(indices=indices, implicit=True)
+  result = module(source, source, implicit)
+  assert torch.allclose(result, expected, atol=1e-5)
+
+@pytest.mark.parametrize("make_module", [NeighbourMean, NeighbourMax])
+def test_implicit_fully_connected_reducers(make_module):
+  source = torch.randn(8, 3)
+  module = make_module()
+  expected = module(source, source, FullyConnectedStructure(batch=2, width=4))
+  expected = expected[0] if isinstance(expected, tuple) else expected
+  implicit = FullyConnectedStructure(batch=2, width=4, implicit=True)
+  result = module(source, source, implicit)
+  assert torch.allclose(result, expected)
@@ -0,0 +1,43 @@
+import numpy as np
+import torch
+from torchsupport.data.graphio import LazyNodes, LazyAdjacency, k_hop
+
+def make_graph(tmp_path, nodes=50, edges=120, seed=0):
+  random = np.random.RandomState(seed)
+  edge_list = random.randint(0, nodes, size=(edges, 2))
+  features = random.randn(nodes, 4).astype(np.float32)
+  node_data = LazyNodes.write(str(tmp_path / "graph.atoms.node"), features)
+  adjacency = LazyAdjacency.from_edges(
+    str(tmp_path / "graph.bonds.struct"), edge_list, nodes,
+    source="atoms", target="atoms", directed=True
+  )
+  return edge_list, features, node_data, adjacency
+
+def test_neighbours_match_edges(tmp_path):
+  edge_list, _, _, adjacency = make_graph(tmp_path)
+  nodes = np.array([3, 7, 11])
+  targets, sources = adjacency.neighbours(nodes)
+  for position, node in enumerate(nodes):
+    expected = sorted(edge_list[edge_list[:, 1] == node, 0].tolist())
+    assert sorted(sources[targets == position].tolist()) == expected
+
+def test_k_hop_subgraph(tmp_path):
+  edge_list, features, node_data, adjacency = make_graph(tmp_path)
+  reachable = {0}
+  for _ in range(2):
+    reachable |= {s for s, t in edge_list.tolist() if t in reachable}
+  result = k_hop([adjacency], {"atoms": [0]}, depth=2)["atoms"]
+  assert result.tolist() == sorted(reachable)
+
+  structure = adjacency.subgraph(result)
+  assert structure.node_count == len(result)
+  edges = sorted(zip(
+    result[structure.connections.numpy()].tolist(),
+    result[structure.indices.numpy()].tolist()
+  ))
+  expected = sorted(
+    (s, t) for s, t in edge_list.tolist()
+    if s in reachable and t in reachable
+  )
+  assert edges == expected
+  assert torch.allclose(node_data.materialize(result), torch.tensor(features[result]))
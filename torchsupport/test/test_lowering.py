@@ -0,0 +1,45 @@
+import pytest
+import torch
+from torchsupport.structured import (
+  ConnectionStructure, CompoundStructure, ConstantStructure, ScatterStructure,
+  NeighbourLinear, NeighbourDotAttention, NeighbourDotMultiHeadAttention, lower
+)
+
+IRREGULAR = [[1, 2], [], [0], [0, 1, 2, 4], [3]]
+UNIFORM = [[1, 2], [0, 2], [0, 1], [4, 0], [3, 1]]
+
+MODULES = [
+  lambda size: NeighbourLinear(size, size),
+  lambda size: NeighbourDotAttention(size, 4),
+  lambda size: NeighbourDotMultiHeadAttention(size, 4, 2, heads=3),
+]
+
+def _compare(module, structure, source):
+  module.lowering = False
+  expected = module(source, source, structure)
+  module.lowering = True
+  result = module(source, source, structure)
+  assert torch.allclose(result, expected, atol=1e-5)
+
+@pytest.mark.parametrize("make_module", MODULES)
+@pytest.mark.parametrize("connections", [IRREGULAR, UNIFORM])
+def test_lowered_consistency(make_module, connections):
+  structure = ConnectionStructure("nodes", "nodes", connections)
+  _compare(make_module(3), structure, torch.randn(5, 3))
+
+def test_lowered_compound_consistency():
+  structure = CompoundStructure([
+    ConnectionStructure("nodes", "nodes", IRREGULAR),
+    ConnectionStructure("nodes", "nodes", [[2, 0], [], [1], [4, 2, 1, 0], [0]])
+  ])
+  _compare(NeighbourLinear(6, 3), structure, torch.randn(5, 3))
+
+def test_lowering_is_cached():
+  uniform = ConnectionStructure("nodes", "nodes", UNIFORM)
+  assert isinstance(lower(uniform), ConstantStructure)
+  assert lower(uniform) is lower(uniform)
+  irregular = ConnectionStructure("nodes", "nodes", IRREGULAR)
+  lowered = lower(irregular)
+  assert isinstance(lowered, ScatterStructure)
+  irregular.connections = UNIFORM
+  assert lower(irregular) is not lowered
@@ -0,0 +1,24 @@
+import torch
+from torchsupport.structured.modules.materialized_transformer import (
+  MaterializedMultiHeadAttention
+)
+
+def test_chunked_materialized_attention():
+  module = MaterializedMultiHeadAttention(
+    3, 4, 2, 5, attention_size=4, heads=2, value_size=3
+  )
+  nodes = torch.randn(2, 3, 7, requires_grad=True)
+  edges = torch.randn(2, 2, 7, 7, requires_grad=True)
+  mask = torch.ones(2, 7, dtype=torch.bool)
+  mask[1, 5:] = False
+  expected = module(nodes, edges, mask)
+  expected_grad = torch.autograd.grad(
+    sum(item.sum() for item in expected), (nodes, edges)
+  )
+  module.chunk_size = 3
+  result = module(nodes, edges, mask)
+  result_grad = torch.autograd.grad(
+    sum(item.sum() for item in result), (nodes, edges)
+  )
+  for first, second in zip(result + result_grad, expected + expected_grad):
+    assert torch.allclose(first, second, atol=1e-5)
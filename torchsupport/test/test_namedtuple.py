@@ -0,0 +1,70 @@
+import pickle
+import pytest
+import torch
+from torchsupport.data.namedtuple import namedtuple, NamedTuple, NamedTupleBatch
+from torchsupport.data.io import to_device
+from torchsupport.interacting.buffer import CombinedBuffer, NoneBuffer
+from torchsupport.interacting.distributor_task import ChunkedDistributor
+
+Step = namedtuple("Step", ["state", "action", "rewards", "returns"])
+
+def make_step(idx):
+  return Step(
+    state=torch.full((4,), float(idx)), action=torch.tensor([idx]),
+    rewards=torch.tensor(1.0), returns=None
+  )
+
+def test_record_access():
+  step = make_step(3)
+  assert isinstance(step, NamedTuple)
+  assert not hasattr(step, "__dict__")
+  assert step.action.item() == 3 and step[1].item() == 3
+  assert len(step) == 4 and list(step)[3] is None
+  replaced = step.replace(returns=torch.tensor(2.0))
+  assert replaced.returns.item() == 2.0 and step.returns is None
+  with pytest.raises(ValueError):
+    Step(state=None, action=None)
+  with pytest.raises(ValueError):
+    step.replace(reward=None)
+
+def test_record_pickle():
+  step = make_step(2)
+  restored = pickle.loads(pickle.dumps(step))
+  assert type(restored) is Step
+  assert torch.equal(restored.state, step.state)
+  generic = NamedTuple(a=1, b=2)
+  assert pickle.loads(pickle.dumps(generic)).asdict() == {"a": 1, "b": 2}
+
+def test_batch():
+  schema = Step(
+    state=torch.zeros(4), action=torch.tensor(0),
+    rewards=torch.tensor(0.0), returns=None
+  )
+  batch = Step.Batch.stack([make_step(idx) for idx in range(5)], schema=schema)
+  assert isinstance(batch, NamedTupleBatch)
+  assert len(batch) == 5
+  assert batch.state.shape == (5, 4) and batch.action.shape == (5,)
+  assert batch.returns is None
+  assert type(batch[2]) is Step and batch[2].action.item() == 2
+  assert len(batch[1:3]) == 2
+  assert [step.action.item() for step in batch] == list(range(5))
+
+  joined = Step.Batch.cat([batch, batch[:2]])
+  assert len(joined) == 7
+  restored = pickle.loads(pickle.dumps(joined))
+  assert type(restored) is Step.Batch and torch.equal(restored.state, joined.state)
+  moved = to_device(joined, "cpu")
+  assert type(moved) is Step.Batch and torch.equal(moved.action, joined.action)
+
+def test_record_return_types():
+  chunks = ChunkedDistributor(chunk_size=2).commit_trajectory(
+    [make_step(idx) for idx in range(3)]
+  )
+  assert len(chunks) == 2 and all(type(chunk) is Step for chunk in chunks)
+  assert chunks[1].action.view(-1).tolist() == [1, 2]
+
+  buffer = CombinedBuffer(first=NoneBuffer(), second=NoneBuffer())
+  sample = buffer.sample(3)
+  assert type(sample) is buffer.data_type
+  batch = buffer.sample_batch(3)
+  assert type(batch) is buffer.data_type.Batch
@@ -0,0 +1,63 @@
+import numpy as np
+import torch
+from torchsupport.data.graphio import LazyAdjacency, NeighbourSampler
+from torchsupport.data.structured import NeighbourSampledDataset
+
+def make_adjacency(tmp_path, nodes=60, edges=400, seed=0):
+  random = np.random.RandomState(seed)
+  edge_list = random.randint(0, nodes, size=(edges, 2))
+  adjacency = LazyAdjacency.from_edges(
+    str(tmp_path / "graph.bonds.struct"), edge_list, nodes,
+    source="atoms", target="atoms", directed=True
+  )
+  return edge_list, adjacency
+
+def test_neighbour_sampler_blocks(tmp_path):
+  edge_list, adjacency = make_adjacency(tmp_path)
+  edges = set(map(tuple, edge_list.tolist()))
+  sampler = NeighbourSampler(adjacency, [3, 2])
+  seeds = np.array([5, 1, 5, 17])
+  nodes, blocks = sampler.sample(seeds)
+  assert nodes[:3].tolist() == [5, 1, 17]
+  assert len(blocks) == 2
+
+  assert blocks[-1].node_count == 3
+  assert blocks[0].node_count >= blocks[1].node_count
+  # all blocks index into prefixes of the input nodes:
+  for block, fanout in zip(blocks, [3, 2]):
+    indices = block.indices.numpy()
+    connections = block.connections.numpy()
+    for target, source in zip(indices, connections):
+      assert (nodes[source], nodes[target]) in edges
+    targets = nodes[:block.node_count]
+    degrees = np.asarray(adjacency.rows[targets + 1] - adjacency.rows[targets])
+    counts = np.bincount(indices, minlength=block.node_count)
+    assert (counts == np.minimum(degrees, fanout)).all()
+
+def test_neighbour_sampler_replace(tmp_path):
+  edge_list, adjacency = make_adjacency(tmp_path)
+  edges = set(map(tuple, edge_list.tolist()))
+  sampler = NeighbourSampler(adjacency, [4], replace=True)
+  nodes, (block,) = sampler.sample(torch.arange(10))
+  assert nodes[:10].tolist() == list(range(10))
+  counts = torch.bincount(block.indices, minlength=10).numpy()
+  degrees = np.asarray(adjacency.rows[1:11] - adjacency.rows[:10])
+  assert (counts == np.where(degrees > 0, 4, 0)).all()
+  for target, source in zip(block.indices.tolist(), block.connections.tolist()):
+    assert (nodes[source], nodes[target]) in edges
+
+def test_neighbour_sampled_dataset_epochs(tmp_path):
+  _, adjacency = make_adjacency(tmp_path)
+  sampler = NeighbourSampler(adjacency, [2])
+  data = NeighbourSampledDataset(sampler, np.arange(40), batch_size=8, seed=3)
+  first = [batch.tolist() for batch in data.batches]
+  assert len(data) == 5
+  assert sorted(sum(first, [])) == list(range(40))
+  data.set_epoch(1)
+  second = [batch.tolist() for batch in data.batches]
+  assert sorted(sum(second, [])) == list(range(40))
+  assert second != first
+  data.set_epoch(0)
+  assert [batch.tolist() for batch in data.batches] == first
+  inputs, blocks, nodes = data[1]
+  assert nodes[:8].tolist() == first[1]
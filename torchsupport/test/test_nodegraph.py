@@ -0,0 +1,44 @@
+import torch
+from torchsupport.experimental.modules.structured.nodegraph import NodeGraphTensor, cat
+
+def _path_graph(nodes):
+  graph = NodeGraphTensor(dict(
+    num_graphs=1, graph_nodes=[nodes],
+    adjacency=[[] for _ in range(nodes)],
+    node_tensor=torch.randn(nodes, 2)
+  ))
+  graph.add_edges([(idx, idx + 1) for idx in range(nodes - 1)])
+  return graph
+
+def test_nodegraph_edge_buffers():
+  graph = _path_graph(4)
+  graph.delete_edge(1, 2)
+  graph.add_edge(0, 3)
+  assert graph.adjacency == [[1, 3], [0], [3], [2, 0]]
+  graph.delete_nodes([1])
+  assert graph.graph_nodes == [3]
+  assert graph.adjacency == [[2], [2], [1, 0]]
+
+def test_nodegraph_laplacian():
+  graph = _path_graph(5)
+  vector = torch.randn(5, 3)
+  dense = torch.zeros(5, 5)
+  for node, neighbours in enumerate(graph.adjacency):
+    dense[node, node] = len(neighbours)
+    dense[node, neighbours] = -1
+  expected = dense @ vector
+  assert torch.allclose(graph.laplacian_action(vector), expected, atol=1e-6)
+  assert torch.allclose(graph.laplacian_action(vector, matrix_free=False), expected, atol=1e-6)
+  assert torch.allclose(
+    graph.adjacency_action(vector, matrix_free=False),
+    graph.adjacency_action(vector), atol=1e-6
+  )
+
+def test_nodegraph_cat():
+  first, second = _path_graph(3), _path_graph(2)
+  result = cat([first, second])
+  assert result.num_graphs == 2
+  assert result.graph_nodes == [3, 2]
+  assert result.adjacency == [[1], [2, 0], [1], [4], [3]]
+  assert torch.equal(result[1].node_tensor, second.node_tensor)
+  assert result[1].adjacency == [[1], [0]]
@@ -0,0 +1,83 @@
+import os
+import pytest
+import torch
+from torchsupport.data.chem.qm9 import QM9
+
+WATER = (
+  "water",
+  [("O", (0.0, 0.0, 0.1173)), ("H", (0.0, 0.7572, -0.4692)), ("H", (0.0, -0.7572, -0.4692))],
+  [(1, 2, 1), (1, 3, 1)],
+  {"gap": "0.3", "mu": "1.85"}
+)
+FORMALDEHYDE = (
+  "formaldehyde",
+  [("C", (0.0, 0.0, 0.0)), ("O", (0.0, 0.0, 1.21)),
+   ("H", (0.0, 0.94, -0.54)), ("H", (0.0, -0.94, -0.54))],
+  [(1, 2, 2), (1, 3, 1), (1, 4, 1)],
+  {"gap": "0.2", "mu": "2.33"}
+)
+
+def write_sdf(path, molecules):
+  with open(path, "w") as sdf:
+    for name, atoms, bonds, properties in molecules:
+      sdf.write(f"{name}\n  fixture\n\n")
+      sdf.write(f"{len(atoms):3d}{len(bonds):3d}  0  0  0  0  0  0  0  0999 V2000\n")
+      for symbol, (x, y, z) in atoms:
+        sdf.write(f"{x:10.4f}{y:10.4f}{z:10.4f} {symbol:<3} 0  0  0  0  0  0\n")
+      for first, second, kind in bonds:
+        sdf.write(f"{first:3d}{second:3d}{kind:3d}  0\n")
+      sdf.write("M  END\n")
+      for key, value in properties.items():
+        sdf.write(f"> <{key}>\n{value}\n\n")
+      sdf.write("$$$$\n")
+
+def test_sdf_dataset(tmp_path):
+  path = str(tmp_path / "fixture.sdf")
+  write_sdf(path, [WATER, FORMALDEHYDE])
+  data = QM9(path, bond_types=True)
+  assert len(data) == 2
+  assert data.targets == ["mu", "gap"]
+  assert os.path.isfile(os.path.join(path + ".cache", "atoms.npy"))
+
+  (atoms, positions, structure, bonds), targets = data[1]
+  assert atoms.tensor.shape == (4, 5)
+  assert atoms.tensor.argmax(dim=1).tolist() == [1, 3, 0, 0]
+  assert torch.allclose(positions.tensor[1], torch.tensor([0.0, 0.0, 1.21]))
+  assert structure.node_count == 4
+  edges = sorted(zip(structure.connections.tolist(), structure.indices.tolist()))
+  assert edges == [(0, 1), (0, 2), (0, 3), (1, 0), (2, 0), (3, 0)]
+  assert bonds.tensor.size(0) == 6 and bonds.tensor[:, 1].sum() == 2
+  assert torch.allclose(targets, torch.tensor([2.33, 0.2]))
+
+  cached = QM9(path, bond_types=True)
+  assert len(cached) == 2 and cached[0][1].tolist() == data[0][1].tolist()
+
+def test_xyz_dataset(tmp_path):
+  path = str(tmp_path / "fixture.xyz")
+  values = "\t".join(str(idx) for idx in range(15))
+  with open(path, "w") as xyz:
+    xyz.write(f"3\ngdb 1\t{values}\n")
+    xyz.write("O\t0.0\t0.0\t0.1173\t-0.4\n")
+    xyz.write("H\t0.0\t0.7572\t-0.4692\t0.2\n")
+    xyz.write("H\t0.0\t-0.7572\t-0.4692\t0.2\n")
+    xyz.write("1.0\t2.0\t3.0\nO\nInChI=1S/H2O/h1H2\n")
+  data = QM9(path)
+  assert len(data) == 1
+  (atoms, positions, structure), targets = data[0]
+  assert structure.connections.size(0) == 4
+  assert targets.tolist() == [float(idx) for idx in range(15)]
+
+def test_properties_invalidate_cache(tmp_path):
+  path = str(tmp_path / "fixture.sdf")
+  write_sdf(path, [WATER, FORMALDEHYDE])
+  properties = str(tmp_path / "fixture.sdf.csv")
+  with open(properties, "w") as csv:
+    csv.write("mol_id,gap\nwater,0.5\nformaldehyde,0.6\n")
+  data = QM9(path, targets=["gap"], properties=properties)
+  assert [data[idx][1].item() for idx in range(2)] == pytest.approx([0.5, 0.6])
+  with open(properties, "w") as csv:
+    csv.write("mol_id,gap\nwater,0.75\nformaldehyde,0.25\n")
+  data = QM9(path, targets=["gap"], properties=properties)
+  assert [data[idx][1].item() for idx in range(2)] == [0.75, 0.25]
+  data = QM9(path, targets=["gap"])
+  assert [data[idx][1].item() for idx in range(2)] == pytest.approx([0.3, 0.2])
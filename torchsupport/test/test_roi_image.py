@@ -0,0 +1,72 @@
+import struct
+import zipfile
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from skimage.draw import polygon2mask
+from torchsupport.data.roi_image import TiffStack, RoiImage
+
+def roi_bytes(kind, top, left, bottom, right, x=(), y=(), position=0):
+  header = bytearray(64)
+  header[0:4] = b"Iout"
+  struct.pack_into(">h", header, 4, 227)
+  header[6] = kind
+  struct.pack_into(">hhhhh", header, 8, top, left, bottom, right, len(x))
+  struct.pack_into(">i", header, 56, position)
+  coordinates = struct.pack(
+    f">{2 * len(x)}h", *[value - left for value in x], *[value - top for value in y]
+  )
+  return bytes(header) + coordinates
+
+def write_fixture(tmp_path):
+  frames = (np.arange(3 * 20 * 24) * 37 % 65536).astype(np.uint16).reshape(3, 20, 24)
+  images = [Image.fromarray(frame) for frame in frames]
+  path = str(tmp_path / "stack")
+  images[0].save(path + ".tif", save_all=True, append_images=images[1:])
+  with zipfile.ZipFile(path + ".roi.zip", "w") as archive:
+    archive.writestr("rect.roi", roi_bytes(1, 6, 4, 12, 12, position=2))
+    archive.writestr("poly.roi", roi_bytes(
+      0, 2, 14, 10, 22, x=(14, 22, 22), y=(2, 2, 10)
+    ))
+  return path, frames
+
+def test_tiff_stack_lazy(tmp_path):
+  path, frames = write_fixture(tmp_path)
+  stack = TiffStack(path + ".tif")
+  assert stack.shape == (3, 20, 24)
+  assert stack.buffer is None
+  frame = stack.frame(2)
+  assert isinstance(frame, np.memmap)
+  assert frame.dtype.newbyteorder("=") == np.uint16
+  assert (frame == frames[2]).all()
+  window = stack.read(1, 18, 20, 4, 6, dtype=torch.double)
+  assert window.dtype == torch.double
+  assert torch.equal(window[:2, :4], torch.tensor(frames[1, 18:, 20:], dtype=torch.double))
+  assert (window[2:] == 0).all() and (window[:, 4:] == 0).all()
+
+def test_roi_image_crops(tmp_path):
+  path, frames = write_fixture(tmp_path)
+  data = RoiImage(path, size=(10, 8))
+  assert len(data) == 4
+
+  crop, mask = data[0]
+  assert crop.shape == (1, 8, 10) and mask.shape == (1, 8, 10)
+  assert torch.equal(crop[0], torch.tensor(frames[1, 5:13, 3:13], dtype=torch.float))
+  rows, columns = mask[0].nonzero().unbind(dim=1)
+  assert rows.min() >= 1 and rows.max() <= 7
+  assert columns.min() >= 1 and columns.max() <= 9
+  assert (mask[0, 2:7, 2:9] == 1).all()
+
+  reference = polygon2mask((20, 24), np.array([[2, 14], [2, 22], [10, 22]]))
+  reference = torch.tensor(reference[2:10, 13:23], dtype=torch.float)
+  for frame in range(3):
+    crop, mask = data[1 + frame]
+    assert torch.equal(crop[0], torch.tensor(frames[frame, 2:10, 13:23], dtype=torch.float))
+    assert torch.equal(mask[0], reference)
+  assert len(data.masks) == 2
+  assert torch.equal(data[-1][0], data[3][0])
+  with pytest.raises(IndexError):
+    data[4]
+  with pytest.raises(IndexError):
+    data[-5]
@@ -1,4 +1,255 @@
 import pytest
 import torch
 from torchsupport.structured import scatter
+from torchsupport.structured.modules.sequence_transformer import SequenceLinearAttention
 
+
+def _values(result):
+  return result[0] if isinstance(result, tuple) else result
+
+def _reference(reduce, data, indices, size):
+  return torch.stack([
+    reduce(data[indices == idx])
+    for idx in range(size)
+  ], dim=0)
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_scatter_reductions(ordered):
+  indices = torch.tensor([0, 0, 0, 1, 3, 3, 3, 3, 3, 3, 3, 4])
+  if not ordered:
+    indices = indices[torch.randperm(indices.size(0))]
+  data = torch.randn(indices.size(0), 3)
+  expected_add = _reference(lambda x: x.sum(dim=0), data, indices, 6)
+  assert torch.allclose(scatter.add(data, indices, dim_size=6), expected_add, atol=1e-6)
+
+  expected_mean = _reference(
+    lambda x: x.mean(dim=0) if x.size(0) else torch.zeros(3), data, indices, 6
+  )
+  assert torch.allclose(scatter.mean(data, indices, dim_size=6), expected_mean, atol=1e-6)
+
+  present = torch.tensor([0, 1, 3, 4])
+  expected_max = _reference(lambda x: x.max(dim=0).values, data, indices, 5)
+  result = _values(scatter.max(data, indices, dim_size=5))
+  assert torch.allclose(result[present], expected_max[present])
+
+def test_scatter_add_out():
+  indices = torch.tensor([2, 0, 2])
+  out = torch.ones(3, 2)
+  result = scatter.add(torch.ones(3, 2), indices, out=out)
+  assert result.tolist() == [[2.0, 2.0], [1.0, 1.0], [3.0, 3.0]]
+
+def test_scatter_integer_sorted():
+  indices = torch.tensor([0, 0, 1, 1, 1, 3])
+  data = torch.tensor([[4, 1], [2, 5], [7, 3], [1, 1], [9, 0], [6, 8]])
+  result = scatter.add(data, indices, dim_size=4)
+  assert result.tolist() == [[6, 6], [17, 4], [0, 0], [6, 8]]
+  result = _values(scatter.min(data, indices, dim_size=4))
+  assert result[[0, 1, 3]].tolist() == [[2, 1], [1, 0], [6, 8]]
+
+@pytest.mark.skipif(scatter.BACKEND == "padded", reason="scatter backends only")
+def test_scatter_mean_out():
+  indices = torch.tensor([2, 0, 2])
+  out = torch.ones(3, 1)
+  result = scatter.mean(torch.tensor([[1.0], [2.0], [3.0]]), indices, out=out)
+  assert result.view(-1).tolist() == [3.0, 1.0, 2.5]
+
+@pytest.mark.skipif(scatter.HAS_SCATTER, reason="fallback backends only")
+def test_scatter_fallback_std_and_gradient():
+  indices = torch.tensor([0, 0, 1, 1, 1])
+  data = torch.randn(5, 2, requires_grad=True)
+  expected = torch.stack([data[:2].std(dim=0), data[2:].std(dim=0)])
+  assert torch.allclose(scatter.std(data, indices), expected, atol=1e-6)
+  scatter.max(data, indices).sum().backward()
+  assert data.grad.sum().item() == 4.0
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_segment_index(ordered):
+  indices = torch.tensor([0, 0, 0, 1, 3, 3, 3, 3, 3, 3, 3, 4])
+  if not ordered:
+    indices = indices[torch.randperm(indices.size(0))]
+  segment = scatter.SegmentIndex(indices, dim_size=6).precompute(pad=True)
+  assert segment.counts.tolist() == [3, 1, 0, 7, 1, 0]
+  assert segment.offsets.tolist() == [0, 3, 4, 4, 11, 12]
+  assert segment.unique.tolist() == [0, 1, 3, 4]
+  assert segment.max_count == 7
+  assert segment.sorted == ordered
+  assert (segment.element_counts == segment.counts[indices]).all()
+
+  data = torch.randn(indices.size(0), 3)
+  padded, unique, index, counts = scatter.pad(data, segment)
+  assert padded.shape == (4, 7, 3)
+  assert counts.tolist() == [3, 1, 7, 1]
+  assert torch.equal(scatter.unpad(padded, segment), data)
+  for position, idx in enumerate(unique.tolist()):
+    expected = data[indices == idx]
+    assert torch.equal(padded[position, :expected.size(0)], expected)
+
+  assert torch.allclose(
+    scatter.add(data, segment), scatter.add(data, indices, dim_size=6)
+  )
+  assert torch.allclose(
+    scatter.softmax(data, segment), scatter.softmax(data, indices, dim_size=6)
+  )
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_segment_softmax(ordered):
+  indices = torch.tensor([0, 0, 0, 1, 3, 3, 3, 3, 3, 3, 3, 4])
+  if not ordered:
+    indices = indices[torch.randperm(indices.size(0))]
+  data = torch.randn(indices.size(0), 4, dtype=torch.double, requires_grad=True)
+  expected = torch.zeros_like(data)
+  expected_log = torch.zeros_like(data)
+  for idx in range(5):
+    expected[indices == idx] = data[indices == idx].softmax(dim=0)
+    expected_log[indices == idx] = data[indices == idx].log_softmax(dim=0)
+  expected_lse = torch.stack([
+    data[indices == idx].logsumexp(dim=0)
+    for idx in range(6)
+  ], dim=0)
+  assert torch.allclose(scatter.softmax(data, indices), expected)
+  assert torch.allclose(scatter.log_softmax(data, indices), expected_log)
+  lse = scatter.logsumexp(data, indices, dim_size=6)
+  assert torch.allclose(lse[:5], expected_lse[:5])
+  assert torch.isinf(lse[5]).all()
+
+  segment = scatter.SegmentIndex(indices)
+  for op in (scatter.softmax, scatter.log_softmax, scatter.logsumexp):
+    assert torch.autograd.gradcheck(lambda x: op(x, segment), (data,))
+
+def test_segment_softmax_masked():
+  indices = torch.tensor([0, 0, 1, 1])
+  data = torch.tensor([[1.0], [-float("inf")], [-float("inf")], [-float("inf")]])
+  result = scatter.softmax(data, indices)
+  assert result[:2].view(-1).tolist() == [1.0, 0.0]
+  assert not torch.isinf(scatter.logsumexp(data, indices)[0]).any()
+
+@pytest.mark.parametrize("reduce", [None, "sum", "max", "logsumexp", "topk"])
+def test_blockwise_pairwise(reduce):
+  indices = torch.tensor([0, 0, 0, 1, 3, 3, 3, 3, 3, 3, 3, 4])
+  indices = indices[torch.randperm(indices.size(0))]
+  data = torch.randn(indices.size(0), 3)
+  op = lambda x, y: -(x - y).norm(dim=-1)
+  dense = op(data.unsqueeze(1), data.unsqueeze(0))
+  mask = indices.unsqueeze(1) == indices.unsqueeze(0)
+  result = scatter.blockwise_pairwise(op, data, indices, reduce=reduce, k=2, tile_size=3)
+  if reduce is None:
+    values, first, second = result
+    assert values.size(0) == int(mask.sum())
+    assert (indices[first] == indices[second]).all()
+    assert torch.allclose(values, dense[first, second])
+    return
+  masked = torch.where(mask, dense, torch.full_like(dense, -float("inf")))
+  if reduce == "sum":
+    expected = torch.where(mask, dense, torch.zeros_like(dense)).sum(dim=1)
+  elif reduce == "max":
+    expected = masked.max(dim=1).values
+  elif reduce == "logsumexp":
+    expected = masked.logsumexp(dim=1)
+  else:
+    values, candidates = result
+    expected = masked.topk(2, dim=1).values
+    single = mask.sum(dim=1) == 1
+    assert torch.allclose(values[~single], expected[~single])
+    assert (candidates[single, 1] == -1).all()
+    assert torch.allclose(dense.gather(1, candidates[~single]), values[~single])
+    return
+  assert torch.allclose(result, expected, atol=1e-6)
+
+@pytest.mark.parametrize("similarity", [None, lambda x, y: -(x - y).norm(dim=-1)])
+def test_segment_attention(similarity):
+  indices = torch.tensor([0, 0, 0, 1, 3, 3, 3, 3, 3, 3, 3, 4])
+  indices = indices[torch.randperm(indices.size(0))]
+  query, key, value = (
+    torch.randn(indices.size(0), 2, size, dtype=torch.double, requires_grad=True)
+    for size in (4, 4, 3)
+  )
+  result = scatter.attention(
+    query, key, value, indices, similarity=similarity, tile_size=2
+  )
+  if similarity is None:
+    score = torch.einsum("kha,qha->qkh", key, query) / 2
+  else:
+    score = similarity(key.unsqueeze(0), query.unsqueeze(1))
+  mask = (indices.unsqueeze(1) == indices.unsqueeze(0)).unsqueeze(-1)
+  weight = torch.where(mask, score, torch.full_like(score, -float("inf"))).softmax(dim=1)
+  expected = torch.einsum("qkh,khv->qhv", weight, value)
+  assert torch.allclose(result, expected)
+  grad = torch.randn_like(result)
+  actual = torch.autograd.grad(result, (query, key, value), grad)
+  dense = torch.autograd.grad(expected, (query, key, value), grad)
+  for first, second in zip(actual, dense):
+    assert torch.allclose(first, second)
+
+class _BilinearSimilarity(torch.nn.Module):
+  def __init__(self, size):
+    super().__init__()
+    self.weight = torch.nn.Parameter(torch.randn(size, size, dtype=torch.double))
+
+  def forward(self, key, query):
+    return ((key @ self.weight) * query).sum(dim=-1)
+
+def test_segment_attention_similarity_parameters():
+  indices = torch.tensor([0, 0, 0, 1, 1, 1, 1, 2])
+  query, key, value = (
+    torch.randn(indices.size(0), 2, size, dtype=torch.double, requires_grad=True)
+    for size in (3, 3, 2)
+  )
+  weight = torch.randn(3, 3, dtype=torch.double, requires_grad=True)
+  def run(query, key, value, weight):
+    return scatter.attention(
+      query, key, value, indices,
+      similarity=lambda key, query: ((key @ weight) * query).sum(dim=-1),
+      tile_size=2, parameters=[weight]
+    )
+  assert torch.autograd.gradcheck(run, (query, key, value, weight))
+
+  similarity = _BilinearSimilarity(3)
+  result = scatter.attention(query, key, value, indices, similarity=similarity, tile_size=2)
+  result.sum().backward()
+  score = similarity(key.unsqueeze(0), query.unsqueeze(1))
+  mask = (indices.unsqueeze(1) == indices.unsqueeze(0)).unsqueeze(-1)
+  attention = torch.where(mask, score, torch.full_like(score, -float("inf"))).softmax(dim=1)
+  expected = torch.einsum("qkh,khv->qhv", attention, value)
+  dense = torch.autograd.grad(expected.sum(), similarity.weight)[0]
+  assert torch.allclose(similarity.weight.grad, dense)
+
+def test_segment_cumsum():
+  indices = torch.tensor([2, 0, 2, 1, 0, 2])
+  data = torch.arange(6, dtype=torch.float).unsqueeze(1)
+  result = scatter.cumsum(data, indices)
+  assert result.view(-1).tolist() == [0.0, 1.0, 2.0, 3.0, 5.0, 7.0]
+
+def test_segment_cumsum_precision():
+  indices = torch.cat((torch.zeros(2 ** 20, dtype=torch.long), torch.ones(100, dtype=torch.long)))
+  data = torch.cat((torch.full((2 ** 20,), 100.0), torch.full((100,), 0.1)))
+  result = scatter.cumsum(data, indices)
+  assert result.dtype == torch.float
+  expected = torch.arange(1, 101, dtype=torch.double) * 0.1
+  assert torch.allclose(result[2 ** 20:].double(), expected, rtol=1e-6, atol=0)
+
+def _linear_attention_reference(module, inputs, indices, causal):
+  size = inputs.size(0)
+  key = module.sim(module.key(inputs).view(size, module.heads, -1))
+  query = module.sim(module.query(inputs).view(size, module.heads, -1))
+  value = module.value(inputs).view(size, module.heads, -1)
+  result = []
+  for idx in range(size):
+    attended = indices == indices[idx]
+    if causal:
+      attended = attended & (torch.arange(size) <= idx)
+    weights = (query[idx][None] * key[attended]).sum(dim=-1)
+    combined = (weights[:, :, None] * value[attended]).sum(dim=0)
+    result.append(combined / (weights.sum(dim=0)[:, None] + 1e-6))
+  return module.out(torch.stack(result, dim=0).view(size, -1))
+
+@pytest.mark.parametrize("causal", [False, True])
+def test_sequence_linear_attention(causal):
+  indices = torch.tensor([1, 0, 1, 1, 2, 0, 2, 1])
+  inputs = torch.randn(indices.size(0), 6)
+  module = SequenceLinearAttention(
+    6, 5, hidden_size=4, attention_size=3, heads=2, causal=causal
+  )
+  with torch.no_grad():
+    result = module(inputs, indices)
+    expected = _linear_attention_reference(module, inputs, indices, causal)
+  assert torch.allclose(result, expected, atol=1e-5)
@@ -0,0 +1,73 @@
+import pytest
+import numpy as np
+import torch
+from torchsupport.data.tiles import MemoryBackend, TileReader
+from torchsupport.data.slides import SlideImage, TileIndex
+
+def make_backend():
+  image = np.random.randint(0, 255, size=(96, 128, 3)).astype(np.uint8)
+  return image, MemoryBackend.from_image(image, depth=3)
+
+def test_memory_backend_region():
+  image, backend = make_backend()
+  region = backend.read_region((8, 4), 0, (16, 12))
+  assert (region == image[4:16, 8:24]).all()
+  region = backend.read_region((120, 90), 0, (16, 12))
+  assert (region[:6, :8] == image[90:, 120:]).all()
+  assert (region[6:] == 0).all()
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_tile_at_matches_backend(workers):
+  image, backend = make_backend()
+  slide = SlideImage(backend=backend, workers=workers, lookahead=4)
+  size = (16, 16)
+  for position, tile in zip(
+      [(idx * 16, idy * 16) for idx in range(8) for idy in range(6)],
+      slide.regular_tiling(level=0, size=size)
+  ):
+    expected = image[position[1]:position[1] + 16, position[0]:position[0] + 16]
+    expected = torch.tensor(expected).permute(2, 0, 1).float()
+    assert tile.shape == (1, 3, 16, 16)
+    assert bool((tile[0] == expected).all())
+  slide.close()
+
+def test_merged_reads_match_single_reads():
+  _, backend = make_backend()
+  keys = [
+    (level, x, y, 8, 8)
+    for level in (0, 1)
+    for x in (0, 4, 16, 40)
+    for y in (0, 8, 16)
+  ]
+  merged = TileReader(backend, workers=0).read(keys)
+  single = TileReader(backend, workers=0, merge_ratio=0.0).read(keys)
+  for first, second in zip(merged, single):
+    assert bool((first == second).all())
+
+def test_cache_budget():
+  _, backend = make_backend()
+  reader = TileReader(backend, cache_size=3 * 8 * 8 * 3, workers=0)
+  reader.read([(0, idx * 8, 0, 8, 8) for idx in range(5)])
+  assert len(reader.cache) == 3
+  assert reader.cache.bytes <= reader.cache.max_bytes
+
+def test_tile_index_keeps_foreground():
+  image = np.full((128, 128, 3), 255, dtype=np.uint8)
+  image[32:96, 64:128] = (150, 50, 120)
+  backend = MemoryBackend.from_image(image, depth=3)
+  index = TileIndex.build(backend, size=(32, 32), level=0)
+  positions = sorted(index[idx] for idx in range(len(index)))
+  assert positions == sorted(
+    (x, y) for x in (64, 96) for y in (32, 64)
+  )
+
+def test_tile_index_cache_tracks_detection(tmp_path):
+  image = np.full((128, 128, 3), 255, dtype=np.uint8)
+  image[40:96, 64:128] = (150, 50, 120)
+  backend = MemoryBackend.from_image(image, depth=3)
+  path = str(tmp_path / "index.pt")
+  index = TileIndex.build(backend, size=(32, 32), level=0, path=path)
+  assert len(index) == 4
+  index = TileIndex.build(backend, size=(32, 32), level=0, min_foreground=0.9, path=path)
+  assert len(index) == 2
+  assert TileIndex.load(path).detection["min_foreground"] == 0.9
@@ -0,0 +1,43 @@
+import pytest
+import torch
+from torchsupport.structured import (
+  ScatterStructure, AdjacencyAction, LaplacianAction, GCN, APP
+)
+
+def _structure():
+  return ScatterStructure(
+    "nodes", "nodes",
+    torch.tensor([0, 0, 1, 2, 2, 2]),
+    torch.tensor([1, 2, 0, 0, 1, 3]),
+    node_count=5
+  )
+
+@pytest.mark.parametrize("make_action", [
+  AdjacencyAction,
+  LaplacianAction,
+  lambda **kwargs: LaplacianAction(normalized=True, **kwargs)
+])
+def test_sparse_action(make_action):
+  structure = _structure()
+  data = torch.randn(5, 3)
+  expected = make_action(sparse=False)(data, data, structure)
+  action = make_action()
+  assert torch.allclose(action(data, data, structure), expected, atol=1e-6)
+  assert action.operator(structure, data) is action.operator(structure, data)
+
+@pytest.mark.parametrize("make_module", [
+  lambda **kwargs: GCN(3, 4, depth=2, **kwargs),
+  lambda **kwargs: APP(3, 4, depth=3, **kwargs)
+])
+def test_precomputed_propagation(make_module):
+  structure = _structure()
+  data = torch.randn(5, 3)
+  module = make_module()
+  precomputed = make_module(precompute=True)
+  precomputed.load_state_dict(module.state_dict())
+  expected = module(data, structure)
+  assert torch.allclose(precomputed(data, structure), expected, atol=1e-5)
+  cached = precomputed._precomputed[3]
+  precomputed(data, structure).sum().backward()
+  assert precomputed._precomputed[3] is cached
+  assert precomputed.linear.weight.grad is not None
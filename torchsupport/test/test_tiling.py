@@ -0,0 +1,58 @@
+import pytest
+import torch
+import torch.nn as nn
+from torchsupport.modules.tiling import TiledInference, receptive_halo
+from torchsupport.modules.unet import UNetBackbone, LightUNetBackbone
+from torchsupport.modules.rezero import ReZero
+
+@pytest.mark.parametrize("tile_size, overlap", [(16, 0), (16, 4), (24, 8)])
+def test_tiled_inference_matches_full(tile_size, overlap):
+  net = nn.Sequential(
+    nn.Conv2d(3, 8, 3, padding=1, bias=False),
+    nn.ReLU(),
+    nn.Conv2d(8, 2, 5, padding=4, dilation=2, bias=False)
+  )
+  assert receptive_halo(net) == 5
+  image = torch.randn(3, 37, 50)
+  with torch.no_grad():
+    expected = net(image[None])[0]
+  tiled = TiledInference(net, tile_size=tile_size, overlap=overlap, batch_size=3)
+  result = torch.tensor(tiled(image.numpy()))
+  assert result.shape == expected.shape
+  assert torch.allclose(result, expected, atol=1e-5)
+
+def test_tiled_inference_unet_backbone():
+  net = UNetBackbone(size_factors=[1, 2, 2], base_size=2)
+  with torch.no_grad():
+    for module in net.modules():
+      if isinstance(module, ReZero):
+        module.alpha.fill_(1.0)
+      elif isinstance(module, nn.Conv2d) and module.bias is not None:
+        # zero features outside the image behave like zero padding:
+        module.bias.zero_()
+  net.eval()
+  image = torch.randn(2, 40, 52)
+  with torch.no_grad():
+    expected = net(image[None])[0]
+  tiled = TiledInference(net, tile_size=16, overlap=4, batch_size=2)
+  assert tiled.halo >= receptive_halo(net)
+  result = torch.tensor(tiled(image.numpy()))
+  assert result.shape == expected.shape
+  assert torch.allclose(result, expected, atol=1e-4)
+
+def test_tiled_inference_rejects_untileable():
+  with pytest.warns(UserWarning):
+    TiledInference(LightUNetBackbone(size_factors=[1, 1], base_size=2))
+
+  class FunctionalPooling(nn.Module):
+    def __init__(self):
+      super().__init__()
+      self.conv = nn.Conv2d(1, 1, 3, padding=1)
+      self.pooling = nn.functional.max_pool2d
+
+    def forward(self, inputs):
+      return self.conv(self.pooling(inputs, 2))
+
+  with pytest.raises(ValueError):
+    TiledInference(FunctionalPooling())
+  TiledInference(FunctionalPooling(), halo=4, alignment=2)
@@ -323,7 +323,8 @@ class ClusterAETraining(ClusteringTraining):
 
       self.train_data = None
       self.train_data = DataLoader(
-        self.data, batch_size=self.batch_size, num_workers=8, shuffle=True
+        self.data, batch_size=self.batch_size, num_workers=8, shuffle=True,
+        batch_sampler=self.batch_sampler_for(self.data)
       )
       for internal_epoch in range(1):
         for data, *_ in islice(self.train_data, 100):
@@ -109,7 +109,8 @@ class AbstractContrastiveTraining(Training):
       self.train_data = None
       self.train_data = DataLoader(
         self.data, batch_size=self.batch_size, num_workers=self.num_workers,
-        shuffle=True, drop_last=True
+        shuffle=True, drop_last=True,
+        batch_sampler=self.batch_sampler_for(self.data)
       )
 
       for data in self.train_data:
@@ -130,7 +130,8 @@ class AbstractEnergyTraining(Training):
       self.train_data = None
       self.train_data = DataLoader(
         self.data, batch_size=self.batch_size, num_workers=8,
-        shuffle=True, drop_last=True
+        shuffle=True, drop_last=True,
+        batch_sampler=self.batch_sampler_for(self.data)
       )
 
       for data in self.train_data:
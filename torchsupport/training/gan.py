@@ -193,7 +193,8 @@ class AbstractGANTraining(Training):
       self.train_data = None
       self.train_data = DataLoader(
         self.data, batch_size=self.batch_size, num_workers=self.num_workers,
-        shuffle=True, drop_last=True
+        shuffle=True, drop_last=True,
+        batch_sampler=self.batch_sampler_for(self.data)
       )
 
       batches_per_step = self.n_actor + self.n_critic
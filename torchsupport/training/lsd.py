@@ -40,7 +40,8 @@ class LSDTraining(AbstractEnergyTraining):
 
     self.critic_data = DataLoader(
       self.data, batch_size=self.batch_size, num_workers=8,
-      shuffle=True, drop_last=True
+      shuffle=True, drop_last=True,
+      batch_sampler=self.batch_sampler_for(self.data)
     )
     self.critic_optimizer = optimizer(
       netlist,
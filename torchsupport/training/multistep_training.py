@@ -110,7 +110,8 @@ class MultistepTraining(Training, metaclass=StepRegistry):
       data = iter(DataLoader(
         self.data[step], batch_size=self.batch_size,
         num_workers=self.num_workers,
-        shuffle=True, drop_last=True
+        shuffle=True, drop_last=True,
+        batch_sampler=self.batch_sampler_for(self.data[step])
       ))
       self.loaders[step] = data
     try:
@@ -119,7 +120,8 @@ class MultistepTraining(Training, metaclass=StepRegistry):
       data = iter(DataLoader(
         self.data[step], batch_size=self.batch_size,
         num_workers=self.num_workers,
-        shuffle=True, drop_last=True
+        shuffle=True, drop_last=True,
+        batch_sampler=self.batch_sampler_for(self.data[step])
       ))
       self.loaders[step] = data
       data_point = to_device(next(data), self.device)
@@ -1,15 +1,15 @@
 import os
 import time
 import random
-from copy import copy
 
 import numpy as np
 import torch
+from torch.utils.data import Sampler
 
 from tensorboardX import SummaryWriter
 
 from torchsupport.data.io import netread, netwrite, to_device
-from torchsupport.data.episodic import SupportData
+from torchsupport.data.episodic import LabelIndex, EpisodeSampler, split_episode
 from torchsupport.data.collate import DataLoader
 
 from torchsupport.training.state import (
@@ -37,6 +37,7 @@ class Training(object):
                verbose=False,
                report_interval=10,
                checkpoint_interval=1000,
+               batch_sampler=None,
                **kwargs):
     self.max_epochs = max_epochs
     self.max_steps = max_steps
@@ -49,6 +50,7 @@ class Training(object):
     self.verbose = verbose
     self.report_interval = report_interval
     self.checkpoint_interval = checkpoint_interval
+    self.batch_sampler = batch_sampler
     self.checkpoint_names = {}
     self.step_id = 0
     self.epoch_id = 0
@@ -71,6 +73,20 @@ class Training(object):
       for name in netlist
     }
 
+  def batch_sampler_for(self, data):
+    """Returns the batch sampler used for loading training data.
+
+    Args:
+      data (Dataset): training data set.
+
+    Returns:
+      A batch sampler, if one was passed to the training, or constructed
+      from `data` by a given batch sampler factory. Otherwise `None`.
+    """
+    if self.batch_sampler is None or isinstance(self.batch_sampler, Sampler):
+      return self.batch_sampler
+    return self.batch_sampler(data)
+
   def log_statistics(self, loss_val, prefix="", suffix=" loss", name="total loss"):
     if self.verbose:
       for loss_name in self.current_losses:
@@ -224,10 +240,12 @@ class SupervisedTraining(Training):
       self.schedule = schedule
     self.losses = losses
     self.train_data = DataLoader(
-      train_data, batch_size=self.batch_size, num_workers=8, shuffle=True, drop_last=True
+      train_data, batch_size=self.batch_size, num_workers=8, shuffle=True, drop_last=True,
+      batch_sampler=self.batch_sampler_for(train_data)
     )
     self.validate_data = DataLoader(
-      validate_data, batch_size=self.batch_size, num_workers=8, shuffle=True, drop_last=True
+      validate_data, batch_size=self.batch_size, num_workers=8, shuffle=True, drop_last=True,
+      batch_sampler=self.validate_batch_sampler_for(validate_data)
     )
     self.valid_iter = iter(self.validate_data)
     self.net = net.to(self.device)
@@ -237,6 +255,11 @@ class SupervisedTraining(Training):
     self.training_losses = [0 for _ in range(len(self.losses))]
     self.best = None
 
+  def validate_batch_sampler_for(self, data):
+    """Returns the batch sampler used for loading validation data.
+    Defaults to `None`, batching validation data by batch size."""
+    return None
+
   def run_networks(self, data):
     inputs, *labels = data
     if not isinstance(inputs, (list, tuple)):
@@ -360,59 +383,67 @@ class MaskedSupervisedTraining(SupervisedTraining):
     return list(zip(predictions, labels, masks))
 
 class FewShotTraining(SupervisedTraining):
+  """Episodic few-shot training process. Training and validation batches
+  are N-way K-shot episodes drawn by an :class:`EpisodeSampler`, such that
+  the items of each episode are loaded in the data loader's workers. The
+  network is applied to the query and support items of an episode and
+  its predictions are compared to the episode labels of the queries.
+
+  Args:
+    ways (int): number of classes per episode.
+    shots (int): number of support items per class.
+    queries (int): number of query items per class.
+    episodes (int): number of episodes per epoch.
+    label (callable): function mapping the index of a training item to
+      its label without loading the item. Defaults to the `labels`
+      attribute of the training data set, if present.
+    validate_label (callable): as `label`, for the validation data set.
+    index_path (str): path to persist the training label index at.
+      Defaults to a file next to the network's checkpoints.
+    validate_index_path (str): as `index_path`, for the validation data set.
+  """
   def __init__(self, net, train_data, validate_data, losses,
+               ways=3, shots=5, queries=5, episodes=1000,
+               label=None, validate_label=None,
+               index_path=None, validate_index_path=None,
                **kwargs):
+    self.ways = ways
+    self.shots = shots
+    self.queries = queries
+    self.episodes = episodes
+    prefix = f"{kwargs.get('path_prefix', '.')}/{kwargs.get('network_name', 'network')}"
+    train_data.data_mode = type(train_data.data_mode)(1)
+    self.index = LabelIndex.build(
+      train_data, label=label,
+      path=index_path or f"{prefix}-train-labels.pt"
+    )
+    self.validate_index = LabelIndex.build(
+      validate_data, label=validate_label,
+      path=validate_index_path or f"{prefix}-valid-labels.pt"
+    )
     super(FewShotTraining, self).__init__(
       net, train_data, validate_data, losses,
       **kwargs
     )
 
-    support_data = copy(train_data)
-    train_data.data_mode = type(train_data.data_mode)(1)
-    support_data = SupportData(train_data, shots=5)
-    validate_support_data = SupportData(validate_data, shots=5)
-    self.support_loader = iter(DataLoader(support_data))
-    self.valid_support_loader = iter(DataLoader(validate_support_data))
-
-  def run_networks(self, data, support, support_label):
-    predictions = self.net(data, support)
-    return list(zip(predictions, support_label))
-
-  def step(self, inputs):
-    data, label = inputs
-    self.optimizer.zero_grad()
-
-    permutation = [0, 1, 2]
-    random.shuffle(permutation)
-
-    support, support_label = next(self.support_loader)
-
-    lv = label[0].reshape(-1)
-    for idx, val in enumerate(lv):
-      lv[idx] = permutation[int(val[0])]
-    lv = support_label.reshape(-1)
-    for idx, val in enumerate(lv):
-      lv[idx] = permutation[int(val[0])]
-
-    support = support[0].to(self.device)
-    support_label = support_label[0].to(self.device)
-    outputs = self.run_networks(data, support, support_label)
+  def batch_sampler_for(self, data):
+    return EpisodeSampler(
+      self.index, self.ways, self.shots, self.queries,
+      episodes=self.episodes
+    )
 
-    loss_val = self.loss(outputs)
-    loss_val.backward()
-    self.optimizer.step()
-    self.each_step()  
+  def validate_batch_sampler_for(self, data):
+    return EpisodeSampler(
+      self.validate_index, self.ways, self.shots, self.queries,
+      episodes=self.episodes
+    )
 
-  def validate(self, data):
-    with torch.no_grad():
-      self.net.eval()
-      inputs, *label = data
-      inputs, label = inputs.to(self.device), list(map(lambda x: x.to(self.device), label))
-      support, support_label = next(self.valid_support_loader)
-      support = support[0].to(self.device)
-      support_label = support_label[0].to(self.device)
-      outputs = self.run_networks(inputs, support, support_label)
-      self.valid_loss(outputs)
-      self.each_validate()
-      self.valid_callback(self, to_device(inputs, "cpu"), to_device(outputs, "cpu"))
-      self.net.train()
+  def run_networks(self, data):
+    inputs, *_ = data
+    support, _, query, query_labels = split_episode(
+      inputs, self.ways, self.shots, self.queries
+    )
+    predictions = self.net(query, support)
+    if not isinstance(predictions, (list, tuple)):
+      predictions = [predictions]
+    return [(prediction, query_labels) for prediction in predictions]
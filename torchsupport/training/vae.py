@@ -179,7 +179,7 @@ class AbstractVAETraining(Training):
       self.train_data = None
       self.train_data = DataLoader(
         self.data, batch_size=self.batch_size, num_workers=8,
-        shuffle=True
+        shuffle=True, batch_sampler=self.batch_sampler_for(self.data)
       )
       for data in self.train_data:
         self.step(data)
@@ -891,7 +891,7 @@ class LaggingInference(ABC):
       self.train_data = None
       self.train_data = DataLoader(
         self.data, batch_size=self.batch_size, num_workers=8,
-        shuffle=True
+        shuffle=True, batch_sampler=self.batch_sampler_for(self.data)
       )
       for data in self.train_data:
         if aggressive: